@@ -0,0 +1,235 @@
+"""
+Conversion server benchmark
+
+Types the words of the phonetic trace prefix by prefix, as the engine looks
+them up key by key, and compares per-key lookup latency in-process with the
+same lookups answered by the conversion server over its Unix socket. The
+server runs in a forked child, so client and server do not share an
+interpreter lock.
+
+Three comparisons are made: the dictionary matches alone, the full
+conversion including ranking, and the 26 next-letter lookups of each
+preedit sent as one batched frame against one frame each.
+"""
+
+import getopt
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import socket
+import string
+import sys
+import tempfile
+import time
+
+import fake_ibus
+fake_ibus.install()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synthetic
+from bench_engine import TRACE_DIR, load_trace, percentile
+from conversion import ConversionRequest, Converter
+from conversion_client import ConversionClient, RemoteDictionary
+from conversion_server import ConversionServer, load_directory
+from romanization import normalize
+
+DEFAULT_SIZE = 100000
+DEFAULT_REPEAT = 5
+STARTUP_TIMEOUT = 120.0
+
+logger = logging.getLogger('thaime.bench')
+
+## ========================================================================== ##
+## SERVER
+## ========================================================================== ##
+
+def serve(path, directory):
+    """Child process: serve until terminated"""
+    server = ConversionServer(path, directory)
+    server.serve_forever()
+
+
+def start_server(path, directory):
+    process = multiprocessing.get_context('fork').Process(target=serve, args=(path, directory), daemon=True)
+    process.start()
+    deadline = time.perf_counter() + STARTUP_TIMEOUT
+    # The server listens once the dictionary is loaded
+    while True:
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            break
+        except OSError:
+            if time.perf_counter() > deadline or not process.is_alive():
+                process.terminate()
+                raise RuntimeError("Conversion server did not start")
+            time.sleep(0.05)
+        finally:
+            probe.close()
+    return process, ConversionClient(path, timeout_ms=10000)
+
+## ========================================================================== ##
+## MEASUREMENTS
+## ========================================================================== ##
+
+def key_texts(words):
+    """The canonical preedit after each key of each word"""
+    return [normalize(word[:end]) for word in words for end in range(1, len(word) + 1)]
+
+
+def time_each(function, items, repeat):
+    """Per-item latencies of ``function(item)`` in ns, over ``repeat`` passes"""
+    latencies = []
+    for _ in range(repeat):
+        for item in items:
+            start = time.perf_counter_ns()
+            function(item)
+            latencies.append(time.perf_counter_ns() - start)
+    return latencies
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {
+        'calls': len(latencies),
+        'p50_us': percentile(latencies, 0.50) / 1000,
+        'p99_us': percentile(latencies, 0.99) / 1000,
+        'mean_us': sum(latencies) / len(latencies) / 1000 if latencies else 0.0,
+    }
+
+
+def conversion(dictionary):
+    """Full conversion of a text, ranking included, without the candidate cache"""
+    def convert(text):
+        converter = Converter(1)
+        request = ConversionRequest(
+            generation=0, text=text, context=(), dictionary=dictionary,
+            language_model=None, page_size=5,
+        )
+        converter.convert(request)
+    return convert
+
+
+def run(size, repeat, seed, workdir):
+    _, _, _, words = load_trace(os.path.join(TRACE_DIR, 'phonetic.trace'))
+    directory = os.path.join(workdir, 'dictionary')
+    logger.info(f"Writing a {size}-key dictionary")
+    entries = synthetic.generate_entries(size, seed=seed, extra_keys=words)
+    synthetic.write_dictionary(entries, directory, 'bin')
+    texts = key_texts(words)
+
+    local = load_directory(directory)
+    path = os.path.join(workdir, 'run', 'conversion.sock')
+    process, client = start_server(path, directory)
+    try:
+        remote = RemoteDictionary.connect(client, directory, lambda: local)
+        converter = Converter(1)
+
+        # Both sides answer the same texts
+        for text in texts:
+            if remote.lookup(text) != converter.matches(local, text):
+                raise RuntimeError(f"Server and in-process matches differ for '{text}'")
+
+        logger.info(f"Timing {len(texts)} keys, {repeat} passes")
+        results = {
+            'matches_in_process': summarize(time_each(lambda text: converter.matches(local, text), texts, repeat)),
+            'matches_server': summarize(time_each(remote.lookup, texts, repeat)),
+            'convert_in_process': summarize(time_each(conversion(local), texts, repeat)),
+            'convert_server': summarize(time_each(conversion(remote), texts, repeat)),
+        }
+        next_letters = [[text + letter for letter in string.ascii_lowercase] for text in texts[:200]]
+        results['next_letters_batched'] = summarize(time_each(remote.lookup_many, next_letters, repeat))
+        results['next_letters_one_by_one'] = summarize(time_each(
+            lambda batch: [remote.lookup(text) for text in batch], next_letters, repeat
+        ))
+    finally:
+        client.close()
+        process.terminate()
+        process.join()
+
+    return {
+        'benchmark': 'conversion_server',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'size': size,
+        'keys': len(texts),
+        'repeat': repeat,
+        'seed': seed,
+        'results': results,
+    }
+
+
+def print_summary(report, out):
+    print(f"{report['keys']} keys over a {report['size']}-key dictionary, {report['repeat']} passes", file=out)
+    print(f"{'':>24} {'calls':>7} {'p50 us':>8} {'p99 us':>8} {'mean us':>8}", file=out)
+    for name, row in report['results'].items():
+        print(f"{name:>24} {row['calls']:>7} {row['p50_us']:>8.1f} {row['p99_us']:>8.1f} "
+              f"{row['mean_us']:>8.1f}", file=out)
+
+## ========================================================================== ##
+## COMMAND LINE
+## ========================================================================== ##
+
+def print_help(out, v=0):
+    print("Usage: bench_conversion_server.py [options]", file=out)
+    print("-s, --size N           synthetic dictionary size (default 100000).", file=out)
+    print("-r, --repeat N         passes over the trace (default 5).", file=out)
+    print("-o, --output FILE      write the JSON report to FILE instead of stdout.", file=out)
+    print("    --seed N           random seed for the dictionary.", file=out)
+    print("-v, --verbose          log progress and server messages.", file=out)
+    print("-h, --help             show this message.", file=out)
+    sys.exit(v)
+
+def main():
+    size = DEFAULT_SIZE
+    repeat = DEFAULT_REPEAT
+    output = None
+    seed = 0
+    verbose = False
+
+    shortopt = "s:r:o:vh"
+    longopt = ["size=", "repeat=", "output=", "seed=", "verbose", "help"]
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], shortopt, longopt)
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        print_help(sys.stderr, 1)
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print_help(sys.stdout)
+        elif o in ("-s", "--size"):
+            size = int(a)
+        elif o in ("-r", "--repeat"):
+            repeat = int(a)
+        elif o in ("-o", "--output"):
+            output = a
+        elif o == "--seed":
+            seed = int(a)
+        elif o in ("-v", "--verbose"):
+            verbose = True
+
+    logging.basicConfig(
+        level=logging.INFO if verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if not verbose:
+        logging.getLogger('thaime').setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory(prefix='thaime-bench-') as workdir:
+        report = run(size, repeat, seed, workdir)
+    print_summary(report, sys.stderr)
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Dictionary build benchmark
+
+Builds ``trie.json`` from a synthetic word-segmented corpus with
+``dictionary_builder.py`` at increasing job counts and reports the build
+time and speedup of each. Then times the rebuilds that reuse the build
+cache: one with nothing changed, and one after a line is appended to a
+single corpus file.
+
+The corpus words are Thai-spelled syllable strings drawn from a Zipf
+curve, so counting, romanizing and merging all do realistic work.
+"""
+
+import getopt
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dictionary_builder import build_dictionary
+from romanization import romanize
+
+DEFAULT_SIZE_MB = 64
+DEFAULT_FILES = 16
+DEFAULT_VOCABULARY = 50000
+POOL_LINES = 20000
+
+INITIALS = 'กขคงจชซดตถทนบปผพฟมยรลวสหอ'
+SYLLABLE_VOWELS = ('', 'า', 'ิ', 'ี', 'ุ', 'ู')
+FINALS = ('', '', 'ก', 'ง', 'น', 'ม', 'ด', 'บ')
+
+logger = logging.getLogger('thaime.bench')
+
+## ========================================================================== ##
+## INPUT
+## ========================================================================== ##
+
+def thai_word(rng):
+    """A word of one to three syllables that romanize() can spell"""
+    while True:
+        syllables = []
+        for _ in range(rng.randint(1, 3)):
+            vowel = rng.choice(SYLLABLE_VOWELS)
+            # A bare consonant needs a final to read as a closed 'o' syllable
+            final = rng.choice(FINALS[2:] if not vowel else FINALS)
+            syllables.append(rng.choice(INITIALS) + vowel + final)
+        word = ''.join(syllables)
+        if romanize(word) is not None:
+            return word
+
+
+def line_pool(vocabulary, count, seed):
+    """Space-separated lines of words drawn from a Zipf curve over a random vocabulary"""
+    rng = random.Random(seed)
+    words = list({thai_word(rng) for _ in range(vocabulary)})
+    rng.shuffle(words)
+    cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(words) + 1)))
+    return [' '.join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(5, 20)))
+            for _ in range(count)]
+
+
+def write_corpus(directory, pool, size, files, seed):
+    """Write ``files`` corpus files of about ``size`` bytes in total; return their paths"""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for number in range(files):
+        path = os.path.join(directory, f"part{number:03d}.txt")
+        written = 0
+        with open(path, 'w', encoding='utf-8') as f:
+            while written < size // files:
+                for line in rng.sample(pool, len(pool)):
+                    f.write(line + '\n')
+                    written += len(line.encode('utf-8')) + 1
+                    if written >= size // files:
+                        break
+        paths.append(path)
+    return paths
+
+## ========================================================================== ##
+## MEASUREMENTS
+## ========================================================================== ##
+
+def timed_build(corpus_dir, output_path, cache_dir, jobs):
+    start = time.perf_counter()
+    stats = build_dictionary([corpus_dir], output_path, jobs=jobs, cache_dir=cache_dir)
+    stats['wall_s'] = time.perf_counter() - start
+    return stats
+
+
+def run(size, files, vocabulary, job_counts, seed, workdir):
+    corpus_dir = os.path.join(workdir, 'corpus')
+    output_path = os.path.join(workdir, 'trie.json')
+    cache_dir = os.path.join(workdir, 'cache')
+    logger.info(f"Writing {size / 1e6:.0f} MB of synthetic corpus in {files} files")
+    paths = write_corpus(corpus_dir, line_pool(vocabulary, POOL_LINES, seed), size, files, seed)
+    corpus_bytes = sum(os.path.getsize(path) for path in paths)
+
+    full_builds = {}
+    for jobs in job_counts:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        logger.info(f"Full build with {jobs} jobs")
+        stats = timed_build(corpus_dir, output_path, cache_dir, jobs)
+        stats['mb_per_s'] = corpus_bytes / 1e6 / stats['wall_s']
+        stats['speedup'] = full_builds[job_counts[0]]['wall_s'] / stats['wall_s'] if full_builds else 1.0
+        full_builds[jobs] = stats
+
+    jobs = job_counts[-1]
+    logger.info("Rebuild with nothing changed")
+    unchanged = timed_build(corpus_dir, output_path, cache_dir, jobs)
+    with open(paths[0], 'a', encoding='utf-8') as f:
+        f.write(thai_word(random.Random(seed)) + '\n')
+    logger.info(f"Rebuild after changing {paths[0]}")
+    incremental = timed_build(corpus_dir, output_path, cache_dir, jobs)
+
+    return {
+        'benchmark': 'dictionary_build',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'corpus_bytes': corpus_bytes,
+        'files': files,
+        'vocabulary': vocabulary,
+        'seed': seed,
+        'full_builds': {str(jobs): stats for jobs, stats in full_builds.items()},
+        'rebuild_jobs': jobs,
+        'unchanged_rebuild': unchanged,
+        'incremental_rebuild': incremental,
+    }
+
+
+def print_summary(report, out):
+    print(f"corpus {report['corpus_bytes'] / 1e6:.0f} MB in {report['files']} files, "
+          f"{report['cpus']} CPUs", file=out)
+    print(f"{'jobs':>6} {'shards':>7} {'count s':>8} {'merge s':>8} {'total s':>8} {'MB/s':>7} "
+          f"{'speedup':>8}", file=out)
+    for jobs, row in report['full_builds'].items():
+        print(f"{jobs:>6} {row['counted']:>7} {row['count_s']:>8.2f} {row['merge_s']:>8.2f} "
+              f"{row['wall_s']:>8.2f} {row['mb_per_s']:>7.1f} {row['speedup']:>8.2f}", file=out)
+    for name in ('unchanged_rebuild', 'incremental_rebuild'):
+        row = report[name]
+        print(f"{name} with {report['rebuild_jobs']} jobs: {row['wall_s']:.2f} s, "
+              f"{row['counted']} of {row['shards']} shards counted", file=out)
+
+## ========================================================================== ##
+## COMMAND LINE
+## ========================================================================== ##
+
+def print_help(out, v=0):
+    print("Usage: bench_dictionary_build.py [options]", file=out)
+    print("-s, --size MB          synthetic corpus size in MB (default 64).", file=out)
+    print("-f, --files N          number of corpus files (default 16).", file=out)
+    print("-w, --words N          vocabulary size (default 50000).", file=out)
+    print("-j, --jobs N,N,...     job counts to build with (default 1, 2, 4... up to the CPUs).", file=out)
+    print("-o, --output FILE      write the JSON report to FILE instead of stdout.", file=out)
+    print("    --seed N           random seed for the corpus.", file=out)
+    print("-v, --verbose          log progress.", file=out)
+    print("-h, --help             show this message.", file=out)
+    sys.exit(v)
+
+def default_job_counts():
+    cpus = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 < cpus:
+        counts.append(counts[-1] * 2)
+    if cpus > 1:
+        counts.append(cpus)
+    return counts
+
+def main():
+    size = DEFAULT_SIZE_MB * 1000000
+    files = DEFAULT_FILES
+    vocabulary = DEFAULT_VOCABULARY
+    job_counts = default_job_counts()
+    output = None
+    seed = 0
+    verbose = False
+
+    shortopt = "s:f:w:j:o:vh"
+    longopt = ["size=", "files=", "words=", "jobs=", "output=", "seed=", "verbose", "help"]
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], shortopt, longopt)
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        print_help(sys.stderr, 1)
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print_help(sys.stdout)
+        elif o in ("-s", "--size"):
+            size = int(float(a) * 1000000)
+        elif o in ("-f", "--files"):
+            files = int(a)
+        elif o in ("-w", "--words"):
+            vocabulary = int(a)
+        elif o in ("-j", "--jobs"):
+            job_counts = [int(jobs) for jobs in a.split(',')]
+        elif o in ("-o", "--output"):
+            output = a
+        elif o == "--seed":
+            seed = int(a)
+        elif o in ("-v", "--verbose"):
+            verbose = True
+
+    logging.basicConfig(
+        level=logging.INFO if verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if not verbose:
+        logging.getLogger('thaime').setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory(prefix='thaime-bench-') as workdir:
+        report = run(size, files, vocabulary, job_counts, seed, workdir)
+    print_summary(report, sys.stderr)
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""
+Headless Engine benchmark
+
+Replays recorded keystroke traces against ``engine.Engine`` running on the
+in-process IBus stand-in, over synthetic dictionaries of several sizes and
+both dictionary backends. Reports per-key latency percentiles, IBus calls
+and GObject allocations per key, Python heap blocks per key, engine
+construction time and dictionary load time, as JSON.
+
+Each key is timed from ``do_process_key_event`` until the fake main loop
+has drained, so deferred renders are charged to the key that queued them.
+"""
+
+import getopt
+import glob
+import json
+import logging
+import os
+import platform
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+import fake_ibus
+fake_ibus.install()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import engine
+import synthetic
+from dictionary import load_dictionary
+from fake_ibus import KEYVALS, MAIN_LOOP, RECORDER
+from gi.repository import IBus
+
+TRACE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'traces')
+DEFAULT_SIZES = (1000, 10000, 100000)
+BACKENDS = ('bin', 'json')
+MODES = {'latin': 0, 'kedmanee': 1, 'phonetic': 2}
+TOKEN = re.compile(r'<[^>]+>|.')
+
+logger = logging.getLogger('thaime.bench')
+
+## ========================================================================== ##
+## TRACES
+## ========================================================================== ##
+
+def load_trace(path):
+    """
+    Parse a trace file.
+
+    Lines starting with ``#`` are comments, ``mode NAME`` selects the input
+    mode, and every other line is typed key by key. ``<Name>`` stands for
+    the IBus key symbol ``KEY_Name``; any other character is its own key.
+
+    Returns:
+        tuple: (name, mode, list of (keyval, state), list of typed words)
+    """
+    mode = None
+    keys = []
+    words = []
+    word = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('mode '):
+                mode = line.split(None, 1)[1].strip()
+                continue
+            for token in TOKEN.findall(line):
+                if len(token) > 1:
+                    keys.append((KEYVALS[token[1:-1]], 0))
+                else:
+                    state = IBus.ModifierType.SHIFT_MASK if token.isupper() else 0
+                    keys.append((ord(token), state))
+
+                # Track the words as finally typed, after BackSpace edits
+                if 'a' <= token <= 'z':
+                    word.append(token)
+                elif token == '<BackSpace>' and word:
+                    word.pop()
+                elif word:
+                    words.append(''.join(word))
+                    word.clear()
+            if word:
+                words.append(''.join(word))
+                word.clear()
+
+    if mode not in MODES:
+        raise ValueError(f"Trace {path} has no valid 'mode' line")
+    name = os.path.splitext(os.path.basename(path))[0]
+    return name, mode, keys, words
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, max(0, int(round(fraction * len(samples) + 0.5)) - 1))
+    return samples[index]
+
+## ========================================================================== ##
+## MEASUREMENTS
+## ========================================================================== ##
+
+def wait_until_ready(new_engine, timeout=120.0):
+    """Drain the fake main loop until the engine's dictionary is loaded"""
+    deadline = time.perf_counter() + timeout
+    while not new_engine.dictionary_ready:
+        if not MAIN_LOOP.drain():
+            time.sleep(0.0005)
+        if time.perf_counter() > deadline:
+            raise RuntimeError("Dictionary did not load in time")
+
+
+def measure_dictionary_load(path, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        dictionary = load_dictionary(path)
+        timings.append((time.perf_counter() - start) * 1000)
+        dictionary.close()
+    return statistics.median(timings)
+
+
+def measure_engine_construction(directory, repeat):
+    """Time engine creation with a cold and with an already shared dictionary"""
+    engine.DICTIONARY_DIR = directory
+    bus = IBus.Bus()
+
+    start = time.perf_counter()
+    first = engine.Engine(bus, "/org/freedesktop/IBus/Thaime/Bench/0")
+    construction_ms = (time.perf_counter() - start) * 1000
+    wait_until_ready(first)
+    ready_ms = (time.perf_counter() - start) * 1000
+
+    warm = []
+    for index in range(repeat):
+        start = time.perf_counter()
+        other = engine.Engine(bus, f"/org/freedesktop/IBus/Thaime/Bench/{index + 1}")
+        warm.append((time.perf_counter() - start) * 1000)
+        other.do_destroy()
+
+    return first, {
+        'engine_construction_ms': construction_ms,
+        'engine_ready_ms': ready_ms,
+        'engine_construction_warm_ms': statistics.median(warm) if warm else 0.0,
+    }
+
+
+def replay(bench_engine, mode, keys, repeat, interval=0.0):
+    """Replay ``keys`` ``repeat`` times, ``interval`` seconds apart, and return per-key statistics"""
+    bench_engine.set_mode(MODES[mode])
+    bench_engine.do_reset()
+    MAIN_LOOP.drain()
+    RECORDER.keep_commits = False
+
+    # Timing pass
+    latencies = []
+    RECORDER.reset()
+    for _ in range(repeat):
+        for keyval, state in keys:
+            if interval:
+                # Typing pace; conversions finish in the pause and are shown by the next drain
+                time.sleep(interval)
+            start = time.perf_counter_ns()
+            bench_engine.do_process_key_event(keyval, 0, state)
+            MAIN_LOOP.drain()
+            latencies.append(time.perf_counter_ns() - start)
+        bench_engine.do_reset()
+        MAIN_LOOP.drain()
+    total_keys = len(keys) * repeat
+    calls = RECORDER.total_calls()
+    objects = RECORDER.total_objects()
+
+    # Allocation pass, kept apart so counting does not skew the timings
+    blocks = []
+    for keyval, state in keys:
+        before = sys.getallocatedblocks()
+        bench_engine.do_process_key_event(keyval, 0, state)
+        MAIN_LOOP.drain()
+        blocks.append(sys.getallocatedblocks() - before)
+    bench_engine.do_reset()
+    MAIN_LOOP.drain()
+
+    latencies.sort()
+    return {
+        'keys': total_keys,
+        'p50_us': percentile(latencies, 0.50) / 1000,
+        'p95_us': percentile(latencies, 0.95) / 1000,
+        'p99_us': percentile(latencies, 0.99) / 1000,
+        'max_us': latencies[-1] / 1000 if latencies else 0.0,
+        'mean_us': statistics.fmean(latencies) / 1000 if latencies else 0.0,
+        'ibus_calls_per_key': calls / total_keys if total_keys else 0.0,
+        'ibus_objects_per_key': objects / total_keys if total_keys else 0.0,
+        'heap_blocks_per_key': statistics.fmean(blocks) if blocks else 0.0,
+    }
+
+
+def run(sizes, repeat, trace_paths, seed, interval=0.0):
+    traces = [load_trace(path) for path in trace_paths]
+    trace_words = {word for _, mode, _, words in traces if mode == 'phonetic' for word in words}
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='thaime-bench-') as workdir:
+        for size in sizes:
+            entries = synthetic.generate_entries(size, seed=seed, extra_keys=trace_words)
+            for backend in BACKENDS:
+                directory = os.path.join(workdir, f"{size}-{backend}")
+                path = synthetic.write_dictionary(entries, directory, backend)
+                logger.info(f"Benchmarking {size} keys, {backend} backend")
+
+                result = {
+                    'size': size,
+                    'backend': backend,
+                    'file_bytes': os.path.getsize(path),
+                    'dictionary_load_ms': measure_dictionary_load(path, 3),
+                }
+                bench_engine, construction = measure_engine_construction(directory, 5)
+                result.update(construction)
+                result['traces'] = {
+                    name: replay(bench_engine, mode, keys, repeat, interval)
+                    for name, mode, keys, _ in traces
+                }
+                bench_engine.do_destroy()
+                results.append(result)
+
+    return {
+        'benchmark': 'engine',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'interval_ms': interval * 1000,
+        'seed': seed,
+        'results': results,
+    }
+
+
+def print_summary(report, out):
+    print(f"{'size':>8} {'backend':>7} {'load ms':>9} {'ready ms':>9} {'trace':>10} "
+          f"{'p50 us':>8} {'p95 us':>8} {'p99 us':>8} {'calls/key':>9} {'objs/key':>8}", file=out)
+    for result in report['results']:
+        for name, trace in result['traces'].items():
+            print(f"{result['size']:>8} {result['backend']:>7} {result['dictionary_load_ms']:>9.2f} "
+                  f"{result['engine_ready_ms']:>9.2f} {name:>10} {trace['p50_us']:>8.1f} "
+                  f"{trace['p95_us']:>8.1f} {trace['p99_us']:>8.1f} "
+                  f"{trace['ibus_calls_per_key']:>9.2f} {trace['ibus_objects_per_key']:>8.2f}", file=out)
+
+## ========================================================================== ##
+## COMMAND LINE
+## ========================================================================== ##
+
+def print_help(out, v=0):
+    print("Usage: bench_engine.py [options]", file=out)
+    print("-s, --sizes N,N,...    synthetic dictionary sizes (default 1000,10000,100000).", file=out)
+    print("-r, --repeat N         replays of each trace (default 20).", file=out)
+    print("-t, --trace FILE       trace to replay, repeatable (default traces/*.trace).", file=out)
+    print("-i, --interval MS      pause between keys, as a typist would (default 0).", file=out)
+    print("-o, --output FILE      write the JSON report to FILE instead of stdout.", file=out)
+    print("    --seed N           random seed for the synthetic dictionaries.", file=out)
+    print("-v, --verbose          log progress and engine messages.", file=out)
+    print("-h, --help             show this message.", file=out)
+    sys.exit(v)
+
+def main():
+    sizes = DEFAULT_SIZES
+    repeat = 20
+    trace_paths = []
+    interval = 0.0
+    output = None
+    seed = 0
+    verbose = False
+
+    shortopt = "s:r:t:i:o:vh"
+    longopt = ["sizes=", "repeat=", "trace=", "interval=", "output=", "seed=", "verbose", "help"]
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], shortopt, longopt)
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        print_help(sys.stderr, 1)
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print_help(sys.stdout)
+        elif o in ("-s", "--sizes"):
+            sizes = tuple(int(size) for size in a.split(','))
+        elif o in ("-r", "--repeat"):
+            repeat = int(a)
+        elif o in ("-t", "--trace"):
+            trace_paths.append(a)
+        elif o in ("-i", "--interval"):
+            interval = float(a) / 1000
+        elif o in ("-o", "--output"):
+            output = a
+        elif o == "--seed":
+            seed = int(a)
+        elif o in ("-v", "--verbose"):
+            verbose = True
+
+    logging.basicConfig(
+        level=logging.INFO if verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if not verbose:
+        # Messages the engine formats eagerly are still paid for, just not printed
+        logging.getLogger('thaime').setLevel(logging.WARNING)
+
+    trace_paths = trace_paths or sorted(glob.glob(os.path.join(TRACE_DIR, '*.trace')))
+    report = run(sizes, repeat, trace_paths, seed, interval)
+    print_summary(report, sys.stderr)
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Engine pool benchmark
+
+Creates engines through the factory the way ibus-daemon does, once with the
+pool of pre-constructed engines disabled and once enabled, and compares how
+long ``do_create_engine`` takes to hand an engine back.
+
+Three situations are timed for each: the first engine of a freshly started
+process after a short idle pause, engines created one at a time with the
+main loop idle in between (a user switching between windows), and a burst
+of creations with no idle time between them, which empties the pool.
+"""
+
+import getopt
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import fake_ibus
+fake_ibus.install()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import engine
+import factory
+import synthetic
+from bench_engine import TRACE_DIR, load_trace, percentile, wait_until_ready
+from fake_ibus import MAIN_LOOP
+from gi.repository import IBus
+from instrumentation import STATS
+from registry import DICTIONARIES
+
+DEFAULT_SIZE = 100000
+DEFAULT_REPEAT = 50
+DEFAULT_BURST = 4
+DEFAULT_STARTUP_MS = 200
+IDLE_MS = 20
+
+logger = logging.getLogger('thaime.bench')
+
+## ========================================================================== ##
+## MEASUREMENTS
+## ========================================================================== ##
+
+def pause(seconds):
+    """Let the main loop run its idle sources for ``seconds``"""
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        if not MAIN_LOOP.drain():
+            time.sleep(0.0002)
+
+
+def timed_create(engine_factory):
+    start = time.perf_counter_ns()
+    new_engine = engine_factory.do_create_engine("thaime")
+    return new_engine, time.perf_counter_ns() - start
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {
+        'calls': len(latencies),
+        'p50_ms': percentile(latencies, 0.50) / 1e6,
+        'p99_ms': percentile(latencies, 0.99) / 1e6,
+        'max_ms': latencies[-1] / 1e6 if latencies else 0.0,
+    }
+
+
+def measure(pool_size, repeat, burst, startup):
+    """Creation latencies of one factory; the dictionary is cold when it starts"""
+    STATS.reset()
+    engine_factory = factory.EngineFactory(IBus.Bus(), pool_size)
+
+    # The process has just started; IBus asks for the first engine shortly after
+    pause(startup)
+    first, first_ns = timed_create(engine_factory)
+    start = time.perf_counter()
+    wait_until_ready(first)
+    first_ready_ms = first_ns / 1e6 + (time.perf_counter() - start) * 1000
+
+    steady = []
+    for _ in range(repeat):
+        pause(IDLE_MS / 1000)
+        new_engine, ns = timed_create(engine_factory)
+        steady.append(ns)
+        new_engine.destroy()
+
+    pause(IDLE_MS / 1000)
+    burst_latencies = []
+    engines = []
+    for _ in range(burst):
+        new_engine, ns = timed_create(engine_factory)
+        burst_latencies.append(ns)
+        engines.append(new_engine)
+
+    for new_engine in [first] + engines:
+        new_engine.destroy()
+    engine_factory.destroy()
+    MAIN_LOOP.drain()
+    if any(DICTIONARIES.share_counts().values()):
+        raise RuntimeError(f"Engines left holding dictionaries: {DICTIONARIES.share_counts()}")
+
+    return {
+        'pool_size': pool_size,
+        'first_create_ms': first_ns / 1e6,
+        'first_ready_ms': first_ready_ms,
+        'steady': summarize(steady),
+        'burst': summarize(burst_latencies),
+        'counters': {name: STATS.counters[name] for name in
+                     ('engine_pool_hits', 'engine_pool_misses', 'engine_pool_filled')},
+    }
+
+
+def run(size, repeat, burst, pool_size, startup, seed, workdir):
+    _, _, _, words = load_trace(os.path.join(TRACE_DIR, 'phonetic.trace'))
+    directory = os.path.join(workdir, 'dictionary')
+    logger.info(f"Writing a {size}-key dictionary")
+    entries = synthetic.generate_entries(size, seed=seed, extra_keys=words)
+    synthetic.write_dictionary(entries, directory, 'bin')
+    engine.DICTIONARY_DIR = directory
+
+    logger.info("Creating engines without a pool")
+    without = measure(0, repeat, burst, startup)
+    logger.info(f"Creating engines with a pool of {pool_size}")
+    with_pool = measure(pool_size, repeat, burst, startup)
+
+    return {
+        'benchmark': 'engine_pool',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'size': size,
+        'repeat': repeat,
+        'burst': burst,
+        'startup_ms': startup * 1000,
+        'seed': seed,
+        'without_pool': without,
+        'with_pool': with_pool,
+    }
+
+
+def print_summary(report, out):
+    print(f"{report['repeat']} engines one at a time, bursts of {report['burst']}, "
+          f"first engine {report['startup_ms']:.0f} ms after startup", file=out)
+    print(f"{'':>13} {'pool':>5} {'first ms':>9} {'ready ms':>9} {'p50 ms':>7} {'p99 ms':>7} "
+          f"{'burst p50':>10} {'burst max':>10}", file=out)
+    for name in ('without_pool', 'with_pool'):
+        row = report[name]
+        print(f"{name:>13} {row['pool_size']:>5} {row['first_create_ms']:>9.2f} {row['first_ready_ms']:>9.2f} "
+              f"{row['steady']['p50_ms']:>7.2f} {row['steady']['p99_ms']:>7.2f} "
+              f"{row['burst']['p50_ms']:>10.2f} {row['burst']['max_ms']:>10.2f}", file=out)
+    counters = report['with_pool']['counters']
+    print(f"pool: {counters['engine_pool_hits']} hits, {counters['engine_pool_misses']} misses, "
+          f"{counters['engine_pool_filled']} engines built ahead", file=out)
+
+## ========================================================================== ##
+## COMMAND LINE
+## ========================================================================== ##
+
+def print_help(out, v=0):
+    print("Usage: bench_engine_pool.py [options]", file=out)
+    print("-s, --size N           synthetic dictionary size (default 100000).", file=out)
+    print("-r, --repeat N         engines created one at a time (default 50).", file=out)
+    print("-b, --burst N          engines created back to back (default 4).", file=out)
+    print("-p, --pool N           pool size to compare against none (default THAIME_ENGINE_POOL or 2).", file=out)
+    print("    --startup MS       idle time before the first engine is created (default 200).", file=out)
+    print("-o, --output FILE      write the JSON report to FILE instead of stdout.", file=out)
+    print("    --seed N           random seed for the dictionary.", file=out)
+    print("-v, --verbose          log progress and engine messages.", file=out)
+    print("-h, --help             show this message.", file=out)
+    sys.exit(v)
+
+def main():
+    size = DEFAULT_SIZE
+    repeat = DEFAULT_REPEAT
+    burst = DEFAULT_BURST
+    pool_size = factory.ENGINE_POOL_SIZE or 2
+    startup = DEFAULT_STARTUP_MS / 1000
+    output = None
+    seed = 0
+    verbose = False
+
+    shortopt = "s:r:b:p:o:vh"
+    longopt = ["size=", "repeat=", "burst=", "pool=", "startup=", "output=", "seed=", "verbose", "help"]
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], shortopt, longopt)
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        print_help(sys.stderr, 1)
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print_help(sys.stdout)
+        elif o in ("-s", "--size"):
+            size = int(a)
+        elif o in ("-r", "--repeat"):
+            repeat = int(a)
+        elif o in ("-b", "--burst"):
+            burst = int(a)
+        elif o in ("-p", "--pool"):
+            pool_size = int(a)
+        elif o == "--startup":
+            startup = float(a) / 1000
+        elif o in ("-o", "--output"):
+            output = a
+        elif o == "--seed":
+            seed = int(a)
+        elif o in ("-v", "--verbose"):
+            verbose = True
+
+    logging.basicConfig(
+        level=logging.INFO if verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if not verbose:
+        logging.getLogger('thaime').setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory(prefix='thaime-bench-') as workdir:
+        report = run(size, repeat, burst, pool_size, startup, seed, workdir)
+    print_summary(report, sys.stderr)
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Fuzzy lookup benchmark
+
+Misspells random dictionary keys with one or two edits (never in the first
+letter, which the search keeps fixed) and looks them up with
+``fuzzy.fuzzy_candidates`` under the engine's time budget. Reports latency
+percentiles, how often the budget cut a lookup short, trie nodes visited,
+and recall: how often the intended key's best word came back. A plain
+Levenshtein scan over every key is timed on a few queries for comparison.
+"""
+
+import getopt
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synthetic
+from bench_engine import percentile
+from dictionary import Dictionary
+from fuzzy import DEFAULT_BUDGET_NS, fuzzy_candidates
+
+DEFAULT_SIZES = (10000, 100000)
+DEFAULT_QUERIES = 500
+SCAN_QUERIES = 10
+LIMIT = 5
+
+logger = logging.getLogger('thaime.bench')
+
+## ========================================================================== ##
+## MEASUREMENTS
+## ========================================================================== ##
+
+def misspell(rng, key, edits):
+    """Apply ``edits`` random substitutions, insertions or deletions after the first letter"""
+    chars = list(key)
+    for _ in range(edits):
+        position = rng.randrange(1, len(chars) + 1)
+        operation = rng.choice(('substitute', 'insert', 'delete'))
+        if operation == 'insert' or position == len(chars):
+            chars.insert(position, rng.choice(string.ascii_lowercase))
+        elif operation == 'delete' and len(chars) > 2:
+            del chars[position]
+        else:
+            chars[position] = rng.choice(string.ascii_lowercase.replace(chars[position], ''))
+    return ''.join(chars)
+
+
+def levenshtein(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        current = [i]
+        for j, cb in enumerate(b, start=1):
+            current.append(min(current[j - 1] + 1, previous[j] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def measure(dictionary, queries, budget_ns):
+    latencies = []
+    visited = []
+    cut_short = 0
+    found = 0
+    for typed, intended in queries:
+        start = time.perf_counter_ns()
+        candidates, searches = fuzzy_candidates(dictionary, typed, LIMIT, budget_ns)
+        latencies.append(time.perf_counter_ns() - start)
+        visited.append(sum(search.visited for search in searches))
+        cut_short += not all(search.complete for search in searches)
+        best = dictionary.get(intended)[0][0]
+        found += typed == intended or any(word == best for word, _, _ in candidates)
+
+    latencies.sort()
+    return {
+        'queries': len(queries),
+        'p50_us': percentile(latencies, 0.50) / 1000,
+        'p95_us': percentile(latencies, 0.95) / 1000,
+        'p99_us': percentile(latencies, 0.99) / 1000,
+        'max_us': latencies[-1] / 1000,
+        'budget_exceeded': cut_short / len(queries),
+        'nodes_visited': statistics.fmean(visited),
+        'recall': found / len(queries),
+    }
+
+
+def measure_scan(dictionary, queries):
+    """Median time of checking every key's edit distance, in microseconds"""
+    keys = [dictionary.key(index) for index in range(len(dictionary))]
+    timings = []
+    for typed, _ in queries:
+        start = time.perf_counter_ns()
+        [key for key in keys if abs(len(key) - len(typed)) <= 2 and levenshtein(typed, key) <= 2]
+        timings.append(time.perf_counter_ns() - start)
+    return statistics.median(timings) / 1000
+
+
+def run(sizes, count, budget_ns, seed):
+    results = []
+    for size in sizes:
+        dictionary = Dictionary.from_entries(synthetic.generate_entries(size, seed=seed))
+        rng = random.Random(seed)
+        keys = [dictionary.key(rng.randrange(len(dictionary))) for _ in range(count)]
+        keys = [key for key in keys if len(key) >= 3]
+
+        result = {'size': size}
+        for edits in (1, 2):
+            queries = [(misspell(rng, key, edits), key) for key in keys]
+            logger.info(f"{len(queries)} queries with {edits} edits over {size} keys")
+            result[f"edits_{edits}"] = measure(dictionary, queries, budget_ns)
+        result['scan_us'] = measure_scan(dictionary, queries[:SCAN_QUERIES])
+        results.append(result)
+
+    return {
+        'benchmark': 'fuzzy',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'budget_us': budget_ns / 1000,
+        'seed': seed,
+        'results': results,
+    }
+
+
+def print_summary(report, out):
+    print(f"{'size':>8} {'edits':>5} {'p50 us':>8} {'p95 us':>8} {'p99 us':>8} "
+          f"{'cut %':>6} {'nodes':>7} {'recall':>7} {'scan us':>9}", file=out)
+    for result in report['results']:
+        for edits in (1, 2):
+            row = result[f"edits_{edits}"]
+            print(f"{result['size']:>8} {edits:>5} {row['p50_us']:>8.1f} {row['p95_us']:>8.1f} "
+                  f"{row['p99_us']:>8.1f} {row['budget_exceeded'] * 100:>6.1f} "
+                  f"{row['nodes_visited']:>7.0f} {row['recall']:>7.2f} {result['scan_us']:>9.0f}", file=out)
+
+## ========================================================================== ##
+## COMMAND LINE
+## ========================================================================== ##
+
+def print_help(out, v=0):
+    print("Usage: bench_fuzzy.py [options]", file=out)
+    print("-s, --sizes N,N,...    synthetic dictionary sizes (default 10000,100000).", file=out)
+    print("-n, --queries N        misspelled keys looked up per size (default 500).", file=out)
+    print("-b, --budget US        time budget per lookup in microseconds (default 5000).", file=out)
+    print("-o, --output FILE      write the JSON report to FILE instead of stdout.", file=out)
+    print("    --seed N           random seed for the dictionaries and typos.", file=out)
+    print("-v, --verbose          log progress.", file=out)
+    print("-h, --help             show this message.", file=out)
+    sys.exit(v)
+
+def main():
+    sizes = DEFAULT_SIZES
+    count = DEFAULT_QUERIES
+    budget_ns = DEFAULT_BUDGET_NS
+    output = None
+    seed = 0
+    verbose = False
+
+    shortopt = "s:n:b:o:vh"
+    longopt = ["sizes=", "queries=", "budget=", "output=", "seed=", "verbose", "help"]
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], shortopt, longopt)
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        print_help(sys.stderr, 1)
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print_help(sys.stdout)
+        elif o in ("-s", "--sizes"):
+            sizes = tuple(int(size) for size in a.split(','))
+        elif o in ("-n", "--queries"):
+            count = int(a)
+        elif o in ("-b", "--budget"):
+            budget_ns = int(a) * 1000
+        elif o in ("-o", "--output"):
+            output = a
+        elif o == "--seed":
+            seed = int(a)
+        elif o in ("-v", "--verbose"):
+            verbose = True
+
+    logging.basicConfig(
+        level=logging.INFO if verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    report = run(sizes, count, budget_ns, seed)
+    print_summary(report, sys.stderr)
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+Kedmanee conversion benchmark
+
+Measures the throughput of the wrong-layout repair tool on a large text
+file: plain conversion in both directions through the ``str.translate``
+converters, per-line detection, and the per-character loop the converters
+replaced. Input is streamed from disk and output goes to ``os.devnull``,
+and peak memory is reported to show it does not grow with the input.
+
+The synthetic input is a chat log of Thai and English lines, a share of
+them typed with the wrong layout active; detection accuracy is measured
+against those labels.
+"""
+
+import getopt
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from thai_keymap import (
+    DETECT_THRESHOLD, KEDMANEE_KEYMAP, QWERTY_TO_THAI_TABLE, THAI_TO_QWERTY_TABLE, convert_stream, open_text,
+    qwerty_to_thai, repair_line, repair_stream, thai_to_qwerty,
+)
+
+DEFAULT_SIZE_MB = 256
+DEFAULT_WRONG_SHARE = 0.2
+LEGACY_LIMIT_MB = 64
+POOL_LINES = 20000
+
+THAI_WORDS = (
+    'ผม', 'ฉัน', 'คุณ', 'เขา', 'เรา', 'ไป', 'มา', 'กิน', 'ข้าว', 'น้ำ', 'ที่', 'บ้าน', 'ทำงาน', 'วันนี้',
+    'พรุ่งนี้', 'เมื่อวาน', 'ไม่', 'ได้', 'แล้ว', 'จะ', 'ครับ', 'ค่ะ', 'นะ', 'สวัสดี', 'ขอบคุณ', 'มาก',
+    'เรื่อง', 'นี้', 'ต้อง', 'คุย', 'กัน', 'ก่อน', 'ประชุม', 'เวลา', 'โมง', 'เย็น', 'อากาศ', 'ดี', 'ร้อน',
+    'ฝน', 'ตก', 'รถ', 'ติด', 'ถึง', 'แล้ว', 'หรือ', 'ยัง', 'อยาก', 'ซื้อ', 'ของ', 'ใหม่', 'ส่ง', 'ไฟล์',
+    'ให้', 'หน่อย', 'เดี๋ยว', 'โทร', 'กลับ', 'ก็', 'และ', 'แต่', 'เพราะ', 'ว่า', 'อะไร', 'ทำไม', 'ใคร',
+)
+ENGLISH_WORDS = (
+    'the', 'meeting', 'is', 'at', 'three', 'tomorrow', 'please', 'send', 'me', 'file', 'report', 'thanks',
+    'hello', 'world', 'I', 'will', 'call', 'you', 'back', 'later', 'can', 'we', 'move', 'it', 'to', 'Friday',
+    'lunch', 'sounds', 'good', 'see', 'there', 'deploy', 'failed', 'again', 'build', 'server', 'ok', 'sure',
+    'what', 'time', 'does', 'start', 'on', 'my', 'way', 'running', 'late', 'sorry', 'about', 'that', 'and',
+)
+
+logger = logging.getLogger('thaime.bench')
+
+## ========================================================================== ##
+## INPUT
+## ========================================================================== ##
+
+def sentence(rng):
+    """A Thai or English chat line, and which one it is"""
+    if rng.random() < 0.6:
+        phrases = [''.join(rng.choices(THAI_WORDS, k=rng.randint(2, 5))) for _ in range(rng.randint(1, 3))]
+        if rng.random() < 0.2:
+            phrases.insert(rng.randrange(len(phrases) + 1), rng.choice(ENGLISH_WORDS))
+        return ' '.join(phrases), 'thai'
+    words = rng.choices(ENGLISH_WORDS, k=rng.randint(3, 12))
+    words[0] = words[0].capitalize()
+    return ' '.join(words) + rng.choice(('', '.', '?', '!')), 'english'
+
+
+def line_pool(count, wrong_share, seed):
+    """(line, typed in the wrong layout) pairs"""
+    rng = random.Random(seed)
+    pool = []
+    for _ in range(count):
+        line, language = sentence(rng)
+        wrong = rng.random() < wrong_share
+        if wrong:
+            line = thai_to_qwerty(line) if language == 'thai' else qwerty_to_thai(line)
+        pool.append((line, wrong))
+    return pool
+
+
+def write_input(path, pool, size):
+    """Write the pool over and over until ``size`` bytes; return the bytes written"""
+    block = ''.join(line + '\n' for line, _ in pool).encode('utf-8')
+    written = 0
+    with open(path, 'wb') as f:
+        while written < size:
+            f.write(block[:size - written])
+            written += min(len(block), size - written)
+    return written
+
+## ========================================================================== ##
+## MEASUREMENTS
+## ========================================================================== ##
+
+def legacy_stream(src, dst, keymap=KEDMANEE_KEYMAP):
+    """The per-character loop qwerty_to_thai used before, applied chunk by chunk"""
+    while True:
+        chunk = src.read(1 << 20)
+        if not chunk:
+            return
+        result = []
+        for char in chunk:
+            result.append(keymap.get(char, char))
+        dst.write(''.join(result))
+
+
+def measure(name, path, limit, work):
+    """Stream up to ``limit`` bytes of ``path`` through ``work`` into os.devnull"""
+    size = min(os.path.getsize(path), limit) if limit else os.path.getsize(path)
+    logger.info(f"{name}: {size / 1e6:.0f} MB")
+    source = path
+    if limit and limit < os.path.getsize(path):
+        source = f"{path}.head"
+        with open(path, 'rb') as src, open(source, 'wb') as dst:
+            copied = 0
+            while copied < limit:
+                block = src.read(min(1 << 20, limit - copied))
+                dst.write(block)
+                copied += len(block)
+    start = time.perf_counter()
+    with open_text(source) as src, open_text(os.devnull, 'w') as dst:
+        work(src, dst)
+    elapsed = time.perf_counter() - start
+    if source != path:
+        os.remove(source)
+    return {'mb': size / 1e6, 'seconds': elapsed, 'mb_per_s': size / 1e6 / elapsed}
+
+
+def accuracy(pool, threshold):
+    """Precision and recall of line detection against the pool labels"""
+    hits = false_alarms = misses = 0
+    for line, wrong in pool:
+        detected = repair_line(line, threshold) is not None
+        if detected and wrong:
+            hits += 1
+        elif detected:
+            false_alarms += 1
+        elif wrong:
+            misses += 1
+    return {
+        'lines': len(pool),
+        'wrong_lines': hits + misses,
+        'precision': hits / (hits + false_alarms) if hits + false_alarms else 1.0,
+        'recall': hits / (hits + misses) if hits + misses else 1.0,
+    }
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(size, input_path, wrong_share, seed, workdir, threshold=DETECT_THRESHOLD):
+    pool = line_pool(POOL_LINES, wrong_share, seed)
+    if input_path is None:
+        input_path = os.path.join(workdir, 'chat.log')
+        logger.info(f"Writing {size / 1e6:.0f} MB of synthetic chat log")
+        write_input(input_path, pool, size)
+    rss_before = max_rss_mb()
+
+    results = {
+        'qwerty_to_thai': measure('qwerty_to_thai', input_path, None,
+                                  lambda src, dst: convert_stream(src, dst, QWERTY_TO_THAI_TABLE)),
+        'thai_to_qwerty': measure('thai_to_qwerty', input_path, None,
+                                  lambda src, dst: convert_stream(src, dst, THAI_TO_QWERTY_TABLE)),
+        'detect': measure('detect', input_path, None,
+                          lambda src, dst: repair_stream(src, dst, threshold)),
+    }
+    # Taken before the legacy loop, whose per-character lists are larger than a chunk
+    rss_streaming = max_rss_mb()
+    results['legacy_loop'] = measure('legacy_loop', input_path, LEGACY_LIMIT_MB * 1000000, legacy_stream)
+
+    return {
+        'benchmark': 'keymap',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'input_bytes': os.path.getsize(input_path),
+        'wrong_share': wrong_share,
+        'threshold': threshold,
+        'seed': seed,
+        'results': results,
+        'detection': accuracy(pool, threshold),
+        'max_rss_before_mb': rss_before,
+        'max_rss_streaming_mb': rss_streaming,
+    }
+
+
+def print_summary(report, out):
+    print(f"input {report['input_bytes'] / 1e6:.0f} MB, peak RSS {report['max_rss_before_mb']:.1f} MB "
+          f"before streaming, {report['max_rss_streaming_mb']:.1f} MB after", file=out)
+    print(f"{'':>15} {'MB':>8} {'s':>8} {'MB/s':>8}", file=out)
+    for name, row in report['results'].items():
+        print(f"{name:>15} {row['mb']:>8.0f} {row['seconds']:>8.2f} {row['mb_per_s']:>8.1f}", file=out)
+    detection = report['detection']
+    print(f"detection at threshold {report['threshold']}: precision {detection['precision']:.3f}, "
+          f"recall {detection['recall']:.3f} over {detection['lines']} lines "
+          f"({detection['wrong_lines']} typed in the wrong layout)", file=out)
+
+## ========================================================================== ##
+## COMMAND LINE
+## ========================================================================== ##
+
+def print_help(out, v=0):
+    print("Usage: bench_keymap.py [options]", file=out)
+    print("-s, --size MB          synthetic input size in MB (default 256).", file=out)
+    print("-i, --input FILE       measure on FILE instead of a synthetic chat log.", file=out)
+    print("-w, --wrong-share X    share of synthetic lines typed in the wrong layout (default 0.2).", file=out)
+    print("-t, --threshold X      detection threshold (default 0.5).", file=out)
+    print("-o, --output FILE      write the JSON report to FILE instead of stdout.", file=out)
+    print("    --seed N           random seed for the synthetic lines.", file=out)
+    print("-v, --verbose          log progress.", file=out)
+    print("-h, --help             show this message.", file=out)
+    sys.exit(v)
+
+def main():
+    size = DEFAULT_SIZE_MB * 1000000
+    input_path = None
+    wrong_share = DEFAULT_WRONG_SHARE
+    threshold = DETECT_THRESHOLD
+    output = None
+    seed = 0
+    verbose = False
+
+    shortopt = "s:i:w:t:o:vh"
+    longopt = ["size=", "input=", "wrong-share=", "threshold=", "output=", "seed=", "verbose", "help"]
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], shortopt, longopt)
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        print_help(sys.stderr, 1)
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print_help(sys.stdout)
+        elif o in ("-s", "--size"):
+            size = int(float(a) * 1000000)
+        elif o in ("-i", "--input"):
+            input_path = a
+        elif o in ("-w", "--wrong-share"):
+            wrong_share = float(a)
+        elif o in ("-t", "--threshold"):
+            threshold = float(a)
+        elif o in ("-o", "--output"):
+            output = a
+        elif o == "--seed":
+            seed = int(a)
+        elif o in ("-v", "--verbose"):
+            verbose = True
+
+    logging.basicConfig(
+        level=logging.INFO if verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    with tempfile.TemporaryDirectory(prefix='thaime-bench-') as workdir:
+        report = run(size, input_path, wrong_share, seed, workdir, threshold)
+    print_summary(report, sys.stderr)
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
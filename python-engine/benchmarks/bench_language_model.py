@@ -0,0 +1,261 @@
+"""
+Language model benchmark
+
+Measures how often the first candidate is the word actually written, with
+static frequency ranking and with n-gram reranking by the preceding words,
+on held-out sentences, together with what reranking costs per lookup.
+
+By default the text comes from a synthetic Markov "language" whose words
+share romanized keys in homophone groups. ``--corpus`` takes a real
+word-segmented Thai corpus instead (one sentence per line, words separated
+by spaces or '|'); its words are grouped into homophones by the romanized
+keys of ``--dictionary``. The last tenth of the sentences is held out.
+"""
+
+import collections
+import getopt
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synthetic
+from bench_engine import percentile
+from dictionary import read_entries
+from language_model import LanguageModel, rerank, split_words
+
+DEFAULT_WORDS = 5000
+DEFAULT_SENTENCES = 40000
+HELD_OUT = 0.1
+
+logger = logging.getLogger('thaime.bench')
+
+## ========================================================================== ##
+## CORPORA
+## ========================================================================== ##
+
+def synthetic_corpus(word_count, sentence_count, seed):
+    """
+    Generate sentences and the romanized key of every word.
+
+    Words come in homophone groups of one to four sharing a key. Each word
+    has a few preferred successors; the rest of the time any word may follow,
+    weighted by a Zipf curve.
+    """
+    rng = random.Random(seed)
+    words = []
+    seen = set()
+    while len(words) < word_count:
+        word = synthetic.thai_word(rng)
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+
+    keys = {}
+    index = 0
+    while index < word_count:
+        key = ''.join(synthetic.syllable(rng) for _ in range(rng.choice((1, 2))))
+        group = rng.choice((1, 2, 2, 3, 4))
+        for word in words[index:index + group]:
+            keys[word] = key
+        index += group
+
+    zipf = [1 / rank for rank in range(1, word_count + 1)]
+    successors = {
+        word: (rng.choices(words, weights=zipf, k=8), [1 / rank for rank in range(1, 9)])
+        for word in words
+    }
+
+    sentences = []
+    for _ in range(sentence_count):
+        sentence = rng.choices(words, weights=zipf, k=1)
+        for _ in range(rng.randint(4, 14)):
+            if rng.random() < 0.7:
+                following, weights = successors[sentence[-1]]
+                sentence.append(rng.choices(following, weights=weights, k=1)[0])
+            else:
+                sentence.append(rng.choices(words, weights=zipf, k=1)[0])
+        sentences.append(sentence)
+    return sentences, keys
+
+
+def real_corpus(corpus_path, dictionary_path):
+    """Read a segmented corpus and map each word to its first romanized key"""
+    with open(corpus_path, 'r', encoding='utf-8') as f:
+        sentences = [words for words in (split_words(line) for line in f) if words]
+    keys = {}
+    for key, candidates in read_entries(dictionary_path).items():
+        for word, _ in candidates:
+            keys.setdefault(word, key)
+    return sentences, keys
+
+## ========================================================================== ##
+## MEASUREMENTS
+## ========================================================================== ##
+
+def evaluate(model, test, homophones, frequencies):
+    """Top-1 accuracy with and without reranking, over ambiguous keys only"""
+    static_hits = reranked_hits = total = 0
+    latencies = []
+    for sentence in test:
+        for position in range(1, len(sentence)):
+            word = sentence[position]
+            candidates = homophones.get(word)
+            if candidates is None or len(candidates) < 2:
+                continue
+            ranked = [(candidate, frequencies[candidate]) for candidate in candidates]
+            ranked.sort(key=lambda item: item[1], reverse=True)
+
+            start = time.perf_counter_ns()
+            context = model.context_ids(sentence[max(0, position - 2):position])
+            reordered = rerank(model, ranked, context)
+            latencies.append(time.perf_counter_ns() - start)
+
+            total += 1
+            static_hits += ranked[0][0] == word
+            reranked_hits += reordered[0][0] == word
+
+    latencies.sort()
+    return {
+        'ambiguous_words': total,
+        'static_top1': static_hits / total if total else 0.0,
+        'reranked_top1': reranked_hits / total if total else 0.0,
+        'rerank_p50_us': percentile(latencies, 0.50) / 1000,
+        'rerank_p99_us': percentile(latencies, 0.99) / 1000,
+        'rerank_mean_us': statistics.fmean(latencies) / 1000 if latencies else 0.0,
+    }
+
+
+def run(sentences, keys, min_count, workdir):
+    split = int(len(sentences) * (1 - HELD_OUT))
+    train, test = sentences[:split], sentences[split:]
+
+    # Static ranking uses training counts, as a dictionary built from the corpus would
+    frequencies = collections.Counter(word for sentence in train for word in sentence)
+    groups = collections.defaultdict(list)
+    for word in frequencies:
+        if word in keys:
+            groups[keys[word]].append(word)
+    homophones = {word: groups[keys[word]] for word in frequencies if word in keys}
+
+    results = []
+    for order in (2, 3):
+        path = os.path.join(workdir, f"lm{order}.bin")
+        LanguageModel.build(train, order=order, min_count=min_count).save(path)
+        model = LanguageModel.open(path)
+        logger.info(f"Evaluating the {order}-gram model on {len(test)} sentences")
+        result = {'order': order, 'file_bytes': os.path.getsize(path)}
+        result.update(evaluate(model, test, homophones, frequencies))
+        results.append(result)
+        model.close()
+
+    return {
+        'benchmark': 'language_model',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'train_sentences': len(train),
+        'test_sentences': len(test),
+        'min_count': min_count,
+        'results': results,
+    }
+
+
+def print_summary(report, out):
+    print(f"{'order':>5} {'bytes':>10} {'words':>7} {'static':>7} {'rerank':>7} "
+          f"{'p50 us':>7} {'p99 us':>7}", file=out)
+    for result in report['results']:
+        print(f"{result['order']:>5} {result['file_bytes']:>10} {result['ambiguous_words']:>7} "
+              f"{result['static_top1']:>7.3f} {result['reranked_top1']:>7.3f} "
+              f"{result['rerank_p50_us']:>7.1f} {result['rerank_p99_us']:>7.1f}", file=out)
+
+## ========================================================================== ##
+## COMMAND LINE
+## ========================================================================== ##
+
+def print_help(out, v=0):
+    print("Usage: bench_language_model.py [options]", file=out)
+    print("-c, --corpus FILE      segmented Thai corpus to use instead of synthetic text.", file=out)
+    print("-d, --dictionary FILE  trie.json giving the romanized keys of corpus words.", file=out)
+    print("-w, --words N          synthetic vocabulary size (default 5000).", file=out)
+    print("-n, --sentences N      synthetic sentences (default 40000).", file=out)
+    print("-m, --min-count N      drop n-grams seen fewer times (default 2).", file=out)
+    print("-o, --output FILE      write the JSON report to FILE instead of stdout.", file=out)
+    print("    --seed N           random seed for the synthetic text.", file=out)
+    print("-v, --verbose          log progress.", file=out)
+    print("-h, --help             show this message.", file=out)
+    sys.exit(v)
+
+def main():
+    corpus_path = None
+    dictionary_path = None
+    word_count = DEFAULT_WORDS
+    sentence_count = DEFAULT_SENTENCES
+    min_count = 2
+    output = None
+    seed = 0
+    verbose = False
+
+    shortopt = "c:d:w:n:m:o:vh"
+    longopt = ["corpus=", "dictionary=", "words=", "sentences=", "min-count=", "output=",
+               "seed=", "verbose", "help"]
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], shortopt, longopt)
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        print_help(sys.stderr, 1)
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print_help(sys.stdout)
+        elif o in ("-c", "--corpus"):
+            corpus_path = a
+        elif o in ("-d", "--dictionary"):
+            dictionary_path = a
+        elif o in ("-w", "--words"):
+            word_count = int(a)
+        elif o in ("-n", "--sentences"):
+            sentence_count = int(a)
+        elif o in ("-m", "--min-count"):
+            min_count = int(a)
+        elif o in ("-o", "--output"):
+            output = a
+        elif o == "--seed":
+            seed = int(a)
+        elif o in ("-v", "--verbose"):
+            verbose = True
+
+    if corpus_path and not dictionary_path:
+        print("--corpus needs --dictionary", file=sys.stderr)
+        print_help(sys.stderr, 1)
+
+    logging.basicConfig(
+        level=logging.INFO if verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    if corpus_path:
+        sentences, keys = real_corpus(corpus_path, dictionary_path)
+    else:
+        sentences, keys = synthetic_corpus(word_count, sentence_count, seed)
+
+    with tempfile.TemporaryDirectory(prefix='thaime-bench-') as workdir:
+        report = run(sentences, keys, min_count, workdir)
+    print_summary(report, sys.stderr)
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Idle-time prefetch benchmark
+
+Types the phonetic trace at a typist's pace, once with next-letter
+prefetching and once without, and compares how long each letter takes
+until its candidates are ready. Between keys the fake main loop is drained
+as an idle GLib loop would run its sources, so prefetch jobs get the
+pauses they would get in the real engine.
+
+Reports the share of letters served from the prefetch cache, the prefetch
+jobs and conversions it took, and what the memory cap evicted.
+"""
+
+import getopt
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import fake_ibus
+fake_ibus.install()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import conversion
+import engine
+import synthetic
+from bench_engine import TRACE_DIR, load_trace, percentile, wait_until_ready
+from fake_ibus import MAIN_LOOP
+from gi.repository import IBus
+from instrumentation import STATS
+
+DEFAULT_SIZE = 100000
+DEFAULT_INTERVAL_MS = 30
+DEFAULT_REPEAT = 3
+COUNTERS = (
+    'cache_hits', 'cache_misses', 'prefetch_hits', 'prefetch_misses',
+    'prefetch_slices', 'prefetch_computed', 'prefetch_evicted',
+)
+
+logger = logging.getLogger('thaime.bench')
+
+## ========================================================================== ##
+## MEASUREMENTS
+## ========================================================================== ##
+
+def pause(seconds):
+    """Let the main loop run its idle sources for ``seconds``"""
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        if not MAIN_LOOP.drain():
+            time.sleep(0.0002)
+
+
+def type_trace(keys, interval, repeat):
+    """Per-letter ns from the key press until its candidates are ready, a fresh engine per pass"""
+    latencies = []
+    for index in range(repeat):
+        bench_engine = engine.Engine(IBus.Bus(), f"/org/freedesktop/IBus/Thaime/Bench/{index}")
+        wait_until_ready(bench_engine)
+        bench_engine.set_mode(2)
+        MAIN_LOOP.drain()
+        for keyval, state in keys:
+            pause(interval)
+            start = time.perf_counter_ns()
+            bench_engine.do_process_key_event(keyval, 0, state)
+            MAIN_LOOP.drain()
+            if ord('a') <= keyval <= ord('z'):
+                bench_engine.lookup_cursor_candidates()
+                latencies.append(time.perf_counter_ns() - start)
+        bench_engine.do_destroy()
+        MAIN_LOOP.drain()
+    return latencies
+
+
+def measure(keys, interval, repeat, letters):
+    conversion.PREFETCH_LETTERS = letters
+    engine.PREFETCH_LETTERS = letters
+    STATS.reset()
+    latencies = sorted(type_trace(keys, interval, repeat))
+    counters = {name: STATS.counters[name] for name in COUNTERS}
+    served = counters['prefetch_hits'] + counters['prefetch_misses']
+    return {
+        'letters': len(latencies),
+        'p50_us': percentile(latencies, 0.50) / 1000,
+        'p95_us': percentile(latencies, 0.95) / 1000,
+        'p99_us': percentile(latencies, 0.99) / 1000,
+        'mean_us': sum(latencies) / len(latencies) / 1000 if latencies else 0.0,
+        'prefetch_hit_rate': counters['prefetch_hits'] / served if served else 0.0,
+        'counters': counters,
+    }
+
+
+def run(size, interval, repeat, letters, seed, workdir):
+    _, _, keys, words = load_trace(os.path.join(TRACE_DIR, 'phonetic.trace'))
+    directory = os.path.join(workdir, 'dictionary')
+    logger.info(f"Writing a {size}-key dictionary")
+    entries = synthetic.generate_entries(size, seed=seed, extra_keys=words)
+    synthetic.write_dictionary(entries, directory, 'bin')
+    engine.DICTIONARY_DIR = directory
+
+    logger.info("Typing without prefetching")
+    without = measure(keys, interval, repeat, 0)
+    logger.info(f"Typing with {letters} prefetched letters")
+    with_prefetch = measure(keys, interval, repeat, letters)
+
+    return {
+        'benchmark': 'prefetch',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'size': size,
+        'interval_ms': interval * 1000,
+        'repeat': repeat,
+        'prefetch_letters': letters,
+        'prefetch_slice_us': conversion.PREFETCH_SLICE_US,
+        'prefetch_kb': conversion.PREFETCH_KB,
+        'seed': seed,
+        'without_prefetch': without,
+        'with_prefetch': with_prefetch,
+    }
+
+
+def print_summary(report, out):
+    print(f"{report['prefetch_letters']} letters, {report['prefetch_slice_us']} us slices, "
+          f"{report['prefetch_kb']} KB cap, {report['interval_ms']:.0f} ms between keys", file=out)
+    print(f"{'':>17} {'letters':>7} {'p50 us':>8} {'p95 us':>8} {'p99 us':>8} {'hit rate':>9}", file=out)
+    for name in ('without_prefetch', 'with_prefetch'):
+        row = report[name]
+        print(f"{name:>17} {row['letters']:>7} {row['p50_us']:>8.1f} {row['p95_us']:>8.1f} "
+              f"{row['p99_us']:>8.1f} {row['prefetch_hit_rate']:>9.2f}", file=out)
+    counters = report['with_prefetch']['counters']
+    print(f"prefetch: {counters['prefetch_slices']} jobs, {counters['prefetch_computed']} conversions, "
+          f"{counters['prefetch_evicted']} evicted", file=out)
+
+## ========================================================================== ##
+## COMMAND LINE
+## ========================================================================== ##
+
+def print_help(out, v=0):
+    print("Usage: bench_prefetch.py [options]", file=out)
+    print("-s, --size N           synthetic dictionary size (default 100000).", file=out)
+    print("-i, --interval MS      pause between keys (default 30).", file=out)
+    print("-r, --repeat N         passes over the trace, each with a fresh engine (default 3).", file=out)
+    print("-l, --letters N        next letters to prefetch (default THAIME_PREFETCH_LETTERS or 6).", file=out)
+    print("-o, --output FILE      write the JSON report to FILE instead of stdout.", file=out)
+    print("    --seed N           random seed for the dictionary.", file=out)
+    print("-v, --verbose          log progress and engine messages.", file=out)
+    print("-h, --help             show this message.", file=out)
+    sys.exit(v)
+
+def main():
+    size = DEFAULT_SIZE
+    interval = DEFAULT_INTERVAL_MS / 1000
+    repeat = DEFAULT_REPEAT
+    letters = conversion.PREFETCH_LETTERS or 6
+    output = None
+    seed = 0
+    verbose = False
+
+    shortopt = "s:i:r:l:o:vh"
+    longopt = ["size=", "interval=", "repeat=", "letters=", "output=", "seed=", "verbose", "help"]
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], shortopt, longopt)
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        print_help(sys.stderr, 1)
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print_help(sys.stdout)
+        elif o in ("-s", "--size"):
+            size = int(a)
+        elif o in ("-i", "--interval"):
+            interval = float(a) / 1000
+        elif o in ("-r", "--repeat"):
+            repeat = int(a)
+        elif o in ("-l", "--letters"):
+            letters = int(a)
+        elif o in ("-o", "--output"):
+            output = a
+        elif o == "--seed":
+            seed = int(a)
+        elif o in ("-v", "--verbose"):
+            verbose = True
+
+    logging.basicConfig(
+        level=logging.INFO if verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if not verbose:
+        logging.getLogger('thaime').setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory(prefix='thaime-bench-') as workdir:
+        report = run(size, interval, repeat, letters, seed, workdir)
+    print_summary(report, sys.stderr)
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
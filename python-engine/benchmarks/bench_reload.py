@@ -0,0 +1,195 @@
+"""
+Dictionary hot reload benchmark
+
+Types the phonetic trace at a steady pace against an engine whose
+``trie.json`` is rewritten mid-session, and compares per-key latency while
+the reload runs with latency before it. Also reports how long the reload
+took from the file event to the swap, split into compiling and opening,
+and how long loading the same ``trie.json`` in-process would have blocked
+the main loop instead.
+"""
+
+import getopt
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import fake_ibus
+fake_ibus.install()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import engine
+import synthetic
+from bench_engine import TRACE_DIR, load_trace, percentile, wait_until_ready
+from dictionary import Dictionary
+from fake_ibus import MAIN_LOOP, file_changed
+from gi.repository import Gio, IBus
+from reloader import DictionaryReloader
+
+DEFAULT_SIZE = 100000
+DEFAULT_INTERVAL_MS = 10
+BASELINE_KEYS = 300
+TIMEOUT = 300.0
+
+logger = logging.getLogger('thaime.bench')
+
+## ========================================================================== ##
+## MEASUREMENTS
+## ========================================================================== ##
+
+def type_keys(bench_engine, keys, interval, count=None, until=None):
+    """Type ``keys`` in a loop until ``count`` keys or ``until()``; return latencies in ns"""
+    latencies = []
+    deadline = time.perf_counter() + TIMEOUT
+    index = 0
+    while (count is None or len(latencies) < count) and not (until and until()):
+        if time.perf_counter() > deadline:
+            raise RuntimeError("Reload did not finish in time")
+        keyval, state = keys[index % len(keys)]
+        index += 1
+        time.sleep(interval)
+        start = time.perf_counter_ns()
+        bench_engine.do_process_key_event(keyval, 0, state)
+        MAIN_LOOP.drain()
+        latencies.append(time.perf_counter_ns() - start)
+    return latencies
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {
+        'keys': len(latencies),
+        'p50_us': percentile(latencies, 0.50) / 1000,
+        'p99_us': percentile(latencies, 0.99) / 1000,
+        'max_us': latencies[-1] / 1000 if latencies else 0.0,
+    }
+
+
+def run(size, interval, seed, workdir):
+    _, _, keys, words = load_trace(os.path.join(TRACE_DIR, 'phonetic.trace'))
+    directory = os.path.join(workdir, 'dictionary')
+    logger.info(f"Writing a {size}-key dictionary")
+    entries = synthetic.generate_entries(size, seed=seed, extra_keys=words)
+    json_path = synthetic.write_dictionary(entries, directory, 'json')
+    synthetic.write_dictionary(entries, directory, 'bin')
+
+    engine.DICTIONARY_DIR = directory
+    bench_engine = engine.Engine(IBus.Bus(), "/org/freedesktop/IBus/Thaime/Bench/0")
+    wait_until_ready(bench_engine)
+    bench_engine.set_mode(2)
+    reloader = DictionaryReloader(directory, delay_ms=0)
+    reloader.start()
+
+    logger.info(f"Typing {BASELINE_KEYS} keys before the reload")
+    baseline = type_keys(bench_engine, keys, interval, count=BASELINE_KEYS)
+
+    # Rewrite trie.json with different frequencies, then let the monitor see it
+    updated = synthetic.generate_entries(size, seed=seed + 1, extra_keys=words)
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(updated, f, ensure_ascii=False)
+    file_changed(json_path, Gio.FileMonitorEvent.CHANGES_DONE_HINT)
+
+    logger.info("Typing while the dictionary reloads")
+    during = type_keys(bench_engine, keys, interval, until=lambda: reloader.reloads > 0)
+    reload_timings = reloader.last_reload
+    reloader.stop()
+    bench_engine.do_destroy()
+
+    start = time.perf_counter()
+    Dictionary.load_json(json_path)
+    blocking_ms = (time.perf_counter() - start) * 1000
+
+    return {
+        'benchmark': 'reload',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'size': size,
+        'interval_ms': interval * 1000,
+        'seed': seed,
+        'reload': reload_timings,
+        'blocking_reload_ms': blocking_ms,
+        'baseline': summarize(baseline),
+        'during_reload': summarize(during),
+    }
+
+
+def print_summary(report, out):
+    reload_timings = report['reload']
+    print(f"reload of {reload_timings['keys']} keys: {reload_timings['total_ms']:.1f} ms "
+          f"(compile {reload_timings['compile_ms']:.1f} ms, open {reload_timings['open_ms']:.1f} ms); "
+          f"loading trie.json in-process would block {report['blocking_reload_ms']:.1f} ms", file=out)
+    print(f"{'':>14} {'keys':>6} {'p50 us':>8} {'p99 us':>8} {'max us':>9}", file=out)
+    for name in ('baseline', 'during_reload'):
+        row = report[name]
+        print(f"{name:>14} {row['keys']:>6} {row['p50_us']:>8.1f} {row['p99_us']:>8.1f} "
+              f"{row['max_us']:>9.1f}", file=out)
+
+## ========================================================================== ##
+## COMMAND LINE
+## ========================================================================== ##
+
+def print_help(out, v=0):
+    print("Usage: bench_reload.py [options]", file=out)
+    print("-s, --size N           synthetic dictionary size (default 100000).", file=out)
+    print("-i, --interval MS      pause between keys (default 10).", file=out)
+    print("-o, --output FILE      write the JSON report to FILE instead of stdout.", file=out)
+    print("    --seed N           random seed for the dictionaries.", file=out)
+    print("-v, --verbose          log progress and engine messages.", file=out)
+    print("-h, --help             show this message.", file=out)
+    sys.exit(v)
+
+def main():
+    size = DEFAULT_SIZE
+    interval = DEFAULT_INTERVAL_MS / 1000
+    output = None
+    seed = 0
+    verbose = False
+
+    shortopt = "s:i:o:vh"
+    longopt = ["size=", "interval=", "output=", "seed=", "verbose", "help"]
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], shortopt, longopt)
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        print_help(sys.stderr, 1)
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print_help(sys.stdout)
+        elif o in ("-s", "--size"):
+            size = int(a)
+        elif o in ("-i", "--interval"):
+            interval = float(a) / 1000
+        elif o in ("-o", "--output"):
+            output = a
+        elif o == "--seed":
+            seed = int(a)
+        elif o in ("-v", "--verbose"):
+            verbose = True
+
+    logging.basicConfig(
+        level=logging.INFO if verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if not verbose:
+        logging.getLogger('thaime').setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory(prefix='thaime-bench-') as workdir:
+        report = run(size, interval, seed, workdir)
+    print_summary(report, sys.stderr)
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
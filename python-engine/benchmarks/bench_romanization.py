@@ -0,0 +1,201 @@
+"""
+Romanization normalization benchmark
+
+Builds a synthetic dictionary the way the legacy ``trie.json`` is written,
+with each word repeated under several spelling variants (ph/p, th/t, kh/k,
+aa/a, ii/ee/i, oo/o, uu/u), then compiles it with and without
+normalization. Reports key count, file sizes and load times for both, and
+checks that every variant spelling still finds its words through the
+streaming normalizer. Loaded tables take as much memory as the compiled
+file, so ``bin_bytes`` doubles as the memory figure.
+"""
+
+import getopt
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synthetic
+from dictionary import Dictionary, load_dictionary
+from romanization import Normalizer, normalize, normalize_entries
+
+DEFAULT_SIZE = 20000
+DEFAULT_VARIANTS = 4
+
+# Spellings each canonical letter is written with in the legacy dictionary
+ALTERNATES = {
+    'p': ('p', 'ph'),
+    't': ('t', 'th'),
+    'k': ('k', 'kh'),
+    'a': ('a', 'aa'),
+    'i': ('i', 'ii', 'ee'),
+    'o': ('o', 'oo'),
+    'u': ('u', 'uu'),
+}
+
+logger = logging.getLogger('thaime.bench')
+
+## ========================================================================== ##
+## MEASUREMENTS
+## ========================================================================== ##
+
+def spell_variants(rng, key, count):
+    """Return up to ``count`` spellings of ``key`` that normalize to the same key"""
+    canonical = normalize(key)
+    variants = {key}
+    for _ in range(count * 4):
+        if len(variants) >= count:
+            break
+        variant = ''.join(rng.choice(ALTERNATES.get(char, (char,))) for char in canonical)
+        if normalize(variant) == canonical:
+            variants.add(variant)
+    return variants
+
+
+def legacy_entries(size, variants, seed):
+    """Synthetic entries with every key duplicated under spelling variants"""
+    rng = random.Random(seed)
+    entries = {}
+    for key, candidates in synthetic.generate_entries(size, seed=seed).items():
+        for variant in spell_variants(rng, key, variants):
+            entries.setdefault(variant, []).extend(candidates)
+    return entries
+
+
+def measure_build(entries, directory, normalize_keys):
+    """Compile ``entries``; return file sizes and load times, and the JSON-loaded dictionary"""
+    os.makedirs(directory, exist_ok=True)
+    json_path = os.path.join(directory, 'trie.json')
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(normalize_entries(entries) if normalize_keys else entries, f, ensure_ascii=False)
+    bin_path = os.path.join(directory, 'trie.bin')
+    Dictionary.from_entries(entries, normalize=normalize_keys).save(bin_path)
+
+    start = time.perf_counter()
+    in_memory = Dictionary.load_json(json_path, normalize=normalize_keys)
+    json_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    mapped = load_dictionary(bin_path)
+    bin_ms = (time.perf_counter() - start) * 1000
+    keys = len(mapped)
+    mapped.close()
+
+    return {
+        'keys': keys,
+        'json_bytes': os.path.getsize(json_path),
+        'bin_bytes': os.path.getsize(bin_path),
+        'json_load_ms': json_ms,
+        'bin_open_ms': bin_ms,
+    }, in_memory
+
+
+def check_variants(entries, dictionary):
+    """Return the share of variant spellings that find all of their words"""
+    normalizer = Normalizer()
+    resolved = 0
+    for key, candidates in entries.items():
+        normalizer.reset()
+        for char in key:
+            normalizer.push(char)
+        found = {word for word, _ in dictionary.get(normalizer.text, [])}
+        resolved += {word for word, _ in candidates} <= found
+    return resolved / len(entries)
+
+
+def run(size, variants, seed):
+    entries = legacy_entries(size, variants, seed)
+    with tempfile.TemporaryDirectory(prefix='thaime-bench-') as workdir:
+        logger.info(f"Building {len(entries)} spellings of {size} keys")
+        before, _ = measure_build(entries, os.path.join(workdir, 'raw'), False)
+        after, normalized = measure_build(entries, os.path.join(workdir, 'normalized'), True)
+        after['variants_resolved'] = check_variants(entries, normalized)
+
+    return {
+        'benchmark': 'romanization',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'size': size,
+        'variants': variants,
+        'seed': seed,
+        'before': before,
+        'after': after,
+    }
+
+
+def print_summary(report, out):
+    before, after = report['before'], report['after']
+    print(f"{'':>22} {'before':>12} {'after':>12} {'change':>8}", file=out)
+    for name in ('keys', 'json_bytes', 'bin_bytes', 'json_load_ms', 'bin_open_ms'):
+        change = (after[name] / before[name] - 1) * 100 if before[name] else 0.0
+        print(f"{name:>22} {before[name]:>12.1f} {after[name]:>12.1f} {change:>7.1f}%", file=out)
+    print(f"{'variants resolved':>22} {after['variants_resolved'] * 100:>11.1f}%", file=out)
+
+## ========================================================================== ##
+## COMMAND LINE
+## ========================================================================== ##
+
+def print_help(out, v=0):
+    print("Usage: bench_romanization.py [options]", file=out)
+    print("-s, --size N           synthetic dictionary size before variants (default 20000).", file=out)
+    print("-V, --variants N       spellings written per key (default 4).", file=out)
+    print("-o, --output FILE      write the JSON report to FILE instead of stdout.", file=out)
+    print("    --seed N           random seed for the dictionary and variants.", file=out)
+    print("-v, --verbose          log progress.", file=out)
+    print("-h, --help             show this message.", file=out)
+    sys.exit(v)
+
+def main():
+    size = DEFAULT_SIZE
+    variants = DEFAULT_VARIANTS
+    output = None
+    seed = 0
+    verbose = False
+
+    shortopt = "s:V:o:vh"
+    longopt = ["size=", "variants=", "output=", "seed=", "verbose", "help"]
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], shortopt, longopt)
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        print_help(sys.stderr, 1)
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print_help(sys.stdout)
+        elif o in ("-s", "--size"):
+            size = int(a)
+        elif o in ("-V", "--variants"):
+            variants = int(a)
+        elif o in ("-o", "--output"):
+            output = a
+        elif o == "--seed":
+            seed = int(a)
+        elif o in ("-v", "--verbose"):
+            verbose = True
+
+    logging.basicConfig(
+        level=logging.INFO if verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    report = run(size, variants, seed)
+    print_summary(report, sys.stderr)
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Phrase segmenter benchmark
+
+Types long phrases, built by gluing random dictionary keys together, one
+character at a time and reports the cost of each keystroke against the
+preedit length: the lattice extension alone (``Segmenter.push``), the
+phrase read-out (``Segmenter.phrases``), and a whole phonetic keystroke
+through ``engine.Engine`` including the deferred render. Flat columns mean
+the decoder is incremental.
+"""
+
+import getopt
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import fake_ibus
+fake_ibus.install()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import engine
+import synthetic
+from bench_engine import wait_until_ready
+from conversion import PHRASE_CANDIDATES
+from dictionary import load_dictionary
+from fake_ibus import MAIN_LOOP, RECORDER
+from gi.repository import IBus
+from segmenter import Segmenter
+
+DEFAULT_SIZE = 100000
+DEFAULT_LENGTH = 40
+DEFAULT_PHRASES = 200
+
+logger = logging.getLogger('thaime.bench')
+
+## ========================================================================== ##
+## MEASUREMENTS
+## ========================================================================== ##
+
+def make_phrases(dictionary, count, length, seed):
+    """Return ``count`` strings of at least ``length`` chars made of dictionary keys"""
+    rng = random.Random(seed)
+    phrases = []
+    for _ in range(count):
+        parts = []
+        while sum(map(len, parts)) < length:
+            parts.append(dictionary.key(rng.randrange(len(dictionary))))
+        phrases.append(''.join(parts)[:length])
+    return phrases
+
+
+def measure_segmenter(dictionary, phrases, length):
+    """Median push and read-out time per preedit length, in microseconds"""
+    push_ns = [[] for _ in range(length)]
+    phrases_ns = [[] for _ in range(length)]
+    segmenter = Segmenter(dictionary)
+    for phrase in phrases:
+        segmenter.reset()
+        for position, char in enumerate(phrase):
+            start = time.perf_counter_ns()
+            segmenter.push(char)
+            middle = time.perf_counter_ns()
+            segmenter.phrases(PHRASE_CANDIDATES)
+            end = time.perf_counter_ns()
+            push_ns[position].append(middle - start)
+            phrases_ns[position].append(end - middle)
+    return (
+        [statistics.median(samples) / 1000 for samples in push_ns],
+        [statistics.median(samples) / 1000 for samples in phrases_ns],
+    )
+
+
+def measure_engine(directory, phrases, length):
+    """Median phonetic keystroke time per preedit length, in microseconds"""
+    engine.DICTIONARY_DIR = directory
+    bench_engine = engine.Engine(IBus.Bus(), "/org/freedesktop/IBus/Thaime/Bench/0")
+    wait_until_ready(bench_engine)
+    bench_engine.set_mode(2)
+    RECORDER.keep_commits = False
+
+    key_ns = [[] for _ in range(length)]
+    for phrase in phrases:
+        for position, char in enumerate(phrase):
+            start = time.perf_counter_ns()
+            bench_engine.do_process_key_event(ord(char), 0, 0)
+            MAIN_LOOP.drain()
+            key_ns[position].append(time.perf_counter_ns() - start)
+        bench_engine.do_reset()
+        MAIN_LOOP.drain()
+    bench_engine.do_destroy()
+    return [statistics.median(samples) / 1000 for samples in key_ns]
+
+
+def run(size, length, count, seed):
+    entries = synthetic.generate_entries(size, seed=seed)
+    with tempfile.TemporaryDirectory(prefix='thaime-bench-') as workdir:
+        path = synthetic.write_dictionary(entries, workdir, 'bin')
+        dictionary = load_dictionary(path)
+        phrases = make_phrases(dictionary, count, length, seed)
+
+        logger.info(f"Segmenting {count} phrases of {length} chars over {size} keys")
+        push_us, phrases_us = measure_segmenter(dictionary, phrases, length)
+        key_us = measure_engine(workdir, phrases, length)
+        dictionary.close()
+
+    return {
+        'benchmark': 'segmenter',
+        'size': size,
+        'phrases': count,
+        'seed': seed,
+        'positions': [
+            {
+                'length': position + 1,
+                'push_us': push_us[position],
+                'phrases_us': phrases_us[position],
+                'engine_key_us': key_us[position],
+            }
+            for position in range(length)
+        ],
+    }
+
+
+def print_summary(report, out):
+    print(f"{'length':>6} {'push us':>9} {'phrases us':>11} {'key us':>9}", file=out)
+    for row in report['positions']:
+        print(f"{row['length']:>6} {row['push_us']:>9.1f} {row['phrases_us']:>11.1f} "
+              f"{row['engine_key_us']:>9.1f}", file=out)
+
+## ========================================================================== ##
+## COMMAND LINE
+## ========================================================================== ##
+
+def print_help(out, v=0):
+    print("Usage: bench_segmenter.py [options]", file=out)
+    print("-s, --size N           synthetic dictionary size (default 100000).", file=out)
+    print("-l, --length N         characters typed per phrase (default 40).", file=out)
+    print("-n, --phrases N        phrases typed (default 200).", file=out)
+    print("-o, --output FILE      write the JSON report to FILE instead of stdout.", file=out)
+    print("    --seed N           random seed for the dictionary and phrases.", file=out)
+    print("-v, --verbose          log progress and engine messages.", file=out)
+    print("-h, --help             show this message.", file=out)
+    sys.exit(v)
+
+def main():
+    size = DEFAULT_SIZE
+    length = DEFAULT_LENGTH
+    count = DEFAULT_PHRASES
+    output = None
+    seed = 0
+    verbose = False
+
+    shortopt = "s:l:n:o:vh"
+    longopt = ["size=", "length=", "phrases=", "output=", "seed=", "verbose", "help"]
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], shortopt, longopt)
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        print_help(sys.stderr, 1)
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print_help(sys.stdout)
+        elif o in ("-s", "--size"):
+            size = int(a)
+        elif o in ("-l", "--length"):
+            length = int(a)
+        elif o in ("-n", "--phrases"):
+            count = int(a)
+        elif o in ("-o", "--output"):
+            output = a
+        elif o == "--seed":
+            seed = int(a)
+        elif o in ("-v", "--verbose"):
+            verbose = True
+
+    logging.basicConfig(
+        level=logging.INFO if verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if not verbose:
+        logging.getLogger('thaime').setLevel(logging.WARNING)
+
+    report = run(size, length, count, seed)
+    print_summary(report, sys.stderr)
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+User learning benchmark
+
+Measures what the user frequency overlay costs on the keystroke path
+(``learn`` on commit, ``adjust`` on lookup), how long a full overlay takes
+to write and to reload at startup, and how many writes a typing session
+turns into once commits are debounced. Words are picked from a Zipf curve
+over a vocabulary larger than the overlay, so eviction runs throughout.
+"""
+
+import getopt
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synthetic
+from bench_engine import percentile
+from user_learning import DEFAULT_CAPACITY, UserFrequencies
+
+DEFAULT_COMMITS = 50000
+VOCABULARY_FACTOR = 4
+
+logger = logging.getLogger('thaime.bench')
+
+## ========================================================================== ##
+## MEASUREMENTS
+## ========================================================================== ##
+
+def vocabulary(size, seed):
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add(synthetic.thai_word(rng))
+    return sorted(words)
+
+
+def summarize(samples):
+    samples.sort()
+    return {
+        'p50_us': percentile(samples, 0.50) / 1000,
+        'p99_us': percentile(samples, 0.99) / 1000,
+        'max_us': samples[-1] / 1000 if samples else 0.0,
+    }
+
+
+def run(capacity, commits, seed, workdir):
+    rng = random.Random(seed)
+    words = vocabulary(capacity * VOCABULARY_FACTOR, seed)
+    weights = [1 / rank for rank in range(1, len(words) + 1)]
+    path = os.path.join(workdir, 'user.json')
+
+    # Debounce shortened so a burst of typing and the pause after it fit in the run
+    overlay = UserFrequencies(path, capacity=capacity, flush_delay=0.05, max_delay=0.5)
+    learn_ns = []
+    adjust_ns = []
+    picks = rng.choices(words, weights=weights, k=commits)
+    logger.info(f"Committing {commits} words from a vocabulary of {len(words)}")
+    for index, word in enumerate(picks):
+        candidates = [(candidate, 100) for candidate in rng.sample(words, 4)] + [(word, 100)]
+        start = time.perf_counter_ns()
+        overlay.adjust(candidates)
+        adjust_ns.append(time.perf_counter_ns() - start)
+
+        start = time.perf_counter_ns()
+        overlay.learn(word)
+        learn_ns.append(time.perf_counter_ns() - start)
+
+        # A pause after every sentence or so lets the writer catch up
+        if index % 2000 == 1999:
+            time.sleep(0.1)
+    overlay.close()
+    size = len(overlay)
+
+    writes = overlay.writes
+
+    # One more change, written directly, to time a full rewrite
+    overlay.learn(picks[0])
+    start = time.perf_counter()
+    overlay.flush()
+    write_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    reloaded = UserFrequencies(path, capacity=capacity)
+    reloaded.load()
+    load_ms = (time.perf_counter() - start) * 1000
+
+    return {
+        'benchmark': 'user_learning',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'capacity': capacity,
+        'commits': commits,
+        'vocabulary': len(words),
+        'words_kept': size,
+        'writes': writes,
+        'file_bytes': os.path.getsize(path),
+        'write_ms': write_ms,
+        'load_ms': load_ms,
+        'reloaded_words': len(reloaded),
+        'learn': summarize(learn_ns),
+        'adjust': summarize(adjust_ns),
+    }
+
+
+def print_summary(report, out):
+    print(f"{report['commits']} commits -> {report['writes']} writes, "
+          f"{report['words_kept']} of {report['vocabulary']} words kept (capacity {report['capacity']})",
+          file=out)
+    print(f"file {report['file_bytes']} bytes, write {report['write_ms']:.1f} ms, "
+          f"load {report['load_ms']:.1f} ms ({report['reloaded_words']} words)", file=out)
+    print(f"{'':>8} {'p50 us':>8} {'p99 us':>8} {'max us':>8}", file=out)
+    for name in ('learn', 'adjust'):
+        row = report[name]
+        print(f"{name:>8} {row['p50_us']:>8.2f} {row['p99_us']:>8.2f} {row['max_us']:>8.1f}", file=out)
+
+## ========================================================================== ##
+## COMMAND LINE
+## ========================================================================== ##
+
+def print_help(out, v=0):
+    print("Usage: bench_user_learning.py [options]", file=out)
+    print("-c, --capacity N       words kept by the overlay (default 10000).", file=out)
+    print("-n, --commits N        candidates committed (default 50000).", file=out)
+    print("-o, --output FILE      write the JSON report to FILE instead of stdout.", file=out)
+    print("    --seed N           random seed for the vocabulary and picks.", file=out)
+    print("-v, --verbose          log progress.", file=out)
+    print("-h, --help             show this message.", file=out)
+    sys.exit(v)
+
+def main():
+    capacity = DEFAULT_CAPACITY
+    commits = DEFAULT_COMMITS
+    output = None
+    seed = 0
+    verbose = False
+
+    shortopt = "c:n:o:vh"
+    longopt = ["capacity=", "commits=", "output=", "seed=", "verbose", "help"]
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], shortopt, longopt)
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        print_help(sys.stderr, 1)
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print_help(sys.stdout)
+        elif o in ("-c", "--capacity"):
+            capacity = int(a)
+        elif o in ("-n", "--commits"):
+            commits = int(a)
+        elif o in ("-o", "--output"):
+            output = a
+        elif o == "--seed":
+            seed = int(a)
+        elif o in ("-v", "--verbose"):
+            verbose = True
+
+    logging.basicConfig(
+        level=logging.INFO if verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    with tempfile.TemporaryDirectory(prefix='thaime-bench-') as workdir:
+        report = run(capacity, commits, seed, workdir)
+    print_summary(report, sys.stderr)
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
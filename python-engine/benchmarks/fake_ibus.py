@@ -0,0 +1,477 @@
+"""
+In-process stand-in for the IBus and GLib GObject APIs
+
+This module provides just enough of ``gi.repository.IBus``,
+``gi.repository.GLib`` and ``gi.repository.Gio`` to construct
+``engine.Engine`` and feed it key events without an ibus-daemon. Every call
+the engine makes towards IBus is recorded, and GLib sources are queued in a
+main loop that the caller drains explicitly. File monitors never see the
+file system; ``file_changed`` delivers their events instead.
+
+Call ``install()`` before importing any engine module.
+"""
+
+import collections
+import heapq
+import itertools
+import os
+import sys
+import threading
+import types
+
+## ========================================================================== ##
+## CALL RECORDING
+## ========================================================================== ##
+
+class Recorder:
+    """Counts IBus calls and GObject allocations made by the engine"""
+
+    def __init__(self):
+        self.calls = collections.Counter()
+        self.objects = collections.Counter()
+        self.committed = []
+        self.keep_commits = True
+
+    def call(self, name):
+        self.calls[name] += 1
+
+    def allocate(self, type_name):
+        self.objects[type_name] += 1
+
+    def commit(self, text):
+        self.calls['commit_text'] += 1
+        if self.keep_commits:
+            self.committed.append(text)
+
+    def reset(self):
+        self.calls.clear()
+        self.objects.clear()
+        self.committed.clear()
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def total_objects(self):
+        return sum(self.objects.values())
+
+
+RECORDER = Recorder()
+
+## ========================================================================== ##
+## GLIB
+## ========================================================================== ##
+
+class MainLoop:
+    """Priority-ordered queue of idle and timeout sources, drained on demand"""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__ids = itertools.count(1)
+        self.__order = itertools.count()
+        self.__queue = []
+        self.__sources = {}
+
+    def add(self, function, args, priority):
+        with self.__lock:
+            source_id = next(self.__ids)
+            self.__sources[source_id] = (function, args)
+            heapq.heappush(self.__queue, (priority, next(self.__order), source_id))
+            return source_id
+
+    def remove(self, source_id):
+        with self.__lock:
+            return self.__sources.pop(source_id, None) is not None
+
+    def pending(self):
+        with self.__lock:
+            return bool(self.__sources)
+
+    def iteration(self):
+        """Dispatch the highest priority source; return whether one ran"""
+        with self.__lock:
+            while self.__queue:
+                priority, _, source_id = heapq.heappop(self.__queue)
+                if source_id in self.__sources:
+                    function, args = self.__sources.pop(source_id)
+                    break
+            else:
+                return False
+
+        if function(*args):
+            # Sources returning True stay installed, like GLib.SOURCE_CONTINUE
+            with self.__lock:
+                self.__sources[source_id] = (function, args)
+                heapq.heappush(self.__queue, (priority, next(self.__order), source_id))
+        return True
+
+    def drain(self, limit=10000):
+        """Run sources until the queue is empty or ``limit`` dispatches happened"""
+        count = 0
+        while count < limit and self.iteration():
+            count += 1
+        return count
+
+
+MAIN_LOOP = MainLoop()
+
+
+def _build_glib():
+    glib = types.ModuleType('gi.repository.GLib')
+    glib.PRIORITY_HIGH = -100
+    glib.PRIORITY_DEFAULT = 0
+    glib.PRIORITY_HIGH_IDLE = 100
+    glib.PRIORITY_DEFAULT_IDLE = 200
+    glib.PRIORITY_LOW = 300
+    glib.SOURCE_CONTINUE = True
+    glib.SOURCE_REMOVE = False
+
+    def idle_add(function, *args, priority=glib.PRIORITY_DEFAULT_IDLE):
+        return MAIN_LOOP.add(function, args, priority)
+
+    def timeout_add(interval, function, *args, priority=glib.PRIORITY_DEFAULT):
+        return MAIN_LOOP.add(function, args, priority)
+
+    def timeout_add_seconds(interval, function, *args, priority=glib.PRIORITY_DEFAULT):
+        return MAIN_LOOP.add(function, args, priority)
+
+    def source_remove(source_id):
+        return MAIN_LOOP.remove(source_id)
+
+    def unix_signal_add(priority, signum, handler, *args):
+        # Signals never arrive in-process; hand out an id that is never dispatched
+        return 0
+
+    class FakeMainLoop:
+        def run(self):
+            MAIN_LOOP.drain()
+
+        def quit(self):
+            pass
+
+    glib.idle_add = idle_add
+    glib.timeout_add = timeout_add
+    glib.timeout_add_seconds = timeout_add_seconds
+    glib.source_remove = source_remove
+    glib.unix_signal_add = unix_signal_add
+    glib.MainLoop = FakeMainLoop
+    return glib
+
+## ========================================================================== ##
+## GIO
+## ========================================================================== ##
+
+# Directory monitors created by the engine, by monitored path
+MONITORS = collections.defaultdict(list)
+
+
+def file_changed(path, event_type, other_path=None):
+    """Queue a file monitor event for ``path`` on the main loop, as inotify would"""
+    gio = sys.modules['gi.repository.Gio']
+    other = gio.File.new_for_path(other_path) if other_path else None
+    directory = os.path.dirname(os.path.abspath(path))
+    for monitor in list(MONITORS.get(directory, ())):
+        MAIN_LOOP.add(monitor.emit, (gio.File.new_for_path(path), other, event_type), 0)
+
+
+def _build_gio():
+    gio = types.ModuleType('gi.repository.Gio')
+
+    class FileMonitorEvent:
+        CHANGED = 0
+        CHANGES_DONE_HINT = 1
+        DELETED = 2
+        CREATED = 3
+        ATTRIBUTE_CHANGED = 4
+        PRE_UNMOUNT = 5
+        UNMOUNTED = 6
+        MOVED = 7
+        RENAMED = 8
+        MOVED_IN = 9
+        MOVED_OUT = 10
+
+    class FileMonitorFlags:
+        NONE = 0
+        WATCH_MOUNTS = 1
+        SEND_MOVED = 2
+        WATCH_HARD_LINKS = 4
+        WATCH_MOVES = 8
+
+    class File:
+        def __init__(self, path):
+            self.path = os.path.abspath(path)
+
+        @classmethod
+        def new_for_path(cls, path):
+            return cls(path)
+
+        def get_path(self):
+            return self.path
+
+        def get_basename(self):
+            return os.path.basename(self.path)
+
+        def monitor_directory(self, flags, cancellable):
+            RECORDER.allocate('FileMonitor')
+            monitor = FileMonitor(self.path)
+            MONITORS[self.path].append(monitor)
+            return monitor
+
+    class FileMonitor:
+        def __init__(self, path):
+            self.path = path
+            self.handlers = []
+            self.cancelled = False
+
+        def connect(self, signal, callback, *args):
+            self.handlers.append((callback, args))
+            return len(self.handlers)
+
+        def emit(self, file, other_file, event_type):
+            if not self.cancelled:
+                for callback, args in self.handlers:
+                    callback(self, file, other_file, event_type, *args)
+            return False
+
+        def cancel(self):
+            self.cancelled = True
+            if self in MONITORS.get(self.path, ()):
+                MONITORS[self.path].remove(self)
+            return True
+
+    for name, value in list(locals().items()):
+        if isinstance(value, type):
+            setattr(gio, name, value)
+    return gio
+
+## ========================================================================== ##
+## IBUS
+## ========================================================================== ##
+
+# Key symbols the engine and the trace files refer to by name
+KEYVALS = {
+    'BackSpace': 0xff08, 'Tab': 0xff09, 'Return': 0xff0d, 'Escape': 0xff1b,
+    'Left': 0xff51, 'Up': 0xff52, 'Right': 0xff53, 'Down': 0xff54,
+    'Page_Up': 0xff55, 'Page_Down': 0xff56, 'KP_Enter': 0xff8d, 'space': 0x20,
+}
+KEYVALS.update((str(digit), ord(str(digit))) for digit in range(10))
+
+def _build_ibus():
+    ibus = types.ModuleType('gi.repository.IBus')
+
+    class ModifierType:
+        SHIFT_MASK = 1 << 0
+        LOCK_MASK = 1 << 1
+        CONTROL_MASK = 1 << 2
+        MOD1_MASK = 1 << 3
+        RELEASE_MASK = 1 << 30
+
+    class PropType:
+        NORMAL, TOGGLE, RADIO, MENU, SEPARATOR = range(5)
+
+    class PropState:
+        UNCHECKED, CHECKED, INCONSISTENT = range(3)
+
+    class Orientation:
+        HORIZONTAL, VERTICAL, SYSTEM = range(3)
+
+    class Text:
+        def __init__(self, text):
+            RECORDER.allocate('Text')
+            self.text = text
+
+        @classmethod
+        def new_from_string(cls, text):
+            return cls(text)
+
+        def get_text(self):
+            return self.text
+
+    class LookupTable:
+        def __init__(self, page_size=5, cursor_pos=0, cursor_visible=True, round=True):
+            RECORDER.allocate('LookupTable')
+            self.page_size = page_size
+            self.cursor_pos = cursor_pos
+            self.cursor_visible = cursor_visible
+            self.round = round
+            self.orientation = Orientation.SYSTEM
+            self.candidates = []
+
+        @classmethod
+        def new(cls, page_size, cursor_pos, cursor_visible, round):
+            return cls(page_size, cursor_pos, cursor_visible, round)
+
+        def clear(self):
+            self.candidates.clear()
+            self.cursor_pos = 0
+
+        def append_candidate(self, text):
+            self.candidates.append(text)
+
+        def get_candidate(self, index):
+            if 0 <= index < len(self.candidates):
+                return self.candidates[index]
+            return None
+
+        def get_number_of_candidates(self):
+            return len(self.candidates)
+
+        def get_cursor_pos(self):
+            return self.cursor_pos
+
+        def set_cursor_pos(self, cursor_pos):
+            self.cursor_pos = cursor_pos
+
+        def get_cursor_in_page(self):
+            return self.cursor_pos % self.page_size
+
+        def get_page_size(self):
+            return self.page_size
+
+        def set_page_size(self, page_size):
+            self.page_size = page_size
+
+        def set_orientation(self, orientation):
+            self.orientation = orientation
+
+        def cursor_up(self):
+            if self.cursor_pos > 0:
+                self.cursor_pos -= 1
+            elif self.round and self.candidates:
+                self.cursor_pos = len(self.candidates) - 1
+            else:
+                return False
+            return True
+
+        def cursor_down(self):
+            if self.cursor_pos + 1 < len(self.candidates):
+                self.cursor_pos += 1
+            elif self.round and self.candidates:
+                self.cursor_pos = 0
+            else:
+                return False
+            return True
+
+        def page_up(self):
+            if self.cursor_pos < self.page_size:
+                return False
+            self.cursor_pos -= self.page_size
+            return True
+
+        def page_down(self):
+            page_start = self.cursor_pos - self.cursor_pos % self.page_size
+            if page_start + self.page_size >= len(self.candidates):
+                return False
+            self.cursor_pos = min(self.cursor_pos + self.page_size, len(self.candidates) - 1)
+            return True
+
+    class Property:
+        def __init__(self, **kwargs):
+            RECORDER.allocate('Property')
+            self.__dict__.update(kwargs)
+
+        def get_key(self):
+            return self.key
+
+        def get_state(self):
+            return self.state
+
+        def set_state(self, state):
+            self.state = state
+
+    class PropList:
+        def __init__(self):
+            self.properties = []
+
+        def append(self, prop):
+            self.properties.append(prop)
+
+    class Engine:
+        def __init__(self, connection=None, object_path=None):
+            self.object_path = object_path
+
+        def get_object_path(self):
+            return self.object_path
+
+        def commit_text(self, text):
+            RECORDER.commit(text.get_text())
+
+        def update_preedit_text(self, text, cursor_pos, visible):
+            RECORDER.call('update_preedit_text')
+
+        def hide_preedit_text(self):
+            RECORDER.call('hide_preedit_text')
+
+        def update_lookup_table(self, table, visible):
+            RECORDER.call('update_lookup_table')
+
+        def hide_lookup_table(self):
+            RECORDER.call('hide_lookup_table')
+
+        def register_properties(self, props):
+            RECORDER.call('register_properties')
+
+        def update_property(self, prop):
+            RECORDER.call('update_property')
+
+        def do_destroy(self):
+            pass
+
+        def destroy(self):
+            self.do_destroy()
+
+    class Factory:
+        def __init__(self, bus=None):
+            self.bus = bus
+
+        def do_destroy(self):
+            pass
+
+        def destroy(self):
+            self.do_destroy()
+
+    class Bus:
+        def get_connection(self):
+            return None
+
+        def connect(self, signal, callback, *args):
+            return 0
+
+        def request_name(self, name, flags):
+            return 1
+
+        def register_component(self, component):
+            return True
+
+    for name, value in list(locals().items()):
+        if isinstance(value, type):
+            setattr(ibus, name, value)
+
+    for name, keyval in KEYVALS.items():
+        setattr(ibus, f"KEY_{name}", keyval)
+    return ibus
+
+
+## ========================================================================== ##
+## INSTALLATION
+## ========================================================================== ##
+
+def install():
+    """Register the stand-in as ``gi`` in ``sys.modules``"""
+    if getattr(sys.modules.get('gi'), 'FAKE', False):
+        return
+
+    gi = types.ModuleType('gi')
+    gi.FAKE = True
+    gi.require_version = lambda namespace, version: None
+
+    repository = types.ModuleType('gi.repository')
+    repository.GLib = _build_glib()
+    repository.IBus = _build_ibus()
+    repository.Gio = _build_gio()
+    gi.repository = repository
+
+    sys.modules['gi'] = gi
+    sys.modules['gi.repository'] = repository
+    sys.modules['gi.repository.GLib'] = repository.GLib
+    sys.modules['gi.repository.IBus'] = repository.IBus
+    sys.modules['gi.repository.Gio'] = repository.Gio
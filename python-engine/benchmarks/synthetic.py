@@ -0,0 +1,85 @@
+"""
+Synthetic dictionaries for benchmarking
+
+Romanized keys are built from Thai-like syllables (onset, vowel, final)
+so the trie has a realistic shape, and frequencies follow a Zipf curve.
+Generation is seeded and fully deterministic.
+"""
+
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dictionary import Dictionary
+
+ONSETS = (
+    'k', 'kh', 'ng', 'j', 'ch', 's', 'd', 't', 'th', 'n', 'b', 'p', 'ph',
+    'f', 'm', 'y', 'r', 'l', 'w', 'h', 'kr', 'khr', 'pl', 'phr', 'tr', '',
+)
+VOWELS = (
+    'a', 'aa', 'i', 'ii', 'ue', 'u', 'uu', 'e', 'ee', 'ae', 'o', 'oo', 'oe',
+    'ia', 'uea', 'ua', 'ai', 'ao', 'am',
+)
+FINALS = ('', '', 'k', 'ng', 'n', 'm', 't', 'p', 'i', 'o')
+
+# Consonants and vowels used to spell the fake Thai words
+THAI_CONSONANTS = [chr(c) for c in range(0x0e01, 0x0e2f)]
+THAI_VOWELS = ['ะ', 'า', 'ิ', 'ี', 'ึ', 'ื', 'ุ', 'ู', 'เ', 'แ', 'โ', 'ไ', 'ใ']
+
+
+def syllable(rng):
+    return rng.choice(ONSETS) + rng.choice(VOWELS) + rng.choice(FINALS)
+
+
+def thai_word(rng):
+    return ''.join(
+        rng.choice(THAI_CONSONANTS) + rng.choice(THAI_VOWELS)
+        for _ in range(rng.randint(1, 3))
+    )
+
+
+def generate_entries(size, seed=0, extra_keys=()):
+    """
+    Generate a trie.json style mapping with about ``size`` keys.
+
+    Args:
+        size (int): Number of distinct romanized keys
+        seed (int): Random seed
+        extra_keys (iterable): Keys that must be present, e.g. trace words
+
+    Returns:
+        dict: Romanized key -> list of [thai_word, frequency]
+    """
+    rng = random.Random(seed)
+    keys = set(extra_keys)
+    while len(keys) < size:
+        keys.add(''.join(syllable(rng) for _ in range(rng.choice((1, 1, 2, 2, 2, 3)))))
+
+    entries = {}
+    for rank, key in enumerate(sorted(keys), start=1):
+        candidates = []
+        for _ in range(rng.choice((1, 1, 1, 2, 2, 3, 5))):
+            # Zipf-like frequency over a shuffled rank
+            frequency = max(1, int(1_000_000 / rng.randint(1, size + 1)))
+            candidates.append([thai_word(rng), frequency])
+        entries[key] = candidates
+    return entries
+
+
+def write_dictionary(entries, directory, backend):
+    """Write ``entries`` into ``directory`` as trie.json or trie.bin; return the path"""
+    os.makedirs(directory, exist_ok=True)
+    if backend == 'json':
+        path = os.path.join(directory, 'trie.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False)
+    elif backend == 'bin':
+        path = os.path.join(directory, 'trie.bin')
+        # Compiled like dictionary.py does, so both backends hold the same keys
+        Dictionary.from_entries(entries, normalize=True).save(path)
+    else:
+        raise ValueError(f"Unknown dictionary backend: {backend}")
+    return path
@@ -0,0 +1,68 @@
+"""
+Thaime Caches
+
+This module provides the bounded caches used on the keystroke path.
+"""
+
+import collections
+
+
+class LRUCache:
+    """Bounded least-recently-used mapping with hit, miss and eviction counters"""
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError(f"LRUCache capacity must be positive, got {capacity}")
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+    def get(self, key, default=None):
+        """Return the cached value for ``key`` and mark it most recently used"""
+        try:
+            value = self.__entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.__entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store ``value`` under ``key``, evicting the least recently used entry if full"""
+        self.__entries[key] = value
+        self.__entries.move_to_end(key)
+        if len(self.__entries) > self.capacity:
+            self.__entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Drop every entry, keeping the counters"""
+        self.__entries.clear()
+
+    def discard_if(self, predicate):
+        """Drop the entries whose value satisfies ``predicate`` and return how many"""
+        stale = [key for key, value in self.__entries.items() if predicate(value)]
+        for key in stale:
+            del self.__entries[key]
+        return len(stale)
+
+    def stats(self):
+        """Return the cache counters as a dict"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.__entries),
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
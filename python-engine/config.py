@@ -0,0 +1,48 @@
+"""
+Thaime Configuration
+
+Runtime options are read from environment variables, so they reach the
+engine the same way whether it is started by hand or launched by IBus.
+"""
+
+import logging
+import os
+
+logger = logging.getLogger('thaime.config')
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+FALSE_VALUES = ('', '0', 'false', 'no', 'off')
+
+
+def env_flag(name, default=False):
+    """Return environment variable ``name`` as a boolean"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    value = value.strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    logger.warning(f"Ignoring {name}={value!r}, expected one of {TRUE_VALUES + FALSE_VALUES}")
+    return default
+
+
+def env_int(name, default):
+    """Return environment variable ``name`` as an integer"""
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.warning(f"Ignoring {name}={value!r}, expected an integer")
+        return default
+
+
+def env_str(name, default=None):
+    """Return environment variable ``name``, or ``default`` when unset or empty"""
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    return value
@@ -0,0 +1,545 @@
+"""
+Thaime Conversion
+
+This module provides candidate generation off the GLib main loop. Each
+engine owns a Converter holding its trie cursor, phrase segmenter and
+candidate cache; only the shared worker thread touches them. The main loop
+submits a request per preedit change, numbered by a per-engine generation
+counter, and carries on handling keys. Requests overtaken by a newer
+generation are dropped before they start and abandoned between stages,
+and results reach the engine through its callback, which hands them back
+to the main loop.
+
+A key that must act on the current candidates, such as Return, waits for
+the request of the current generation instead, so it commits what a
+synchronous lookup would have returned. The wait is bounded: should the
+worker be slow or stuck, navigation keys act on the candidates last shown,
+and keys that commit convert the preedit on the main loop with a converter
+of their own.
+
+With a RemoteDictionary the matches come from the conversion server, and
+from the in-process fallback when it does not answer; ranking is the same
+either way.
+
+While the user pauses, the engine asks for the preedits its likeliest next
+letters would make to be converted ahead of time, ranked by how much of the
+dictionary lies under each trie branch. Each prefetch job runs for one time
+slice and stops as soon as a real key arrives; the results wait in a
+memory-capped cache next to the candidate cache.
+"""
+
+import collections
+import functools
+import logging
+import queue
+import string
+import sys
+import threading
+import time
+
+from cache import LRUCache
+from config import env_int
+from conversion_client import RemoteDictionary, ServerUnavailable
+from dictionary import NO_NODE, ROOT, TrieCursor
+from fuzzy import fuzzy_candidates
+from instrumentation import STATS
+from language_model import rerank
+from profiling import PROFILER
+from romanization import normalize
+from segmenter import Segmenter
+from user_learning import USER_FREQUENCIES
+
+# Multi-word conversions of the whole preedit offered as candidates
+PHRASE_CANDIDATES = 5
+
+# Time a typo-tolerant lookup may take per keystroke, in microseconds
+FUZZY_BUDGET_US = env_int('THAIME_FUZZY_BUDGET_US', 5000)
+
+# Longest a key waits on the main loop for the candidates of the current preedit
+WAIT_TIMEOUT_MS = env_int('THAIME_CONVERSION_WAIT_MS', 50)
+
+# Interpreter switch interval while the worker has work queued, in seconds; a key
+# arriving mid-conversion waits at most this long for the main loop to get the GIL back
+SWITCH_INTERVAL = 0.001
+
+# Next letters whose candidates are computed while the user pauses; 0 disables prefetching
+PREFETCH_LETTERS = env_int('THAIME_PREFETCH_LETTERS', 6)
+# Work done per prefetch job before yielding back to the main loop, in microseconds;
+# a conversion already started runs to its end
+PREFETCH_SLICE_US = env_int('THAIME_PREFETCH_SLICE_US', 2000)
+# Memory held by prefetched candidates of one engine, in kilobytes
+PREFETCH_KB = env_int('THAIME_PREFETCH_KB', 256)
+
+logger = logging.getLogger('thaime.conversion')
+
+ConversionRequest = collections.namedtuple('ConversionRequest', (
+    'generation',    # Engine generation this request was made for
+    'text',          # Canonical preedit
+    'context',       # Preceding words, for the language model
+    'dictionary',    # Dictionary of the engine when the request was made
+    'language_model',
+    'page_size',     # Candidates to produce before the result is handed over
+))
+
+TailRequest = collections.namedtuple('TailRequest', (
+    'generation',    # Engine generation this request was made for
+    'stream',        # CandidateStream whose tail the engine is paging into
+))
+
+PrefetchRequest = collections.namedtuple('PrefetchRequest', (
+    'base',          # ConversionRequest of the current preedit
+    'preedit',       # Preedit as typed, before normalization
+    'rules',         # Normalization rules of the engine's dictionary
+))
+
+
+class CandidateStream:
+    """Candidate words, with a typo-tolerant tail searched on the worker once it is needed"""
+
+    def __init__(self, words, tail=None, alive=True):
+        """
+        Args:
+            words (list): Candidates known when the stream is made
+            tail (callable): Zero-argument function returning the words
+                that follow; run on the worker thread only
+            alive (bool): Whether typing on can still reach a dictionary
+                key or phrase; typo-tolerant matches aside
+        """
+        self.__words = words
+        self.__tail = tail
+        self.alive = alive
+
+    def __len__(self):
+        return len(self.__words)
+
+    def __getitem__(self, index):
+        return self.__words[index]
+
+    @property
+    def pending(self):
+        """Whether the tail is still to be searched"""
+        return self.__tail is not None
+
+    def contains_any(self, words):
+        """Whether any of ``words`` is among the candidates known so far"""
+        return not words.isdisjoint(self.__words)
+
+    def size(self):
+        """Approximate memory held by the candidates, in bytes"""
+        return sys.getsizeof(self.__words) + sum(map(sys.getsizeof, self.__words))
+
+    def extend(self):
+        """Search the tail and append its words; worker thread only"""
+        tail = self.__tail
+        if tail is None:
+            return
+        try:
+            # Readers on the main loop see either the old list or the whole new one
+            self.__words = self.__words + list(tail())
+        finally:
+            self.__tail = None
+
+
+EMPTY_STREAM = CandidateStream([])
+
+
+class Converter:
+    """Candidate generation state of one engine, used by the worker thread only"""
+
+    def __init__(self, cache_size):
+        # Current generation; advanced by the main loop, read by the worker
+        self.generation = 0
+        self.__dictionary = None
+        self.__language_model = None
+        self.__cursor = None
+        self.__segmenter = None
+        self.__text = ''
+        self.__cache = LRUCache(cache_size)
+        # USER_FREQUENCIES.version the cached rankings are up to date with
+        self.__user_version = 0
+
+        # Candidates computed ahead of the next key: cache key -> (stream, bytes)
+        self.__prefetched = collections.OrderedDict()
+        self.__prefetched_bytes = 0
+        # Next preedits still to prefetch, and the generation they follow
+        self.__plan = []
+        self.__plan_generation = 0
+
+        # Last finished result, for callers that cannot wait for the callback
+        self.__condition = threading.Condition()
+        self.__result_generation = 0
+        self.__result = EMPTY_STREAM
+
+    def advance(self):
+        """Start a new generation, making every earlier request stale; main loop only"""
+        self.generation += 1
+        return self.generation
+
+    def cancelled(self, request):
+        """Whether a newer request has been submitted since ``request``"""
+        return request.generation != self.generation
+
+    def convert(self, request):
+        """
+        Return the candidate stream for ``request``, with its first page produced.
+
+        Args:
+            request (ConversionRequest): What to convert
+
+        Returns:
+            CandidateStream: The candidates, or None if the request was
+                overtaken by a newer one midway
+        """
+        self.__use(request.dictionary, request.language_model)
+        STATS.count('lookups')
+        # Spelling variants share one cache entry; the ranking also depends on the context
+        context = self.__context(request)
+        cache_key = (request.text, context)
+        stream = self.__cache.get(cache_key)
+        if stream is not None:
+            STATS.count('cache_hits')
+            return stream
+        STATS.count('cache_misses')
+
+        entry = self.__prefetched.pop(cache_key, None)
+        if entry is not None:
+            STATS.count('prefetch_hits')
+            self.__prefetched_bytes -= entry[1]
+            self.__cache.put(cache_key, entry[0])
+            return entry[0]
+        if self.__plan_generation:
+            STATS.count('prefetch_misses')
+
+        stream = self.__compute(request, context)
+        if stream is not None and stream is not EMPTY_STREAM:
+            self.__cache.put(cache_key, stream)
+        return stream
+
+    @staticmethod
+    def __context(request):
+        """Model ids of the words before the cursor, part of the cache key"""
+        if request.language_model is not None and request.context:
+            return request.language_model.context_ids(request.context)
+        return ()
+
+    def __compute(self, request, context):
+        """Build the candidate stream of ``request``; None if it was overtaken midway"""
+        dictionary = request.dictionary
+        matches = None
+        if isinstance(dictionary, RemoteDictionary):
+            try:
+                matches = dictionary.lookup(request.text)
+            except ServerUnavailable:
+                dictionary = dictionary.local()
+                if dictionary is None:
+                    # The in-process copy is loading in the background; a later key uses it
+                    return EMPTY_STREAM
+        alive = True
+        if matches is None:
+            self.__seek(dictionary, request.text)
+            alive = self.__cursor.is_alive or self.__segmenter.is_alive
+            exact = self.__cursor.candidates()
+            if self.cancelled(request):
+                return None
+            phrases = self.__phrases()
+            if self.cancelled(request):
+                return None
+            completions = self.__cursor.completions()
+        else:
+            exact, phrases, completions = matches
+        language_model = request.language_model
+
+        # Exact matches first, then multi-word phrases, then predictions for longer keys,
+        # each group ordered by user-adjusted frequency and how well it follows the context
+        exact = rerank(language_model, USER_FREQUENCIES.adjust(exact), context)
+        words = [word for word, _ in exact]
+        seen = set(words)
+        for text in phrases:
+            if text not in seen:
+                seen.add(text)
+                words.append(text)
+        for word, _ in rerank(language_model, USER_FREQUENCIES.adjust(completions), context):
+            if word not in seen:
+                seen.add(word)
+                words.append(word)
+
+        # Typo tolerance comes last and is only searched once a page is not yet full;
+        # paging past the other candidates asks the worker for it with a TailRequest
+        tail = functools.partial(fuzzy_words, request.dictionary, request.text, request.page_size, seen)
+        stream = CandidateStream(words, tail, alive)
+        if len(words) < request.page_size:
+            stream.extend()
+        return stream
+
+    def prefetch(self, request, budget_ns):
+        """
+        Convert the preedits of the likeliest next letters ahead of time.
+
+        The first job of a generation ranks the next letters; each job
+        then converts them in order until ``budget_ns`` is spent or a newer
+        request arrives, and leaves the rest to the next job.
+
+        Args:
+            request (PrefetchRequest): The current preedit
+            budget_ns (int): Time after which no further conversion starts
+
+        Returns:
+            int: Next preedits still to convert, 0 once done or overtaken
+        """
+        deadline = time.perf_counter_ns() + budget_ns
+        base = request.base
+        self.__use(base.dictionary, base.language_model)
+        if self.__plan_generation != base.generation:
+            self.__plan_generation = base.generation
+            self.__plan = self.__next_texts(base.dictionary, base.text, request.preedit, request.rules)
+        context = self.__context(base)
+        limit = PREFETCH_KB * 1024
+        while self.__plan and not self.cancelled(base) and time.perf_counter_ns() < deadline:
+            cache_key = (self.__plan[0], context)
+            if cache_key in self.__cache or cache_key in self.__prefetched:
+                self.__plan.pop(0)
+                continue
+            stream = self.__compute(base._replace(text=self.__plan[0]), context)
+            if stream is None:
+                break
+            self.__plan.pop(0)
+            STATS.count('prefetch_computed')
+            size = stream.size()
+            if size > limit:
+                continue
+            while self.__prefetched_bytes + size > limit:
+                _, (_, evicted) = self.__prefetched.popitem(last=False)
+                self.__prefetched_bytes -= evicted
+                STATS.count('prefetch_evicted')
+            self.__prefetched[cache_key] = (stream, size)
+            self.__prefetched_bytes += size
+        if self.cancelled(base):
+            return 0
+        return len(self.__plan)
+
+    def __next_texts(self, dictionary, text, preedit, rules):
+        """Canonical preedits after the likeliest next letters of ``preedit``, best first"""
+        if isinstance(dictionary, RemoteDictionary):
+            # The trie lives in the server
+            return []
+        self.__seek(dictionary, text)
+        here = self.__cursor.node
+        weights = {}
+        for letter in string.ascii_lowercase:
+            # A letter may rewrite the end of the canonical text, 'h' after 'p' for one
+            following = normalize(preedit + letter, rules)
+            if following == text or following in weights:
+                continue
+            if following.startswith(text) and here != NO_NODE:
+                node = dictionary.walk(here, following[len(text):])
+            else:
+                node = dictionary.walk(ROOT, following)
+            if node != NO_NODE:
+                weights[following] = dictionary.weight(node)
+        ranked = sorted(weights, key=weights.get, reverse=True)
+        return ranked[:PREFETCH_LETTERS]
+
+    def matches(self, dictionary, text):
+        """
+        Return what ``dictionary`` holds for ``text``, before any user or context ranking.
+
+        Args:
+            dictionary (Dictionary): A loaded dictionary
+            text (str): Canonical preedit
+
+        Returns:
+            tuple: Exact (word, frequency) pairs, phrase texts, and
+                completion (word, frequency) pairs
+        """
+        self.__seek(dictionary, text)
+        return self.__cursor.candidates(), self.__phrases(), self.__cursor.completions()
+
+    def __phrases(self):
+        return [''.join(words) for words, _ in self.__segmenter.phrases(PHRASE_CANDIDATES)]
+
+    def __use(self, dictionary, language_model):
+        """Switch to the dictionary and model of a request, dropping what depended on the old ones"""
+        if dictionary is not self.__dictionary:
+            self.__dictionary = dictionary
+            self.__clear()
+        if language_model is not self.__language_model:
+            self.__language_model = language_model
+            self.__clear()
+        self.__sync_user_frequencies()
+
+    def __sync_user_frequencies(self):
+        """Drop the cached candidates holding a word the user picked since they were ranked"""
+        words, version = USER_FREQUENCIES.changed_since(self.__user_version)
+        if version == self.__user_version:
+            return
+        self.__user_version = version
+        if words is None:
+            self.__clear()
+            return
+        dropped = self.__cache.discard_if(lambda stream: stream.contains_any(words))
+        for cache_key, (stream, size) in list(self.__prefetched.items()):
+            if stream.contains_any(words):
+                del self.__prefetched[cache_key]
+                self.__prefetched_bytes -= size
+                dropped += 1
+        STATS.count('cache_user_evictions', dropped)
+
+    def __clear(self):
+        self.__cache.clear()
+        self.__prefetched.clear()
+        self.__prefetched_bytes = 0
+        self.__plan = []
+        self.__plan_generation = 0
+
+    def __seek(self, dictionary, text):
+        """Move the cursor and segmenter to ``text`` in ``dictionary``, reusing the common prefix"""
+        if self.__cursor is None or self.__cursor.dictionary is not dictionary:
+            self.__cursor = TrieCursor(dictionary)
+            self.__segmenter = Segmenter(dictionary)
+            self.__text = ''
+        common = 0
+        for old, new in zip(self.__text, text):
+            if old != new:
+                break
+            common += 1
+        for _ in range(len(self.__text) - common):
+            self.__cursor.pop()
+            self.__segmenter.pop()
+        for char in text[common:]:
+            self.__cursor.push(char)
+            self.__segmenter.push(char)
+        self.__text = text
+
+    def publish(self, generation, stream):
+        """Record a finished result and wake anyone waiting for it"""
+        with self.__condition:
+            if generation > self.__result_generation:
+                self.__result_generation = generation
+                self.__result = stream
+            self.__condition.notify_all()
+
+    def wait(self, generation, timeout=None):
+        """Block until the result of ``generation`` is ready and return it, or None on timeout"""
+        with self.__condition:
+            if not self.__condition.wait_for(lambda: self.__result_generation >= generation, timeout):
+                return None
+            return self.__result
+
+
+def fuzzy_words(dictionary, text, limit, seen):
+    """Generate typo-tolerant matches of ``text`` not already in ``seen``"""
+    if FUZZY_BUDGET_US <= 0:
+        return
+    words = None
+    if isinstance(dictionary, RemoteDictionary):
+        try:
+            words = dictionary.fuzzy(text, limit)
+        except ServerUnavailable:
+            dictionary = dictionary.local()
+            if dictionary is None:
+                return
+    if words is None:
+        fuzzy, searches = fuzzy_candidates(dictionary, text, limit, FUZZY_BUDGET_US * 1000)
+        STATS.count('fuzzy_searches', len(searches))
+        if not all(search.complete for search in searches):
+            STATS.count('fuzzy_budget_exceeded')
+        words = [word for word, _, _ in fuzzy]
+    for word in words:
+        if word not in seen:
+            seen.add(word)
+            yield word
+
+
+class ConversionWorker:
+    """Process-wide thread running conversion requests in submission order"""
+
+    def __init__(self):
+        self.__queue = queue.SimpleQueue()
+        self.__lock = threading.Lock()
+        self.__thread = None
+
+    def submit(self, converter, request, callback):
+        """
+        Queue ``request``; a later ``converter.advance()`` makes it stale.
+
+        Args:
+            converter (Converter): State of the engine making the request
+            request (ConversionRequest): What to convert, a TailRequest
+                to extend a stream, or a PrefetchRequest for one prefetch job
+            callback (callable): Called on the worker thread with the
+                generation and the CandidateStream, or for a prefetch job
+                the number of preedits left; it must hand them back to the
+                main loop
+        """
+        self.__start()
+        self.__queue.put((converter, request, callback))
+
+    def __start(self):
+        with self.__lock:
+            if self.__thread is not None:
+                return
+            self.__thread = threading.Thread(target=self.__run, name='thaime-conversion', daemon=True)
+            self.__thread.start()
+
+    def __run(self):
+        while True:
+            job = self.__queue.get()
+            # Only for a burst of work; the process keeps its own interval while idle
+            default_interval = sys.getswitchinterval()
+            sys.setswitchinterval(SWITCH_INTERVAL)
+            try:
+                while job is not None:
+                    PROFILER.run_profiled(self.__handle, *job)
+                    try:
+                        job = self.__queue.get_nowait()
+                    except queue.Empty:
+                        job = None
+            finally:
+                sys.setswitchinterval(default_interval)
+
+    def __handle(self, converter, request, callback):
+        if isinstance(request, PrefetchRequest):
+            self.__prefetch(converter, request, callback)
+            return
+        if isinstance(request, TailRequest):
+            self.__extend(converter, request, callback)
+            return
+        if converter.cancelled(request):
+            STATS.count('conversions_cancelled')
+            return
+        try:
+            stream = converter.convert(request)
+        except Exception:
+            # A waiting keystroke must never hang on a failed conversion
+            logger.exception(f"Conversion of '{request.text}' failed")
+            stream = EMPTY_STREAM
+        if stream is None:
+            STATS.count('conversions_cancelled')
+            return
+        converter.publish(request.generation, stream)
+        callback(request.generation, stream)
+
+    @staticmethod
+    def __extend(converter, request, callback):
+        if converter.cancelled(request):
+            return
+        try:
+            request.stream.extend()
+        except Exception:
+            logger.exception("Typo-tolerant search failed")
+        callback(request.generation, request.stream)
+
+    @staticmethod
+    def __prefetch(converter, request, callback):
+        if converter.cancelled(request.base):
+            return
+        STATS.count('prefetch_slices')
+        try:
+            remaining = converter.prefetch(request, PREFETCH_SLICE_US * 1000)
+        except Exception:
+            logger.exception(f"Prefetch after '{request.preedit}' failed")
+            remaining = 0
+        callback(request.base.generation, remaining)
+
+
+CONVERSIONS = ConversionWorker()
@@ -0,0 +1,485 @@
+"""
+Thaime Conversion Client
+
+This module provides the engine side of the optional conversion server,
+and the wire format both sides speak. An engine process whose dictionary
+is served holds a RemoteDictionary instead of a loaded one: lookups go to
+the server over a few pooled, persistent Unix socket connections, and when
+the server cannot be reached they fall back to a copy of the dictionary
+loaded in-process on first need.
+
+The server answers with what the dictionary holds for the preedit: exact
+matches, phrases and completions with their frequencies, or typo-tolerant
+matches. Ranking by the user's own picks and by the preceding words stays
+in the engine, which holds both.
+
+Frames are a little-endian uint32 length and a body. A request body is a
+header (protocol version, operation, query count, limit) followed by the
+UTF-8 query texts joined by a separator; several queries go in one frame.
+A response body is a header (status, flags, dictionary generation, key
+count), per-query group sizes, one float64 array of frequencies, and the
+UTF-8 words joined by the separator.
+"""
+
+import array
+import logging
+import os
+import socket
+import stat
+import struct
+import threading
+import time
+
+from gi.repository import GLib
+from config import env_int, env_str
+from instrumentation import STATS
+from registry import DICTIONARIES
+
+PROTOCOL_VERSION = 1
+
+# Operations
+OP_CONVERT = 1   # Exact matches, phrases and completions of each text
+OP_FUZZY = 2     # Up to ``limit`` typo-tolerant matches of each text
+
+# Response status
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+# Response flags
+FLAG_NORMALIZED = 1  # The served dictionary merges spelling variants
+
+FRAME = struct.Struct('<I')
+REQUEST = struct.Struct('<BBHH')
+RESPONSE = struct.Struct('<BBII')
+# Largest frame either side accepts, in bytes
+MAX_FRAME = 16 << 20
+# Queries per frame; counts travel as uint16
+MAX_QUERIES = 0xFFFF
+
+# Joins texts and words on the wire; never part of a key or a Thai word
+SEPARATOR = '\x1f'
+
+SOCKET_NAME = 'conversion.sock'
+
+# Time a lookup may wait on the server before falling back, in milliseconds
+TIMEOUT_MS = env_int('THAIME_CONVERSION_TIMEOUT_MS', 200)
+# Idle connections kept per process
+POOL_SIZE = 4
+# Seconds after a failure before the server is tried again
+RETRY_DELAY = 5.0
+# Registry key suffix of the in-process copy of a served dictionary
+LOCAL_SUFFIX = '#local'
+
+logger = logging.getLogger('thaime.client')
+
+
+class ProtocolError(Exception):
+    """Malformed or unexpected frame"""
+
+
+class ServerUnavailable(Exception):
+    """The conversion server could not answer; look up in-process instead"""
+
+
+def default_socket_path():
+    """Return the server socket: $XDG_RUNTIME_DIR/thaime, else a per-user directory in /tmp"""
+    runtime_dir = env_str('XDG_RUNTIME_DIR')
+    if runtime_dir is None:
+        runtime_dir = os.path.join('/tmp', f"thaime-{os.getuid()}")
+    else:
+        runtime_dir = os.path.join(runtime_dir, 'thaime')
+    return os.path.join(runtime_dir, SOCKET_NAME)
+
+
+def check_private_directory(directory):
+    """
+    Raise OSError unless ``directory`` is a real directory only this user can enter.
+
+    Keystrokes pass through the socket inside it, so a directory another
+    user created or can write to must not be trusted, even when its name
+    is the one expected.
+    """
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f"{directory} is not a directory")
+    if info.st_uid != os.getuid():
+        raise PermissionError(f"{directory} is owned by uid {info.st_uid}, not {os.getuid()}")
+    if stat.S_IMODE(info.st_mode) != 0o700:
+        raise PermissionError(f"{directory} has mode {stat.S_IMODE(info.st_mode):o}, expected 700")
+
+## ========================================================================== ##
+## WIRE FORMAT
+## ========================================================================== ##
+
+def join_words(words):
+    return SEPARATOR.join(words).encode('utf-8')
+
+
+def split_words(data):
+    return data.decode('utf-8').split(SEPARATOR) if data else []
+
+
+def encode_request(op, texts, limit=0):
+    if len(texts) > MAX_QUERIES:
+        raise ValueError(f"At most {MAX_QUERIES} queries fit in a frame, got {len(texts)}")
+    return REQUEST.pack(PROTOCOL_VERSION, op, len(texts), limit) + join_words(texts)
+
+
+def decode_request(body):
+    """Return (op, texts, limit) of a request body"""
+    if len(body) < REQUEST.size:
+        raise ProtocolError("Request too short")
+    version, op, count, limit = REQUEST.unpack_from(body)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    texts = split_words(body[REQUEST.size:])
+    if count == 1 and not texts:
+        texts = ['']
+    if len(texts) != count:
+        raise ProtocolError(f"Expected {count} queries, got {len(texts)}")
+    return op, texts, limit
+
+
+def encode_response(flags, generation, keys, groups, frequencies, words):
+    """
+    Encode a successful response.
+
+    Args:
+        flags (int): FLAG_* bits of the served dictionary
+        generation (int): Served dictionary generation
+        keys (int): Number of keys in the served dictionary
+        groups (list): Group sizes, a fixed number per query
+        frequencies (list): Frequencies of the words that have one, in order
+        words (list): Every word of every group, in order
+    """
+    counts = array.array('H', groups)
+    values = array.array('d', frequencies)
+    return b''.join((
+        RESPONSE.pack(STATUS_OK, flags, generation, keys),
+        FRAME.pack(len(counts)), counts.tobytes(),
+        FRAME.pack(len(values)), values.tobytes(),
+        join_words(words),
+    ))
+
+
+def encode_error(message):
+    return RESPONSE.pack(STATUS_ERROR, 0, 0, 0) + message.encode('utf-8')
+
+
+def decode_response(body):
+    """Return (flags, generation, keys, groups, frequencies, words) of a response body"""
+    if len(body) < RESPONSE.size:
+        raise ProtocolError("Response too short")
+    status, flags, generation, keys = RESPONSE.unpack_from(body)
+    if status != STATUS_OK:
+        raise ProtocolError(f"Server error: {body[RESPONSE.size:].decode('utf-8', 'replace')}")
+    try:
+        offset = RESPONSE.size
+        groups = array.array('H')
+        (count,) = FRAME.unpack_from(body, offset)
+        offset += FRAME.size
+        groups.frombytes(body[offset:offset + count * groups.itemsize])
+        offset += count * groups.itemsize
+        frequencies = array.array('d')
+        (count,) = FRAME.unpack_from(body, offset)
+        offset += FRAME.size
+        frequencies.frombytes(body[offset:offset + count * frequencies.itemsize])
+        offset += count * frequencies.itemsize
+    except (struct.error, ValueError) as err:
+        raise ProtocolError(f"Truncated response: {err}") from err
+    return flags, generation, keys, groups, frequencies, split_words(body[offset:])
+
+
+def send_frame(sock, body):
+    sock.sendall(FRAME.pack(len(body)) + body)
+
+
+def recv_exactly(sock, size):
+    """Read ``size`` bytes; None if the peer closed the connection before the first one"""
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            if received == 0:
+                return None
+            raise ProtocolError("Connection closed mid-frame")
+        received += count
+    return bytes(data)
+
+
+def recv_frame(sock):
+    """Read one frame body; None on a clean close between frames"""
+    header = recv_exactly(sock, FRAME.size)
+    if header is None:
+        return None
+    (size,) = FRAME.unpack(header)
+    if size > MAX_FRAME:
+        raise ProtocolError(f"Frame of {size} bytes exceeds {MAX_FRAME}")
+    body = recv_exactly(sock, size) if size else b''
+    if body is None:
+        raise ProtocolError("Connection closed mid-frame")
+    return body
+
+## ========================================================================== ##
+## CLIENT
+## ========================================================================== ##
+
+class ServerInfo:
+    """What a response says about the served dictionary"""
+
+    def __init__(self, flags, generation, keys):
+        self.normalized = bool(flags & FLAG_NORMALIZED)
+        self.generation = generation
+        self.keys = keys
+
+
+class ConversionClient:
+    """Persistent connections to the conversion server, shared by every thread of the process"""
+
+    def __init__(self, path, pool_size=POOL_SIZE, timeout_ms=TIMEOUT_MS):
+        self.path = path
+        self.pool_size = pool_size
+        self.timeout = timeout_ms / 1000
+        self.__idle = []
+        self.__lock = threading.Lock()
+        self.__retry_at = 0.0
+        self.__available = True
+
+    def close(self):
+        with self.__lock:
+            idle, self.__idle = self.__idle, []
+        for sock in idle:
+            sock.close()
+
+    def info(self):
+        """Return the ServerInfo of the served dictionary"""
+        info, _ = self.__query(encode_request(OP_CONVERT, []))
+        return info
+
+    def convert(self, texts):
+        """
+        Look up several preedit texts in one round trip.
+
+        Args:
+            texts (list): Canonical preedit texts
+
+        Returns:
+            tuple: (ServerInfo, list of (exact, phrases, completions) per
+                text), exact and completions being (word, frequency) pairs
+        """
+        info, (groups, frequencies, words) = self.__query(encode_request(OP_CONVERT, texts))
+        if len(groups) != 3 * len(texts):
+            raise ServerUnavailable(f"Expected {3 * len(texts)} groups, got {len(groups)}")
+        results = []
+        word_at = frequency_at = 0
+        for index in range(len(texts)):
+            exact_size, phrase_size, completion_size = groups[3 * index:3 * index + 3]
+            exact = list(zip(words[word_at:word_at + exact_size], frequencies[frequency_at:]))
+            word_at += exact_size
+            frequency_at += exact_size
+            phrases = words[word_at:word_at + phrase_size]
+            word_at += phrase_size
+            completions = list(zip(words[word_at:word_at + completion_size], frequencies[frequency_at:]))
+            word_at += completion_size
+            frequency_at += completion_size
+            results.append((exact, phrases, completions))
+        return info, results
+
+    def fuzzy(self, text, limit):
+        """Return up to ``limit`` typo-tolerant matches of ``text``, closest first"""
+        _, (_, _, words) = self.__query(encode_request(OP_FUZZY, [text], limit))
+        return words
+
+    def __query(self, body):
+        """Send one request frame and decode the answer, on a pooled connection"""
+        if not self.__available and time.monotonic() < self.__retry_at:
+            raise ServerUnavailable(f"Conversion server at {self.path} is down")
+        start = time.perf_counter_ns()
+        with self.__lock:
+            sock = self.__idle.pop() if self.__idle else None
+        try:
+            reply = None
+            if sock is not None:
+                # The server may have restarted since this connection was last used
+                try:
+                    reply = self.__exchange(sock, body)
+                except (OSError, ProtocolError):
+                    sock.close()
+                    sock = None
+            if sock is None:
+                check_private_directory(os.path.dirname(self.path))
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(self.timeout)
+                sock.connect(self.path)
+                STATS.count('conversion_server.connects')
+                reply = self.__exchange(sock, body)
+            flags, generation, keys, groups, frequencies, words = decode_response(reply)
+        except (OSError, ProtocolError) as err:
+            if sock is not None:
+                sock.close()
+            self.__failed(err)
+            raise ServerUnavailable(str(err)) from err
+
+        with self.__lock:
+            if len(self.__idle) < self.pool_size:
+                self.__idle.append(sock)
+                sock = None
+        if sock is not None:
+            sock.close()
+        if not self.__available:
+            self.__available = True
+            logger.info(f"Conversion server at {self.path} is back")
+        STATS.count('conversion_server.requests')
+        STATS.record_latency('conversion_server', 'round_trip', time.perf_counter_ns() - start)
+        return ServerInfo(flags, generation, keys), (groups, frequencies, words)
+
+    @staticmethod
+    def __exchange(sock, body):
+        send_frame(sock, body)
+        reply = recv_frame(sock)
+        if reply is None:
+            raise ProtocolError("Server closed the connection")
+        return reply
+
+    def __failed(self, err):
+        STATS.count('conversion_server.failures')
+        self.__retry_at = time.monotonic() + RETRY_DELAY
+        if self.__available:
+            self.__available = False
+            logger.warning(f"Conversion server at {self.path} unavailable, looking up in-process: {err}")
+
+
+def make_client():
+    """Client for THAIME_CONVERSION_SOCKET, or None when engines look up in-process"""
+    path = env_str('THAIME_CONVERSION_SOCKET')
+    if path is None:
+        return None
+    return ConversionClient(path)
+
+
+# Process-wide; None unless the engines are configured to use the server
+CONVERSION_CLIENT = make_client()
+
+## ========================================================================== ##
+## REMOTE DICTIONARY
+## ========================================================================== ##
+
+class RemoteDictionary:
+    """
+    Stand-in for a loaded Dictionary whose lookups the conversion server answers.
+
+    It is shared through the registry like a loaded dictionary. When a
+    response shows the server has reloaded, a successor carrying the new
+    generation replaces it in the registry, so engines switch over and
+    drop their cached candidates the same way as after a local reload.
+    """
+
+    def __init__(self, client, name, info, fallback):
+        """
+        Args:
+            client (ConversionClient): Connections to the server
+            name (str): Registry key, usually the dictionary directory
+            info (ServerInfo): The served dictionary
+            fallback (callable): Zero-argument function loading the
+                dictionary in-process, for when the server is unavailable;
+                run on a registry loader thread
+        """
+        self.client = client
+        self.name = name
+        self.normalized = info.normalized
+        self.generation = info.generation
+        self.__keys = info.keys
+        self.__fallback = fallback
+        self.__local = None
+        self.__local_acquired = False
+        self.__lock = threading.Lock()
+        self.__superseded = False
+
+    @classmethod
+    def connect(cls, client, name, fallback):
+        """Ask the server about its dictionary; raises ServerUnavailable"""
+        return cls(client, name, client.info(), fallback)
+
+    def __len__(self):
+        return self.__keys
+
+    def local(self):
+        """The in-process copy lookups fall back to; None while it loads in the background"""
+        with self.__lock:
+            if self.__local is None and not self.__local_acquired:
+                logger.info(f"Loading dictionary '{self.name}' in-process")
+                self.__local_acquired = True
+                # Shared with the successors of this dictionary, under a key of its own
+                self.__local = DICTIONARIES.acquire_async(
+                    self.name + LOCAL_SUFFIX, self.__fallback, self.__local_loaded
+                )
+            return self.__local
+
+    def __local_loaded(self, dictionary):
+        """Called on the loader thread"""
+        release = False
+        with self.__lock:
+            if not self.__local_acquired:
+                # Closed while loading; close() already released it
+                return
+            if dictionary is None:
+                # Try again on the next fallback
+                self.__local_acquired = False
+                release = True
+            else:
+                self.__local = dictionary
+        if release:
+            DICTIONARIES.release(self.name + LOCAL_SUFFIX)
+
+    def close(self):
+        with self.__lock:
+            acquired, self.__local_acquired = self.__local_acquired, False
+            self.__local = None
+        if acquired:
+            DICTIONARIES.release(self.name + LOCAL_SUFFIX)
+
+    def lookup(self, text):
+        """
+        Return what the server holds for ``text``; raises ServerUnavailable.
+
+        Returns:
+            tuple: Exact (word, frequency) pairs, phrase texts, and
+                completion (word, frequency) pairs
+        """
+        info, results = self.client.convert([text])
+        self.__check(info)
+        return results[0]
+
+    def lookup_many(self, texts):
+        """``lookup`` of several texts in one round trip"""
+        info, results = self.client.convert(texts)
+        self.__check(info)
+        return results
+
+    def fuzzy(self, text, limit):
+        """Up to ``limit`` typo-tolerant matches of ``text``; raises ServerUnavailable"""
+        return self.client.fuzzy(text, limit)
+
+    def get(self, key, default=None):
+        """Return the candidates of ``key``, mirroring ``Dictionary.get``"""
+        try:
+            exact = self.lookup(key)[0]
+        except ServerUnavailable:
+            local = self.local()
+            return local.get(key, default) if local is not None else default
+        return exact if exact else default
+
+    def __check(self, info):
+        """Hand a successor to the registry once the server has reloaded"""
+        if info.generation == self.generation or self.__superseded:
+            return
+        self.__superseded = True
+        successor = RemoteDictionary(self.client, self.name, info, self.__fallback)
+        logger.info(f"Conversion server reloaded '{self.name}', {info.keys} keys")
+        GLib.idle_add(self.__replace, successor)
+
+    def __replace(self, successor):
+        DICTIONARIES.replace(self.name, successor)
+        return False
@@ -0,0 +1,235 @@
+"""
+Thaime Conversion Server
+
+This module provides an optional local server that looks up candidates for
+every engine process of a user, so the dictionary is loaded, kept in memory
+and hot reloaded once instead of once per process. It listens on a Unix
+domain socket in a directory only the user can enter and speaks the frame
+protocol of ``conversion_client``.
+
+Each connection is served by its own thread with its own trie cursor and
+phrase segmenter, so a client typing one character more reuses the work of
+the previous keystroke. The dictionary is shared through the registry and
+watched by the same reloader the engine uses; a reload bumps the generation
+reported in every response, which is how clients learn about it.
+"""
+
+import getopt
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+
+from gi.repository import GLib
+from config import env_flag, env_str
+from conversion import FUZZY_BUDGET_US, Converter
+from conversion_client import (
+    FLAG_NORMALIZED, OP_CONVERT, OP_FUZZY, ProtocolError, check_private_directory, decode_request,
+    default_socket_path, encode_error, encode_response, recv_frame, send_frame,
+)
+from dictionary import DictionaryError, load_dictionary
+from fuzzy import fuzzy_candidates
+from registry import DICTIONARIES
+from reloader import BINARY_FILE, JSON_FILE, DictionaryReloader
+
+logger = logging.getLogger('thaime.server')
+
+
+def load_directory(directory):
+    """Load the compiled dictionary of ``directory``, falling back to trie.json"""
+    for file_name in (BINARY_FILE, JSON_FILE):
+        path = os.path.join(directory, file_name)
+        try:
+            dictionary = load_dictionary(path)
+        except FileNotFoundError:
+            continue
+        logger.info(f"Loaded {len(dictionary)} dictionary keys from {path}")
+        return dictionary
+    raise DictionaryError(f"No {BINARY_FILE} or {JSON_FILE} in {directory}")
+
+
+class ConversionHandler(socketserver.BaseRequestHandler):
+    """One client connection: frames in, frames out, until the client hangs up"""
+
+    def setup(self):
+        logger.debug("Client connected")
+        # Matches only; ranking and its cache stay in the client
+        self.converter = Converter(1)
+
+    def handle(self):
+        while True:
+            try:
+                body = recv_frame(self.request)
+            except (OSError, ProtocolError) as err:
+                logger.debug(f"Dropping connection: {err}")
+                return
+            if body is None:
+                return
+            try:
+                reply = self.server.answer(self.converter, body)
+            except ProtocolError as err:
+                logger.warning(f"Bad request: {err}")
+                send_frame(self.request, encode_error(str(err)))
+                return
+            try:
+                send_frame(self.request, reply)
+            except OSError as err:
+                logger.debug(f"Dropping connection: {err}")
+                return
+
+
+class ConversionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Answers lookups in the dictionary of one directory"""
+
+    daemon_threads = True
+
+    def __init__(self, path, directory):
+        """
+        Args:
+            path (str): Socket path; its directory is created private to the user,
+                and refused if it already exists without being private
+            directory (str): Dictionary directory, also the registry key
+        """
+        self.directory = directory
+        # Swapped whole by the main loop, read without a lock by the connection threads
+        self.dictionary = DICTIONARIES.acquire(directory, lambda: load_directory(directory))
+        self.generation = 1
+        DICTIONARIES.add_listener(directory, self.__replaced)
+
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        check_private_directory(os.path.dirname(path))
+        remove_stale_socket(path)
+        super().__init__(path, ConversionHandler)
+        os.chmod(path, 0o600)
+        logger.info(f"Serving {len(self.dictionary)} dictionary keys on {path}")
+
+    def __replaced(self, dictionary):
+        self.dictionary = dictionary
+        self.generation += 1
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.remove(self.server_address)
+        except OSError:
+            pass
+        DICTIONARIES.remove_listener(self.directory, self.__replaced)
+        DICTIONARIES.release(self.directory)
+
+    def answer(self, converter, body):
+        """Return the response body for a request body"""
+        op, texts, limit = decode_request(body)
+        # One dictionary for the whole frame, even if a reload lands meanwhile
+        dictionary = self.dictionary
+        generation = self.generation
+        flags = FLAG_NORMALIZED if dictionary.normalized else 0
+        groups = []
+        frequencies = []
+        words = []
+        if op == OP_CONVERT:
+            for text in texts:
+                exact, phrases, completions = converter.matches(dictionary, text)
+                groups.extend((len(exact), len(phrases), len(completions)))
+                for word, frequency in exact:
+                    words.append(word)
+                    frequencies.append(frequency)
+                words.extend(phrases)
+                for word, frequency in completions:
+                    words.append(word)
+                    frequencies.append(frequency)
+        elif op == OP_FUZZY:
+            for text in texts:
+                fuzzy, _ = fuzzy_candidates(dictionary, text, limit, FUZZY_BUDGET_US * 1000)
+                groups.append(len(fuzzy))
+                words.extend(word for word, _, _ in fuzzy)
+        else:
+            raise ProtocolError(f"Unknown operation {op}")
+        return encode_response(flags, generation, len(dictionary), groups, frequencies, words)
+
+
+def remove_stale_socket(path):
+    """Remove a socket left behind by a server that is gone; fail if one is still running"""
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.remove(path)
+    else:
+        raise OSError(f"A conversion server is already listening on {path}")
+    finally:
+        probe.close()
+
+## ========================================================================== ##
+## COMMAND LINE
+## ========================================================================== ##
+
+def print_help(out, v=0):
+    print("Usage: conversion_server.py [options]", file=out)
+    print("-s, --socket PATH      socket to listen on (default THAIME_CONVERSION_SOCKET,", file=out)
+    print("                       else $XDG_RUNTIME_DIR/thaime/conversion.sock).", file=out)
+    print("-d, --dictionary DIR   directory holding trie.bin or trie.json (default", file=out)
+    print("                       THAIME_DICTIONARY_DIR, else this directory).", file=out)
+    print("-v, --verbose          log every connection.", file=out)
+    print("-h, --help             show this message.", file=out)
+    sys.exit(v)
+
+def main():
+    path = env_str('THAIME_CONVERSION_SOCKET', default_socket_path())
+    directory = env_str('THAIME_DICTIONARY_DIR', os.path.dirname(os.path.abspath(__file__)))
+    verbose = False
+
+    shortopt = "s:d:vh"
+    longopt = ["socket=", "dictionary=", "verbose", "help"]
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], shortopt, longopt)
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        print_help(sys.stderr, 1)
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print_help(sys.stdout)
+        elif o in ("-s", "--socket"):
+            path = a
+        elif o in ("-d", "--dictionary"):
+            directory = a
+        elif o in ("-v", "--verbose"):
+            verbose = True
+
+    logging.basicConfig(
+        level=logging.DEBUG if verbose else logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    try:
+        server = ConversionServer(path, directory)
+    except (OSError, DictionaryError) as err:
+        print(f"Error: {err}", file=sys.stderr)
+        sys.exit(1)
+
+    # Connections are served on threads; the main loop runs the reloader
+    thread = threading.Thread(target=server.serve_forever, name='thaime-server', daemon=True)
+    thread.start()
+    mainloop = GLib.MainLoop()
+    reloader = None
+    if env_flag('THAIME_HOT_RELOAD', True):
+        reloader = DictionaryReloader(directory)
+        reloader.start()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signum, mainloop.quit)
+    try:
+        mainloop.run()
+    finally:
+        if reloader is not None:
+            reloader.stop()
+        server.shutdown()
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,539 @@
+"""
+Thaime Compiled Dictionary
+
+This module provides the compiled binary dictionary used by the phonetic
+conversion mode, together with the converter from the legacy ``trie.json``
+layout.
+
+The binary file is opened with mmap and queried in place, so opening a
+dictionary costs a header check instead of a full parse. The JSON layout
+is still accepted; it is converted into the same in-memory tables on load,
+so both backends answer queries through the same code.
+
+The file is a section file (see section_file.py) whose format-specific
+header byte holds the flags and whose item count is the number of keys.
+
+Sections:
+
+    KEY_OFFSETS   uint32[keys + 1]   offsets into KEY_BLOB, keys sorted
+    KEY_BLOB      bytes              UTF-8 romanized keys
+    CAND_OFFSETS  uint32[keys + 1]   candidate range of each key, best first
+    CAND_WORDS    uint32[cands]      string id of each candidate
+    CAND_FREQS    float64[cands]     frequency of each candidate
+    STR_OFFSETS   uint32[strs + 1]   offsets into STR_BLOB
+    STR_BLOB      bytes              interned UTF-8 Thai words
+    NODE_EDGES    uint32[nodes + 1]  edge range of each trie node
+    NODE_KEYS     uint32[nodes]      key index ending at each node, or NO_KEY
+    EDGE_LABELS   bytes[edges]       key byte of each edge, sorted per node
+    NODE_LISTS    uint32[nodes]      completion list of each trie node
+    LIST_OFFSETS  uint32[lists + 1]  offsets into LIST_ITEMS
+    LIST_ITEMS    uint32[items]      candidate indices, best first
+
+Trie nodes are numbered breadth-first with the root as node 0, so every
+node other than the root is the target of exactly one edge and edge ``e``
+always leads to node ``e + 1``. No edge target array is stored.
+
+Every node refers to the frequency-ranked top completions of all keys
+below it. Identical lists are stored once, so the single-child chains
+that make up most of a trie share one list.
+
+With FLAG_NORMALIZED set, keys are canonical spellings (see romanization.py)
+and spelling variants were merged when the dictionary was built; typed
+text must be normalized with the same rules before it is looked up.
+"""
+
+import array
+import collections
+import getopt
+import json
+import os
+import sys
+
+from romanization import normalize, normalize_entries
+from section_file import SectionFormat
+
+MAGIC = b'THMD'
+FORMAT_VERSION = 4
+
+# Header flags
+FLAG_NORMALIZED = 0x01
+
+# Section name and array typecode ('B' for raw UTF-8 blobs), in file order
+SECTIONS = (
+    ('key_offsets', 'I'),
+    ('key_blob', 'B'),
+    ('cand_offsets', 'I'),
+    ('cand_words', 'I'),
+    ('cand_freqs', 'd'),
+    ('str_offsets', 'I'),
+    ('str_blob', 'B'),
+    ('node_edges', 'I'),
+    ('node_keys', 'I'),
+    ('edge_labels', 'B'),
+    ('node_lists', 'I'),
+    ('list_offsets', 'I'),
+    ('list_items', 'I'),
+)
+
+# Number of completions precomputed for each trie node
+COMPLETION_LIMIT = 10
+
+ROOT = 0
+NO_NODE = -1
+NO_KEY = 0xFFFFFFFF
+
+
+class DictionaryError(Exception):
+    """Raised when a dictionary file cannot be read or built"""
+
+
+FILE_FORMAT = SectionFormat(
+    MAGIC, FORMAT_VERSION, SECTIONS, DictionaryError, 'dictionary', hint='; recompile it from trie.json'
+)
+
+
+class Dictionary:
+    """Read-only romanization dictionary backed by flat typed arrays"""
+
+    def __init__(self, sections, path=None, mapping=None, flags=0):
+        self.path = path
+        self.flags = flags
+        self.__mapping = mapping
+        self.__sections = sections
+        for name, _ in SECTIONS:
+            setattr(self, f"_{name}", sections[name])
+
+    ## ====================================================================== ##
+    ## CONSTRUCTION
+    ## ====================================================================== ##
+
+    @classmethod
+    def from_entries(cls, entries, path=None, normalize=False):
+        """
+        Build a dictionary in memory.
+
+        Args:
+            entries (dict): Romanized key -> list of [thai_word, frequency]
+            path (str): Source path, for diagnostics only
+            normalize (bool): Merge spelling variants under canonical keys
+
+        Returns:
+            Dictionary: The in-memory dictionary
+        """
+        flags = 0
+        if normalize:
+            entries = normalize_entries(entries)
+            flags |= FLAG_NORMALIZED
+
+        sections = {name: array.array(code) for name, code in SECTIONS}
+        key_blob = bytearray()
+        str_blob = bytearray()
+        string_ids = {}
+
+        sections['key_offsets'].append(0)
+        sections['cand_offsets'].append(0)
+        sections['str_offsets'].append(0)
+
+        keys = sorted(key.encode('utf-8') for key in entries)
+        for encoded in keys:
+            key = encoded.decode('utf-8')
+            key_blob += encoded
+            sections['key_offsets'].append(len(key_blob))
+
+            # Rank once here so lookups never sort on the keystroke path
+            ranked = sorted(entries[key], key=lambda item: item[1], reverse=True)
+            for word, freq in ranked:
+                string_id = string_ids.get(word)
+                if string_id is None:
+                    string_id = len(string_ids)
+                    string_ids[word] = string_id
+                    str_blob += word.encode('utf-8')
+                    sections['str_offsets'].append(len(str_blob))
+                sections['cand_words'].append(string_id)
+                sections['cand_freqs'].append(float(freq))
+            sections['cand_offsets'].append(len(sections['cand_words']))
+
+        sections['key_blob'] = bytes(key_blob)
+        sections['str_blob'] = bytes(str_blob)
+        cls.__build_trie(keys, sections)
+        cls.__build_completions(sections)
+        return cls(sections, path=path, flags=flags)
+
+    @staticmethod
+    def __build_trie(keys, sections):
+        """Fill the trie sections from the sorted, encoded keys"""
+        node_edges = sections['node_edges']
+        node_keys = sections['node_keys']
+        edge_labels = bytearray()
+
+        # Each node covers the contiguous run keys[lo:hi] sharing its prefix
+        queue = collections.deque([(0, len(keys), 0)])
+        node_edges.append(0)
+        while queue:
+            lo, hi, depth = queue.popleft()
+
+            # A key ending here sorts before every longer key with the prefix
+            if lo < hi and len(keys[lo]) == depth:
+                node_keys.append(lo)
+                lo += 1
+            else:
+                node_keys.append(NO_KEY)
+
+            while lo < hi:
+                label = keys[lo][depth]
+                end = lo + 1
+                while end < hi and keys[end][depth] == label:
+                    end += 1
+                edge_labels.append(label)
+                queue.append((lo, end, depth + 1))
+                lo = end
+            node_edges.append(len(edge_labels))
+
+        sections['edge_labels'] = bytes(edge_labels)
+
+    @staticmethod
+    def __build_completions(sections, limit=COMPLETION_LIMIT):
+        """Fill the completion sections, merging child lists bottom-up"""
+        node_edges = sections['node_edges']
+        node_keys = sections['node_keys']
+        cand_offsets = sections['cand_offsets']
+        cand_words = sections['cand_words']
+        cand_freqs = sections['cand_freqs']
+
+        def rank(index):
+            return (-cand_freqs[index], index)
+
+        node_count = len(node_keys)
+        completions = [()] * node_count
+        list_ids = {}
+        node_lists = array.array('I', bytes(4 * node_count))
+
+        # Children always have higher node numbers than their parent
+        for node in range(node_count - 1, -1, -1):
+            pool = []
+            key = node_keys[node]
+            if key != NO_KEY:
+                pool.extend(range(cand_offsets[key], cand_offsets[key + 1]))
+            for edge in range(node_edges[node], node_edges[node + 1]):
+                pool.extend(completions[edge + 1])
+                completions[edge + 1] = None
+
+            ranked = []
+            seen = set()
+            for index in sorted(pool, key=rank):
+                if cand_words[index] not in seen:
+                    seen.add(cand_words[index])
+                    ranked.append(index)
+                    if len(ranked) == limit:
+                        break
+            ranked = tuple(ranked)
+
+            list_id = list_ids.setdefault(ranked, len(list_ids))
+            node_lists[node] = list_id
+            completions[node] = ranked
+
+        list_offsets = sections['list_offsets']
+        list_items = sections['list_items']
+        list_offsets.append(0)
+        for ranked in list_ids:
+            list_items.extend(ranked)
+            list_offsets.append(len(list_items))
+        sections['node_lists'] = node_lists
+
+    @classmethod
+    def load_json(cls, path, normalize=True):
+        """Build a dictionary from a legacy ``trie.json`` file"""
+        return cls.from_entries(read_entries(path), path=path, normalize=normalize)
+
+    @classmethod
+    def open(cls, path, verify=True):
+        """
+        Memory-map a compiled dictionary file.
+
+        Args:
+            path (str): Path to the compiled dictionary
+            verify (bool): Check the body against the header checksum
+
+        Returns:
+            Dictionary: The mapped dictionary
+        """
+        mapping, sections, flags = FILE_FORMAT.open(path, verify)
+        return cls(sections, path=path, mapping=mapping, flags=flags)
+
+    def save(self, path):
+        """Write the dictionary in the compiled binary format"""
+        FILE_FORMAT.save(path, self.__sections, self.flags, len(self))
+
+    def close(self):
+        """Release the memory mapping, if any"""
+        if self.__mapping is None:
+            return
+        FILE_FORMAT.close(self.__mapping, self.__sections, self.path)
+        self.__mapping = None
+
+    ## ====================================================================== ##
+    ## QUERIES
+    ## ====================================================================== ##
+
+    @property
+    def normalized(self):
+        """Whether keys are canonical spellings that typed text must be normalized to"""
+        return bool(self.flags & FLAG_NORMALIZED)
+
+    def __len__(self):
+        return len(self._key_offsets) - 1
+
+    def __contains__(self, key):
+        return self.find(key) >= 0
+
+    def key(self, index):
+        """Return the romanized key stored at ``index``"""
+        return str(self._key_blob[self._key_offsets[index]:self._key_offsets[index + 1]], 'utf-8')
+
+    def word(self, string_id):
+        """Return the interned Thai word with id ``string_id``"""
+        return str(self._str_blob[self._str_offsets[string_id]:self._str_offsets[string_id + 1]], 'utf-8')
+
+    def find(self, key):
+        """Return the index of ``key``, or -1 when it is not in the dictionary"""
+        node = self.walk(ROOT, key)
+        if node == NO_NODE:
+            return -1
+        return self.node_key(node)
+
+    def child(self, node, label):
+        """Return the child of ``node`` along byte ``label``, or NO_NODE"""
+        labels = self._edge_labels
+        lo, hi = self._node_edges[node], self._node_edges[node + 1]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            probe = labels[mid]
+            if probe < label:
+                lo = mid + 1
+            elif probe > label:
+                hi = mid
+            else:
+                return mid + 1
+        return NO_NODE
+
+    def walk(self, node, text):
+        """Follow the UTF-8 bytes of ``text`` from ``node``; NO_NODE if it falls off"""
+        for label in text.encode('utf-8'):
+            node = self.child(node, label)
+            if node == NO_NODE:
+                break
+        return node
+
+    def children(self, node):
+        """Return the (byte label, child node) pairs below ``node`` in label order"""
+        labels = self._edge_labels
+        return [(labels[edge], edge + 1) for edge in range(self._node_edges[node], self._node_edges[node + 1])]
+
+    def node_key(self, node):
+        """Return the index of the key ending at ``node``, or -1"""
+        index = self._node_keys[node]
+        return -1 if index == NO_KEY else index
+
+    def candidates(self, index):
+        """Return the (thai_word, frequency) pairs of the key at ``index``, best first"""
+        start, end = self._cand_offsets[index], self._cand_offsets[index + 1]
+        freqs = self._cand_freqs
+        words = self._cand_words
+        return [(self.word(words[i]), freqs[i]) for i in range(start, end)]
+
+    def completions(self, node):
+        """Return the precomputed (thai_word, frequency) completions below ``node``"""
+        list_id = self._node_lists[node]
+        start, end = self._list_offsets[list_id], self._list_offsets[list_id + 1]
+        items = self._list_items
+        words = self._cand_words
+        freqs = self._cand_freqs
+        return [(self.word(words[items[i]]), freqs[items[i]]) for i in range(start, end)]
+
+    def weight(self, node):
+        """Total frequency of the precomputed completions below ``node``; how likely typing goes through it"""
+        list_id = self._node_lists[node]
+        items = self._list_items
+        freqs = self._cand_freqs
+        return sum(freqs[items[i]] for i in range(self._list_offsets[list_id], self._list_offsets[list_id + 1]))
+
+    def get(self, key, default=None):
+        """Return the candidates of ``key``, mirroring ``dict.get`` on trie.json"""
+        index = self.find(key)
+        if index < 0:
+            return default
+        return self.candidates(index)
+
+
+class TrieCursor:
+    """
+    Incremental position in the dictionary trie, one node per typed character.
+
+    Typing past a dead end keeps pushing NO_NODE markers, so every ``push``
+    is matched by exactly one ``pop`` however far the preedit runs on.
+    """
+
+    def __init__(self, dictionary):
+        self.dictionary = dictionary
+        self.__stack = [ROOT]
+
+    def push(self, char):
+        """Advance by one character; return whether a word can still follow"""
+        node = self.__stack[-1]
+        if node != NO_NODE:
+            node = self.dictionary.walk(node, char)
+        self.__stack.append(node)
+        return node != NO_NODE
+
+    def pop(self):
+        """Step back over the last pushed character"""
+        if len(self.__stack) > 1:
+            self.__stack.pop()
+
+    def reset(self):
+        del self.__stack[1:]
+
+    @property
+    def node(self):
+        return self.__stack[-1]
+
+    @property
+    def depth(self):
+        return len(self.__stack) - 1
+
+    @property
+    def is_alive(self):
+        """Whether the typed prefix can still lead to a dictionary key"""
+        return self.__stack[-1] != NO_NODE
+
+    def candidates(self):
+        """Return the candidates of the key spelled so far, if it is one"""
+        node = self.__stack[-1]
+        if node == NO_NODE:
+            return []
+        index = self.dictionary.node_key(node)
+        if index < 0:
+            return []
+        return self.dictionary.candidates(index)
+
+    def completions(self):
+        """Return the best completions of every key starting with the prefix"""
+        node = self.__stack[-1]
+        if node == NO_NODE:
+            return []
+        return self.dictionary.completions(node)
+
+
+def load_dictionary(path, verify=True):
+    """
+    Open a dictionary file, choosing the backend from its contents.
+
+    Args:
+        path (str): Compiled dictionary or legacy JSON file
+        verify (bool): Check the compiled dictionary checksum
+
+    Returns:
+        Dictionary: The loaded dictionary
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+    if magic == MAGIC:
+        return Dictionary.open(path, verify=verify)
+    return Dictionary.load_json(path)
+
+
+def read_entries(path):
+    """Read the key -> candidates mapping of a ``trie.json`` file, checking its shape"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+    except json.JSONDecodeError as err:
+        raise DictionaryError(f"Error decoding dictionary {path}: {err}") from err
+    check_entries(entries, path)
+    return entries
+
+
+def check_entries(entries, path):
+    """Raise DictionaryError unless ``entries`` maps keys to lists of [thai_word, frequency]"""
+    if not isinstance(entries, dict):
+        raise DictionaryError(f"Dictionary {path} is not a mapping of keys to candidates")
+    for key, candidates in entries.items():
+        if not isinstance(candidates, list):
+            raise DictionaryError(f"Candidates of key {key!r} in {path} are not a list")
+        for candidate in candidates:
+            if (not isinstance(candidate, list) or len(candidate) != 2
+                    or not isinstance(candidate[0], str)
+                    or isinstance(candidate[1], bool) or not isinstance(candidate[1], (int, float))):
+                raise DictionaryError(
+                    f"Candidate {candidate!r} of key {key!r} in {path} is not [thai_word, frequency]"
+                )
+
+
+def compile_json(json_path, output_path, normalize=True):
+    """Convert a legacy ``trie.json`` file into the compiled binary format"""
+    dictionary = Dictionary.load_json(json_path, normalize=normalize)
+    dictionary.save(output_path)
+    return dictionary
+
+
+## ========================================================================== ##
+## COMMAND LINE
+## ========================================================================== ##
+
+def print_help(out, v=0):
+    print("Usage: dictionary.py [options] INPUT.json OUTPUT.bin", file=out)
+    print("-c, --check            verify OUTPUT.bin against INPUT.json after compiling.", file=out)
+    print("-n, --no-normalize     keep every spelling variant as its own key.", file=out)
+    print("-h, --help             show this message.", file=out)
+    sys.exit(v)
+
+def main():
+    check = False
+    normalized = True
+
+    shortopt = "cnh"
+    longopt = ["check", "no-normalize", "help"]
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], shortopt, longopt)
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        print_help(sys.stderr, 1)
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print_help(sys.stdout)
+        elif o in ("-c", "--check"):
+            check = True
+        elif o in ("-n", "--no-normalize"):
+            normalized = False
+
+    if len(args) != 2:
+        print_help(sys.stderr, 1)
+
+    json_path, output_path = args
+    try:
+        entries = read_entries(json_path)
+        Dictionary.from_entries(entries, path=json_path, normalize=normalized).save(output_path)
+        compiled = Dictionary.open(output_path)
+    except (OSError, DictionaryError) as err:
+        print(str(err), file=sys.stderr)
+        sys.exit(1)
+
+    print(f"Compiled {len(compiled)} keys into {output_path} "
+          f"({os.path.getsize(output_path)} bytes, from {os.path.getsize(json_path)} bytes of JSON)")
+    if normalized:
+        print(f"Normalization merged {len(entries)} spellings into {len(compiled)} keys")
+
+    if check:
+        # Every spelling in the source must still find all of its words
+        for key, candidates in entries.items():
+            found = {word for word, _ in compiled.get(normalize(key) if normalized else key, [])}
+            if not {word for word, _ in candidates} <= found:
+                print(f"Mismatch for key '{key}'", file=sys.stderr)
+                sys.exit(1)
+        print("Check passed")
+    compiled.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,460 @@
+"""
+Thaime Dictionary Builder
+
+This module builds ``trie.json`` from a word-segmented Thai corpus: words
+are counted, spelled in roman letters with ``romanization.romanize`` (or a
+pronunciation lexicon), and ranked by count under each key, in the format
+``Engine.load_trie_data`` and ``dictionary.py`` read.
+
+The corpus is split into shards, whole files or line-aligned pieces of large
+ones, and a process pool counts each shard independently. A shard writes its
+counts to the build cache, already partitioned by key, so the merge is done
+per partition by the same pool and the final file is the concatenation of
+the partitions. Nothing serial in between touches every word.
+
+Counted shards stay in the cache with the size and modification time of
+their file, so a rebuild only counts shards whose file changed and merges
+the cached counts of the rest.
+"""
+
+import collections
+import concurrent.futures
+import getopt
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+import zlib
+
+from language_model import split_words
+from romanization import ROMANIZER_VERSION, romanize
+
+# Corpus files larger than this are split into shards of about this size, in bytes
+SHARD_SIZE = 64 << 20
+
+# Key partitions of the shard counts, each merged on its own
+PARTITIONS = 16
+
+# Words seen fewer times are left out, and at most this many are kept per key
+MIN_COUNT = 2
+MAX_CANDIDATES = 20
+
+CACHE_DIR_NAME = '.thaime-build'
+MANIFEST_FILE = 'manifest.json'
+CACHE_VERSION = 1
+
+# Bytes read at a time from a shard
+READ_SIZE = 1 << 20
+
+logger = logging.getLogger('thaime.builder')
+
+Shard = collections.namedtuple('Shard', ('path', 'start', 'end', 'size', 'mtime_ns'))
+
+
+class BuildError(Exception):
+    """Raised when the corpus or lexicon cannot be read"""
+
+
+## ========================================================================== ##
+## CORPUS
+## ========================================================================== ##
+
+def corpus_files(paths):
+    """Expand files and directories into a sorted list of corpus files"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, subdirectories, names in os.walk(path):
+                subdirectories[:] = sorted(name for name in subdirectories if not name.startswith('.'))
+                files.extend(os.path.join(directory, name) for name in names if not name.startswith('.'))
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            raise BuildError(f"Corpus file not found: {path}")
+    return sorted(os.path.abspath(path) for path in files)
+
+
+def split_shards(path, shard_size=SHARD_SIZE):
+    """Split a corpus file into shards at line boundaries near every ``shard_size`` bytes"""
+    stat = os.stat(path)
+    offsets = [0]
+    with open(path, 'rb') as f:
+        while offsets[-1] + shard_size < stat.st_size:
+            f.seek(offsets[-1] + shard_size)
+            f.readline()
+            if f.tell() >= stat.st_size:
+                break
+            offsets.append(f.tell())
+    offsets.append(stat.st_size)
+    return [Shard(path, start, end, stat.st_size, stat.st_mtime_ns)
+            for start, end in zip(offsets, offsets[1:])]
+
+
+def shard_id(shard):
+    """Cache name of a shard; a shard of a changed file gets a new name only if it moved"""
+    return hashlib.sha1(f"{shard.path}\0{shard.start}\0{shard.end}".encode('utf-8')).hexdigest()[:16]
+
+
+def read_lines(shard):
+    """Generate the lines of a shard"""
+    with open(shard.path, 'rb') as f:
+        f.seek(shard.start)
+        remaining = shard.end - shard.start
+        pending = b''
+        while remaining > 0:
+            block = f.read(min(READ_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            lines = (pending + block).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line.decode('utf-8', 'replace')
+        if pending:
+            yield pending.decode('utf-8', 'replace')
+
+
+def read_lexicon(path):
+    """
+    Read a pronunciation lexicon: one word per line, a tab, then its keys.
+
+    Args:
+        path (str): Lexicon file; '#' starts a comment line
+
+    Returns:
+        dict: Thai word -> list of romanized keys
+    """
+    lexicon = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                word, _, keys = line.partition('\t')
+                if not keys.split():
+                    raise BuildError(f"{path}:{number}: expected a word, a tab and its keys")
+                lexicon[word] = keys.split()
+    except OSError as err:
+        raise BuildError(f"Error reading lexicon {path}: {err}") from err
+    return lexicon
+
+## ========================================================================== ##
+## WORKERS
+## ========================================================================== ##
+
+# Lexicon of the current worker process, set once by the pool initializer
+_lexicon = {}
+
+
+def _init_worker(lexicon):
+    global _lexicon
+    _lexicon = lexicon
+
+
+def partition_of(key, partitions):
+    """Partition of a key; stable across processes, unlike hash()"""
+    return zlib.crc32(key.encode('utf-8')) % partitions
+
+
+def count_shard(shard, cache_dir, partitions):
+    """
+    Count the words of one shard and write them to the cache, partitioned by key.
+
+    Runs in a worker process. Each partition file holds ``key<TAB>word<TAB>count``
+    lines; it is written under a temporary name and renamed, so an interrupted
+    build never leaves a partial shard behind.
+
+    Returns:
+        dict: Tokens counted, and tokens left out for not being plain Thai
+    """
+    counts = collections.Counter()
+    for line in read_lines(shard):
+        counts.update(split_words(line))
+
+    name = shard_id(shard)
+    outputs = [[] for _ in range(partitions)]
+    skipped = 0
+    for word, count in counts.items():
+        keys = _lexicon.get(word)
+        if keys is None:
+            key = romanize(word)
+            if key is None:
+                skipped += count
+                continue
+            keys = (key,)
+        for key in keys:
+            outputs[partition_of(key, partitions)].append(f"{key}\t{word}\t{count}\n")
+
+    for partition, lines in enumerate(outputs):
+        path = os.path.join(cache_dir, f"{name}.{partition}.tsv")
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        os.replace(f"{path}.tmp", path)
+    return {'tokens': sum(counts.values()), 'skipped': skipped}
+
+
+def merge_partition(partition, names, cache_dir, min_count, max_candidates):
+    """
+    Sum one key partition over every shard and rank the words of each key.
+
+    Runs in a worker process and writes the partition as a fragment of the
+    final JSON object, without the surrounding braces.
+
+    Returns:
+        tuple: (keys, candidates) written
+    """
+    totals = collections.defaultdict(collections.Counter)
+    for name in names:
+        with open(os.path.join(cache_dir, f"{name}.{partition}.tsv"), 'r', encoding='utf-8') as f:
+            for line in f:
+                key, word, count = line.rstrip('\n').split('\t')
+                totals[key][word] += int(count)
+
+    entries = {}
+    candidates = 0
+    for key in sorted(totals):
+        ranked = [[word, count] for word, count in totals[key].most_common(max_candidates)
+                  if count >= min_count]
+        if ranked:
+            entries[key] = ranked
+            candidates += len(ranked)
+
+    path = os.path.join(cache_dir, f"merged.{partition}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(entries, ensure_ascii=False, separators=(',', ':'))[1:-1])
+    return len(entries), candidates
+
+## ========================================================================== ##
+## BUILD
+## ========================================================================== ##
+
+def load_manifest(cache_dir, settings):
+    """Return the cached shards, or nothing if the cache was built with other settings"""
+    try:
+        with open(os.path.join(cache_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('settings') != settings:
+        logger.info("Build settings changed, counting every shard again")
+        return {}
+    return manifest.get('shards', {})
+
+
+def save_manifest(cache_dir, settings, shards):
+    path = os.path.join(cache_dir, MANIFEST_FILE)
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+        json.dump({'settings': settings, 'shards': shards}, f, indent=1)
+    os.replace(f"{path}.tmp", path)
+
+
+def build_dictionary(corpus_paths, output_path, jobs=None, lexicon_path=None, cache_dir=None,
+                     min_count=MIN_COUNT, max_candidates=MAX_CANDIDATES, shard_size=SHARD_SIZE,
+                     partitions=PARTITIONS, full=False):
+    """
+    Build ``trie.json`` from a word-segmented corpus.
+
+    Args:
+        corpus_paths (list): Corpus files or directories of them, one
+            sentence per line, words separated by spaces or '|'
+        output_path (str): The ``trie.json`` to write, replaced atomically
+        jobs (int): Worker processes, default one per CPU
+        lexicon_path (str): Optional word -> keys lexicon overriding romanize()
+        cache_dir (str): Build cache, default ``.thaime-build`` next to the output
+        min_count (int): Words seen fewer times are left out
+        max_candidates (int): Most words kept per key
+        shard_size (int): Size in bytes above which files are split
+        partitions (int): Key partitions merged independently
+        full (bool): Count every shard even if the cache has it
+
+    Returns:
+        dict: Build statistics
+    """
+    start = time.perf_counter()
+    jobs = jobs or os.cpu_count() or 1
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(output_path)), CACHE_DIR_NAME)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    lexicon = {}
+    lexicon_digest = None
+    if lexicon_path is not None:
+        lexicon = read_lexicon(lexicon_path)
+        with open(lexicon_path, 'rb') as f:
+            lexicon_digest = hashlib.sha1(f.read()).hexdigest()
+    settings = {
+        'version': CACHE_VERSION,
+        'romanizer': ROMANIZER_VERSION,
+        'lexicon': lexicon_digest,
+        'partitions': partitions,
+    }
+
+    shards = {}
+    for path in corpus_files(corpus_paths):
+        for shard in split_shards(path, shard_size):
+            shards[shard_id(shard)] = shard
+    cached = {} if full else load_manifest(cache_dir, settings)
+    stale = [name for name, shard in shards.items()
+             if name not in cached or (cached[name]['size'], cached[name]['mtime_ns'])
+             != (shard.size, shard.mtime_ns)]
+    logger.info(f"{len(shards)} shards, {len(shards) - len(stale)} unchanged, counting {len(stale)} "
+                f"with {jobs} processes")
+
+    executor = None
+    if jobs > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, initializer=_init_worker, initargs=(lexicon,)
+        )
+    else:
+        _init_worker(lexicon)
+    try:
+        # Largest shards first, so a big file does not finish alone at the end
+        stale.sort(key=lambda name: shards[name].end - shards[name].start, reverse=True)
+        if executor is None:
+            results = [count_shard(shards[name], cache_dir, partitions) for name in stale]
+        else:
+            results = executor.map(count_shard, [shards[name] for name in stale],
+                                   [cache_dir] * len(stale), [partitions] * len(stale))
+        for name, result in zip(stale, results):
+            cached[name] = dict(result, size=shards[name].size, mtime_ns=shards[name].mtime_ns)
+        counted = time.perf_counter()
+
+        # Counts of the current shards are complete now; forget removed and moved ones
+        cached = {name: cached[name] for name in shards}
+        save_manifest(cache_dir, settings, cached)
+        names = sorted(shards)
+        args = (range(partitions), [names] * partitions, [cache_dir] * partitions,
+                [min_count] * partitions, [max_candidates] * partitions)
+        if executor is None:
+            merged = list(map(merge_partition, *args))
+        else:
+            merged = list(executor.map(merge_partition, *args))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    stats = {
+        'shards': len(shards),
+        'counted': len(stale),
+        'tokens': sum(entry['tokens'] for entry in cached.values()),
+        'skipped': sum(entry['skipped'] for entry in cached.values()),
+        'keys': sum(keys for keys, _ in merged),
+        'candidates': sum(candidates for _, candidates in merged),
+    }
+    prune_cache(cache_dir, shards)
+
+    # The engine reloads on the rename, so it never sees a partial file
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as out:
+        out.write('{')
+        first = True
+        for partition in range(partitions):
+            with open(os.path.join(cache_dir, f"merged.{partition}.json"), 'r', encoding='utf-8') as f:
+                fragment = f.read()
+            if fragment:
+                if not first:
+                    out.write(',')
+                out.write(fragment)
+                first = False
+        out.write('}')
+    os.replace(tmp_path, output_path)
+
+    end = time.perf_counter()
+    stats['count_s'] = counted - start
+    stats['merge_s'] = end - counted
+    stats['total_s'] = end - start
+    return stats
+
+
+def prune_cache(cache_dir, shards):
+    """Delete the cached counts of shards that are no longer part of the corpus"""
+    for name in os.listdir(cache_dir):
+        prefix = name.split('.', 1)[0]
+        if name.endswith('.tsv') and prefix not in shards:
+            os.remove(os.path.join(cache_dir, name))
+
+## ========================================================================== ##
+## COMMAND LINE
+## ========================================================================== ##
+
+def print_help(out, v=0):
+    print("Usage: dictionary_builder.py [options] CORPUS... OUTPUT.json", file=out)
+    print("CORPUS files or directories hold one sentence per line, words separated by spaces or '|'.",
+          file=out)
+    print("-j, --jobs N           worker processes (default one per CPU).", file=out)
+    print("-l, --lexicon FILE     word<TAB>keys lines used instead of the built-in romanization.", file=out)
+    print("-m, --min-count N      leave out words seen fewer than N times (default 2).", file=out)
+    print("-n, --max-candidates N keep at most N words per key (default 20).", file=out)
+    print("-s, --shard-size MB    split corpus files larger than this (default 64).", file=out)
+    print("-c, --cache DIR        build cache (default .thaime-build next to OUTPUT).", file=out)
+    print("-f, --full             count every shard again instead of reusing the cache.", file=out)
+    print("-v, --verbose          log progress.", file=out)
+    print("-h, --help             show this message.", file=out)
+    sys.exit(v)
+
+def main():
+    jobs = None
+    lexicon_path = None
+    min_count = MIN_COUNT
+    max_candidates = MAX_CANDIDATES
+    shard_size = SHARD_SIZE
+    cache_dir = None
+    full = False
+    verbose = False
+
+    shortopt = "j:l:m:n:s:c:fvh"
+    longopt = ["jobs=", "lexicon=", "min-count=", "max-candidates=", "shard-size=", "cache=",
+               "full", "verbose", "help"]
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], shortopt, longopt)
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        print_help(sys.stderr, 1)
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print_help(sys.stdout)
+        elif o in ("-j", "--jobs"):
+            jobs = int(a)
+        elif o in ("-l", "--lexicon"):
+            lexicon_path = a
+        elif o in ("-m", "--min-count"):
+            min_count = int(a)
+        elif o in ("-n", "--max-candidates"):
+            max_candidates = int(a)
+        elif o in ("-s", "--shard-size"):
+            shard_size = int(float(a) * (1 << 20))
+        elif o in ("-c", "--cache"):
+            cache_dir = a
+        elif o in ("-f", "--full"):
+            full = True
+        elif o in ("-v", "--verbose"):
+            verbose = True
+
+    if len(args) < 2:
+        print_help(sys.stderr, 1)
+
+    logging.basicConfig(
+        level=logging.INFO if verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    *corpus_paths, output_path = args
+    try:
+        stats = build_dictionary(corpus_paths, output_path, jobs=jobs, lexicon_path=lexicon_path,
+                                 cache_dir=cache_dir, min_count=min_count, max_candidates=max_candidates,
+                                 shard_size=shard_size, full=full)
+    except (OSError, BuildError) as err:
+        print(str(err), file=sys.stderr)
+        sys.exit(1)
+
+    print(f"Built {stats['keys']} keys with {stats['candidates']} candidates from {stats['tokens']} tokens "
+          f"into {output_path} ({os.path.getsize(output_path)} bytes) in {stats['total_s']:.1f} s")
+    print(f"Counted {stats['counted']} of {stats['shards']} shards; "
+          f"{stats['skipped']} tokens were not plain Thai and were left out")
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,76 @@
+import collections
 import logging
-import json
 import os
+import time
 
 import gi
 gi.require_version('IBus', '1.0')
 
 from gi.repository import GLib, IBus
+from config import env_flag, env_str
+from conversion import (
+    CONVERSIONS, PREFETCH_LETTERS, WAIT_TIMEOUT_MS, ConversionRequest, Converter, PrefetchRequest, TailRequest,
+)
+from conversion_client import CONVERSION_CLIENT, RemoteDictionary, ServerUnavailable
+from dictionary import Dictionary, DictionaryError, load_dictionary
+from instrumentation import STATS, dump_stats
+from language_model import LanguageModel, LanguageModelError
+from profiling import PROFILER
+from registry import DICTIONARIES
+from reloader import BINARY_FILE, JSON_FILE, compile_dictionary, file_signature, json_is_newer
+from romanization import IDENTITY, RULES, Normalizer
 from thai_keymap import KEDMANEE_KEYMAP
+from user_learning import USER_FREQUENCIES
+
+# Directory holding trie.bin / trie.json, also the dictionary registry key
+DICTIONARY_DIR = env_str('THAIME_DICTIONARY_DIR', os.path.dirname(os.path.abspath(__file__)))
+
+# Number of preedit strings whose lookup table candidates are kept ready
+CANDIDATE_CACHE_SIZE = 256
+
+# Word n-gram model reranking candidates by the preceding words, next to the dictionary
+LANGUAGE_MODEL_FILE = 'lm.bin'
+
+# Preceding words kept as context, and surrounding text searched for them
+CONTEXT_WORDS = 2
+CONTEXT_CHARS = 64
+
+# Stand-in used while the real dictionary loads, or if it fails to load
+EMPTY_DICTIONARY = Dictionary.from_entries({})
+
+# Mode names used in statistics, indexed by Engine.MODE_*
+MODE_NAMES = ('latin', 'kedmanee', 'phonetic')
+
+NAVIGATION_KEYS = frozenset((
+    IBus.KEY_Up, IBus.KEY_Down, IBus.KEY_Left, IBus.KEY_Right,
+    IBus.KEY_Page_Up, IBus.KEY_Page_Down, IBus.KEY_Tab,
+))
+COMMIT_KEYS = frozenset((IBus.KEY_Return, IBus.KEY_KP_Enter, IBus.KEY_space))
+
+
+def classify_key(mode, keyval):
+    """Return the statistics key class of ``keyval`` in ``mode``"""
+    if keyval == IBus.KEY_BackSpace:
+        return 'backspace'
+    if keyval in COMMIT_KEYS:
+        return 'commit'
+    if keyval in NAVIGATION_KEYS:
+        return 'navigation'
+    if mode == 'phonetic' and IBus.KEY_1 <= keyval <= IBus.KEY_5:
+        # Number keys pick a candidate in phonetic mode
+        return 'commit'
+    if 32 < keyval <= 126:
+        return 'letter'
+    return 'other'
+
+
+def dump_engine_stats():
+    """Write the process statistics as JSON; return the file path, or None on failure"""
+    try:
+        return dump_stats(extra={'dictionary_engines': DICTIONARIES.share_counts()})
+    except OSError as err:
+        logging.getLogger('thaime.engine').error(f"Could not write statistics: {err}")
+        return None
 
 
 class Engine(IBus.Engine):
@@ -16,7 +80,15 @@ class Engine(IBus.Engine):
     ## INIT
     ## ====================================================================== ##
 
-    def __init__(self, bus, object_path):
+    def __init__(self, bus, object_path, pooled=False):
+        """
+        Args:
+            bus (IBus.Bus): Bus the engine is exported on
+            object_path (str): D-Bus object path of the engine
+            pooled (bool): Built ahead of time; ``start`` runs once the
+                engine is handed to IBus
+        """
+        self.__created_at = time.perf_counter()
         super(Engine, self).__init__(
             connection=bus.get_connection(),
             object_path=object_path
@@ -30,7 +102,44 @@ class Engine(IBus.Engine):
         self.__preedit_string = ""
         self.__lookup_table = IBus.LookupTable.new(5, 0, True, True)
         self.__is_invalidate = False
-        self.__trie_data = self.load_trie_data()
+        self.__update_source = 0
+        self.__lookup_table_stale = False
+        # UI renders skipped because one was already queued for this main loop pass
+        self.coalesced_updates = 0
+        self.__trie_data = EMPTY_DICTIONARY
+        # Canonical spelling of the preedit, which candidates are looked up by
+        self.__normalizer = Normalizer(IDENTITY)
+        # Candidate lookup state, worked on by the conversion thread
+        self.__converter = Converter(CANDIDATE_CACHE_SIZE)
+        # Stream feeding the lookup table, which holds only the pages fetched so far
+        self.__candidates = None
+        # Generation whose typo-tolerant tail was asked of the conversion thread
+        self.__tail_generation = 0
+        # Idle source converting the likeliest next preedits while the user pauses
+        self.__prefetch_source = 0
+        self.__dictionary_ready = False
+        self.__first_keystroke_pending = True
+        self.__loading_keystrokes = 0
+
+        # Opt-in: batch consecutive Kedmanee characters into one commit
+        self.__buffered_commit = env_flag('THAIME_BUFFERED_COMMIT')
+        self.__commit_buffer = []
+        self.__flush_source = 0
+
+        # Shared with every other engine in this process; taken by start()
+        self.__dictionary_acquired = False
+        # Hot reloads; the replacement waits here while a composition uses the old one
+        self.__pending_dictionary = None
+
+        # Words before the cursor, from surrounding text or our own commits
+        self.__language_model = None
+        self.__context_words = collections.deque(maxlen=CONTEXT_WORDS)
+        self.__language_model_path = os.path.join(DICTIONARY_DIR, LANGUAGE_MODEL_FILE)
+        self.__language_model_acquired = False
+
+        # Words this user picked before rank higher; read once per process off the main loop,
+        # written in the background
+        USER_FREQUENCIES.load_async()
 
         # Define input modes
         self.MODE_LATIN = 0
@@ -39,6 +148,37 @@ class Engine(IBus.Engine):
         self.current_mode = self.MODE_LATIN
 
         self.init_properties()
+        if not pooled:
+            self.start()
+
+    def start(self):
+        """
+        Take the shared dictionary and model, and publish the properties.
+
+        A pooled engine runs this when the factory hands it to IBus, so
+        engines waiting in the pool keep no dictionary loaded and export
+        nothing on the bus.
+        """
+        # Load times count from when IBus asked for the engine
+        self.__created_at = time.perf_counter()
+
+        # Loaded off the main loop the first time
+        self.__dictionary_acquired = True
+        dictionary = DICTIONARIES.acquire_async(
+            DICTIONARY_DIR, self.load_trie_data, self.__dictionary_loaded_cb
+        )
+        if dictionary is not None:
+            self.set_dictionary(dictionary)
+        DICTIONARIES.add_listener(DICTIONARY_DIR, self.__dictionary_replaced)
+
+        self.__language_model_acquired = True
+        language_model = DICTIONARIES.acquire_async(
+            self.__language_model_path, self.load_language_model, self.__language_model_loaded_cb
+        )
+        if language_model is not None:
+            self.__language_model = language_model
+
+        self.register_properties(self.props_list)
 
     def init_properties(self):
         """Initialize IME properties menu"""
@@ -86,8 +226,78 @@ class Engine(IBus.Engine):
         self.props_list.append(self.mode_kedmanee)
         self.props_list.append(self.mode_phonetic)
 
-        # Register properties with IBus
-        self.register_properties(self.props_list)
+        # Hidden debug action: dump latency statistics as JSON
+        self.debug_dump_stats = IBus.Property(
+            key="debug.dump_stats",
+            prop_type=IBus.PropType.NORMAL,
+            label=IBus.Text.new_from_string("Dump Statistics"),
+            tooltip=IBus.Text.new_from_string("Write key latency statistics as JSON"),
+            sensitive=True,
+            visible=False
+        )
+        self.props_list.append(self.debug_dump_stats)
+
+        # Hidden debug action: start or stop a cProfile/tracemalloc capture
+        self.debug_profile = IBus.Property(
+            key="debug.profile",
+            prop_type=IBus.PropType.NORMAL,
+            label=IBus.Text.new_from_string("Toggle Profiling"),
+            tooltip=IBus.Text.new_from_string("Capture a cProfile and tracemalloc profile"),
+            sensitive=True,
+            visible=False
+        )
+        self.props_list.append(self.debug_profile)
+
+    def __dictionary_loaded_cb(self, dictionary):
+        """Called on the loader thread; hand the dictionary to the main loop"""
+        GLib.idle_add(self.__on_dictionary_loaded, dictionary)
+
+    def __on_dictionary_loaded(self, dictionary):
+        if self.__dictionary_acquired:
+            self.set_dictionary(dictionary if dictionary is not None else EMPTY_DICTIONARY)
+        return False
+
+    def __dictionary_replaced(self, dictionary):
+        """Called on the main loop when the shared dictionary is reloaded"""
+        if not self.__dictionary_acquired:
+            return
+        if self.__preedit_string:
+            self.__pending_dictionary = dictionary
+        else:
+            self.set_dictionary(dictionary)
+
+    def __apply_pending_dictionary(self):
+        """Move to a reloaded dictionary once the composition that used the old one is over"""
+        if self.__pending_dictionary is not None:
+            dictionary, self.__pending_dictionary = self.__pending_dictionary, None
+            self.set_dictionary(dictionary)
+
+    def __language_model_loaded_cb(self, language_model):
+        """Called on the loader thread; hand the model to the main loop"""
+        GLib.idle_add(self.__on_language_model_loaded, language_model)
+
+    def __on_language_model_loaded(self, language_model):
+        if self.__language_model_acquired and language_model is not None:
+            # The converter drops candidates ranked without it on the next request
+            self.__language_model = language_model
+        return False
+
+    @property
+    def dictionary_ready(self):
+        """Whether the dictionary has finished loading"""
+        return self.__dictionary_ready
+
+    def set_dictionary(self, dictionary):
+        """Switch lookups over to a loaded dictionary"""
+        self.__trie_data = dictionary
+        self.__normalizer = Normalizer(RULES if dictionary.normalized else IDENTITY)
+        self.__candidates = None
+        if self.__dictionary_ready:
+            self.logger.info(f"Switched to a reloaded dictionary of {len(dictionary)} keys")
+            return
+        self.__dictionary_ready = True
+        elapsed_ms = (time.perf_counter() - self.__created_at) * 1000
+        self.logger.info(f"Dictionary ready {elapsed_ms:.1f} ms after engine creation")
 
     ## ====================================================================== ##
     ## HANDLING STATES
@@ -101,6 +311,10 @@ class Engine(IBus.Engine):
             self.set_mode(self.MODE_KEDMANEE)
         elif prop_name == 'mode.phonetic':
             self.set_mode(self.MODE_PHONETIC)
+        elif prop_name == 'debug.dump_stats':
+            dump_engine_stats()
+        elif prop_name == 'debug.profile':
+            PROFILER.toggle()
 
     def set_mode(self, new_mode):
         """Switch to a new input mode and update UI"""
@@ -140,9 +354,13 @@ class Engine(IBus.Engine):
         if not is_press:
             return False
         
-        # Log the keystroke
-        key_char = chr(keyval) if 32 <= keyval <= 126 else f"<{keyval}>"
-        self.logger.info(f"Key pressed: keyval={keyval} (0x{keyval:x}) '{key_char}', keycode={keycode}, state={state} (0x{state:x})")
+        # Log the keystroke; guarded so nothing is formatted unless DEBUG is on
+        if self.logger.isEnabledFor(logging.DEBUG):
+            key_char = chr(keyval) if 32 <= keyval <= 126 else f"<{keyval}>"
+            self.logger.debug(
+                "Key pressed: keyval=%d (0x%x) '%s', keycode=%d, state=%d (0x%x)",
+                keyval, keyval, key_char, keycode, state, state
+            )
         
         # TODO: Handle mode switching shortcuts (optional)
         if state & IBus.ModifierType.CONTROL_MASK:
@@ -158,15 +376,21 @@ class Engine(IBus.Engine):
         
         # Route to mode-specific processing
         if self.current_mode == self.MODE_LATIN:
-            return self.process_latin_input(keyval, keycode, state)
+            handler = self.process_latin_input
         elif self.current_mode == self.MODE_KEDMANEE:
-            return self.process_kedmanee_input(keyval, keycode, state)
+            handler = self.process_kedmanee_input
         elif self.current_mode == self.MODE_PHONETIC:
-            return self.process_phonetic_input(keyval, keycode, state)
-        
-        # This should never happen
-        self.logger.error(f"do_process_key_event: Unexpected IME mode - {self.current_mode}")
-        raise RuntimeError(f"do_process_key_event: Unexpected IME mode - {self.current_mode}")
+            handler = self.process_phonetic_input
+        else:
+            # This should never happen
+            self.logger.error(f"do_process_key_event: Unexpected IME mode - {self.current_mode}")
+            raise RuntimeError(f"do_process_key_event: Unexpected IME mode - {self.current_mode}")
+
+        start = time.perf_counter_ns()
+        handled = handler(keyval, keycode, state)
+        mode_name = MODE_NAMES[self.current_mode]
+        STATS.record_latency(mode_name, classify_key(mode_name, keyval), time.perf_counter_ns() - start)
+        return handled
     
     def process_latin_input(self, keyval, keycode, state):
         """Latin ANSI-QWERTY keyboard layout mode"""
@@ -177,6 +401,7 @@ class Engine(IBus.Engine):
         """Thai Kedmanee mode: convert QWERTY keys to Thai characters"""
         # Skip if modifier keys are pressed (except Shift for uppercase)
         if state & (IBus.ModifierType.CONTROL_MASK | IBus.ModifierType.MOD1_MASK):
+            self.flush_commit_buffer()
             return False
 
         # Convert key to character if it's printable
@@ -185,26 +410,68 @@ class Engine(IBus.Engine):
             thai_char = KEDMANEE_KEYMAP.get(char)
 
             if thai_char:
-                self.logger.info(f"Converting '{char}' to '{thai_char}'")
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug("Converting '%s' to '%s'", char, thai_char)
+                if self.__buffered_commit:
+                    # Commit the whole run of Thai characters once the burst ends
+                    self.__commit_buffer.append(thai_char)
+                    if not self.__flush_source:
+                        self.__flush_source = GLib.idle_add(
+                            self.__flush_commit_buffer_idle, priority=GLib.PRIORITY_LOW
+                        )
+                    return True
+
                 # Commit the Thai character
                 text = IBus.Text.new_from_string(thai_char)
                 self.commit_text(text)
                 return True  # Consume the key event
 
+        # Buffered text must reach the application before this key does
+        self.flush_commit_buffer()
         return False  # Let the system handle it normally
 
+    def flush_commit_buffer(self):
+        """Commit any buffered Kedmanee characters as a single text"""
+        if self.__flush_source:
+            GLib.source_remove(self.__flush_source)
+            self.__flush_source = 0
+        if not self.__commit_buffer:
+            return
+        text = ''.join(self.__commit_buffer)
+        self.__commit_buffer.clear()
+        self.commit_text(IBus.Text.new_from_string(text))
+
+    def __flush_commit_buffer_idle(self):
+        self.__flush_source = 0
+        self.flush_commit_buffer()
+        return False
+
     def process_phonetic_input(self, keyval, keycode, state):
         """Handle phonetic input mode"""
         # Skip if modifier keys are pressed
         if state & (IBus.ModifierType.CONTROL_MASK | IBus.ModifierType.MOD1_MASK):
             return False
 
+        if not self.__dictionary_ready:
+            # Degraded mode: type plain Latin until the dictionary is loaded
+            self.__loading_keystrokes += 1
+            return False
+
+        if self.__first_keystroke_pending:
+            self.__first_keystroke_pending = False
+            elapsed_ms = (time.perf_counter() - self.__created_at) * 1000
+            self.logger.info(
+                f"First usable phonetic keystroke {elapsed_ms:.1f} ms after engine creation "
+                f"({self.__loading_keystrokes} keys passed through while loading)"
+            )
+
         key_char = chr(keyval)
 
         if keyval == IBus.KEY_BackSpace:
             if self.__preedit_string:
                 self.__preedit_string = self.__preedit_string[:-1]
-                self.update_preedit_and_lookup()
+                self.__normalizer.pop()
+                self.__preedit_changed()
                 return True
             return False
 
@@ -214,6 +481,10 @@ class Engine(IBus.Engine):
                 return True
             return False
         
+        # Keys below read the lookup table, which may lag behind queued renders; keys
+        # that commit from it must see the candidates of the current preedit
+        self.__sync_lookup_table(keyval in COMMIT_KEYS or IBus.KEY_1 <= keyval <= IBus.KEY_5)
+
         if keyval in (IBus.KEY_Return, IBus.KEY_KP_Enter, IBus.KEY_space):
             if self.__preedit_string:
                 if self.__lookup_table.get_number_of_candidates() > 0:
@@ -222,6 +493,8 @@ class Engine(IBus.Engine):
                         self.commit_candidate(candidate)
                 else:
                     self.commit_text(IBus.Text.new_from_string(self.__preedit_string))
+                    # Latin text breaks the Thai word context
+                    self.__context_words.clear()
                 
                 self.do_reset()
                 
@@ -236,57 +509,293 @@ class Engine(IBus.Engine):
             return False
 
         if keyval == IBus.KEY_Up:
-            if self.__lookup_table.get_number_of_candidates() > 0:
-                self.__lookup_table.cursor_up()
-                self.update_lookup_table(self.__lookup_table, True)
-                return True
-            return False
+            return self.cursor_up_lookup_table()
 
         if keyval == IBus.KEY_Down:
-            if self.__lookup_table.get_number_of_candidates() > 0:
-                self.__lookup_table.cursor_down()
-                self.update_lookup_table(self.__lookup_table, True)
-                return True
-            return False
+            return self.cursor_down_lookup_table()
+
+        if keyval == IBus.KEY_Page_Up:
+            # Consumed on the first page too, so it does not scroll the application
+            return self.page_up_lookup_table() or bool(self.__preedit_string)
+
+        if keyval == IBus.KEY_Page_Down:
+            return self.page_down_lookup_table() or bool(self.__preedit_string)
 
         if IBus.KEY_1 <= keyval <= IBus.KEY_5:
             if self.__preedit_string:
-                candidates = self.lookup_candidates(self.__preedit_string)
-                index = keyval - IBus.KEY_1
-                if index < len(candidates):
-                    self.commit_candidate(candidates[index])
+                # Number keys pick from the page already shown in the lookup table
+                cursor_pos = self.__lookup_table.get_cursor_pos()
+                index = cursor_pos - self.__lookup_table.get_cursor_in_page() + keyval - IBus.KEY_1
+                if index < self.__lookup_table.get_number_of_candidates():
+                    self.commit_candidate(self.__lookup_table.get_candidate(index))
                     self.do_reset()
                     return True
 
         if 'a' <= key_char.lower() <= 'z':
             self.__preedit_string += key_char.lower()
-            self.update_preedit_and_lookup()
+            self.__normalizer.push(key_char.lower())
+            self.__preedit_changed()
             return True
 
         return False
 
     def load_trie_data(self):
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        trie_path = os.path.join(script_dir, 'trie.json')
+        """Use the conversion server if configured and up, else load the dictionary in-process"""
+        if CONVERSION_CLIENT is not None:
+            try:
+                dictionary = RemoteDictionary.connect(
+                    CONVERSION_CLIENT, DICTIONARY_DIR, self.load_local_trie_data
+                )
+            except ServerUnavailable as err:
+                self.logger.warning(f"Conversion server unavailable, loading the dictionary in-process: {err}")
+            else:
+                self.logger.info(f"Using the conversion server at {CONVERSION_CLIENT.path}, "
+                                 f"{len(dictionary)} keys")
+                return dictionary
+        return self.load_local_trie_data()
+
+    def load_local_trie_data(self):
+        """Load the compiled dictionary, recompiling it first if trie.json is newer"""
+        json_path = os.path.join(DICTIONARY_DIR, JSON_FILE)
+        bin_path = os.path.join(DICTIONARY_DIR, BINARY_FILE)
+        file_names = (BINARY_FILE, JSON_FILE)
+        signature = file_signature(DICTIONARY_DIR)
+        # Same rule as a hot reload, so an edit made while no engine ran is not ignored
+        if signature[1] is not None and json_is_newer(signature):
+            message = compile_dictionary(json_path, bin_path)
+            if message is not None:
+                self.logger.error(f"Could not compile {json_path}, loading it directly: {message}")
+                file_names = (JSON_FILE, BINARY_FILE)
+        for file_name in file_names:
+            trie_path = os.path.join(DICTIONARY_DIR, file_name)
+            start = time.perf_counter()
+            try:
+                trie_data = load_dictionary(trie_path)
+            except FileNotFoundError:
+                continue
+            except (OSError, DictionaryError) as err:
+                self.logger.error(f"Error loading Trie data from {trie_path}: {err}")
+                continue
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            STATS.record_dictionary_load(trie_path, elapsed_ms, len(trie_data))
+            self.logger.info(f"Loaded {len(trie_data)} Trie keys from {trie_path} in {elapsed_ms:.1f} ms")
+            return trie_data
+
+        self.logger.error(f"Trie data file not found in {DICTIONARY_DIR}")
+        return EMPTY_DICTIONARY
+
+    def load_language_model(self):
+        """Open the n-gram model; None when there is none, which keeps static ranking"""
+        start = time.perf_counter()
         try:
-            with open(trie_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            language_model = LanguageModel.open(self.__language_model_path)
         except FileNotFoundError:
-            self.logger.error(f"Trie data file not found at {trie_path}")
-            return {}
-        except json.JSONDecodeError:
-            self.logger.error(f"Error decoding Trie data from {trie_path}")
-            return {}
-
-    def lookup_candidates(self, prefix):
-        if not prefix:
-            return []
-        
-        candidates = self.__trie_data.get(prefix, [])
-        # Sort by frequency (descending)
-        sorted_candidates = sorted(candidates, key=lambda item: item[1], reverse=True)
-        # Return only the Thai word
-        return [IBus.Text.new_from_string(c[0]) for c in sorted_candidates]
+            self.logger.info(f"No language model at {self.__language_model_path}, ranking by frequency")
+            return None
+        except (OSError, LanguageModelError) as err:
+            self.logger.error(f"Error loading language model from {self.__language_model_path}: {err}")
+            return None
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.logger.info(f"Loaded a {language_model.order}-gram model of {len(language_model)} words "
+                         f"from {self.__language_model_path} in {elapsed_ms:.1f} ms")
+        return language_model
+
+    def lookup_cursor_candidates(self):
+        """Candidate stream for the current preedit, waiting a bounded time for the conversion thread"""
+        if self.__lookup_table_stale:
+            return self.__converter.wait(self.__converter.generation, WAIT_TIMEOUT_MS / 1000)
+        return self.__candidates
+
+    def __request_candidates(self):
+        """Ask the conversion thread for the candidates of the current preedit"""
+        request = self.__conversion_request(self.__converter.advance())
+        CONVERSIONS.submit(self.__converter, request, self.__candidates_ready_cb)
+
+    def __conversion_request(self, generation):
+        context = tuple(self.__context_words) if self.__language_model is not None else ()
+        return ConversionRequest(
+            generation=generation,
+            text=self.__normalizer.text,
+            context=context,
+            dictionary=self.__trie_data,
+            language_model=self.__language_model,
+            page_size=self.__lookup_table.get_page_size(),
+        )
+
+    def __candidates_ready_cb(self, generation, candidates):
+        """Called on the conversion thread; hand the result to the main loop"""
+        GLib.idle_add(self.__on_candidates_ready, generation, candidates)
+
+    def __on_candidates_ready(self, generation, candidates):
+        if generation == self.__converter.generation and candidates.alive:
+            # The user may pause now; get the next keys ready meanwhile. Past a dead
+            # prefix no next letter leads to a key, bar a rewrite such as 'ph' to 'f'
+            self.__schedule_prefetch()
+        if generation != self.__converter.generation or not self.__lookup_table_stale:
+            # The preedit changed since, or a key already waited for this result
+            STATS.count('conversions_stale')
+            return False
+        self.__show_candidates(candidates)
+        if not self.__is_invalidate:
+            # Otherwise the queued render shows them with the preedit
+            self.__update_lookup_table_ui()
+        return False
+
+    def __schedule_prefetch(self):
+        """Queue a prefetch job for when the main loop has nothing else to do"""
+        if (PREFETCH_LETTERS <= 0 or self.__prefetch_source or not self.__preedit_string
+                or self.current_mode != self.MODE_PHONETIC):
+            return
+        self.__prefetch_source = GLib.idle_add(self.__prefetch_idle, priority=GLib.PRIORITY_LOW)
+
+    def __prefetch_idle(self):
+        self.__prefetch_source = 0
+        if self.__preedit_string:
+            request = PrefetchRequest(
+                base=self.__conversion_request(self.__converter.generation),
+                preedit=self.__preedit_string,
+                rules=self.__normalizer.rules,
+            )
+            CONVERSIONS.submit(self.__converter, request, self.__prefetch_done_cb)
+        return False
+
+    def __prefetch_done_cb(self, generation, remaining):
+        """Called on the conversion thread after a prefetch job"""
+        if remaining:
+            GLib.idle_add(self.__on_prefetch_done, generation)
+
+    def __on_prefetch_done(self, generation):
+        if generation == self.__converter.generation:
+            self.__schedule_prefetch()
+        return False
+
+    def __preedit_changed(self):
+        """Request candidates, mark the lookup table stale and queue one UI render for this burst of keys"""
+        self.__lookup_table_stale = True
+        if self.__preedit_string:
+            self.__request_candidates()
+        else:
+            self.__converter.advance()
+            self.__lookup_table_stale = False
+            self.__candidates = None
+            self.__lookup_table.clear()
+            self.__apply_pending_dictionary()
+        self.__invalidate()
+
+    def __sync_lookup_table(self, committing=False):
+        """
+        Refill the lookup table if the preedit changed since the last fill, waiting if needed.
+
+        Args:
+            committing (bool): The key commits from the table, so it must
+                not be left holding an older preedit's candidates
+        """
+        if self.__lookup_table_stale:
+            candidates = self.lookup_cursor_candidates()
+            if candidates is None:
+                STATS.count('conversion_wait_timeouts')
+                if not committing:
+                    # The worker is late; keep the table last shown, its callback refills it
+                    return
+                candidates = self.__convert_now()
+            self.__show_candidates(candidates)
+
+    def __convert_now(self):
+        """Convert the current preedit on the main loop, for a commit the worker is too late for"""
+        STATS.count('conversions_on_main_loop')
+        # A converter of its own: the worker may still be using the engine's one
+        converter = Converter(1)
+        return converter.convert(self.__conversion_request(converter.generation))
+
+    def __show_candidates(self, candidates):
+        """Fill the first page of the lookup table; local only, IBus is not notified"""
+        self.__lookup_table_stale = False
+        self.__candidates = candidates
+        self.__lookup_table.clear()
+        self.__lookup_table.set_orientation(IBus.Orientation.VERTICAL)
+        self.__fill_lookup_table(self.__lookup_table.get_page_size())
+
+    def __fill_lookup_table(self, count):
+        """Append candidates until the table holds ``count``; return whether any were added"""
+        if self.__candidates is None:
+            return False
+        table = self.__lookup_table
+        filled = table.get_number_of_candidates()
+        # A cached stream may hold more than is asked for; the table still grows a page at a time
+        available = min(len(self.__candidates), count)
+        for index in range(filled, available):
+            table.append_candidate(IBus.Text.new_from_string(self.__candidates[index]))
+        if available < count and self.__candidates.pending:
+            self.__request_tail()
+        return available > filled
+
+    def __request_tail(self):
+        """Ask the conversion thread for the typo-tolerant candidates after the last one"""
+        generation = self.__converter.generation
+        if self.__tail_generation == generation:
+            return
+        self.__tail_generation = generation
+        CONVERSIONS.submit(self.__converter, TailRequest(generation, self.__candidates), self.__tail_ready_cb)
+
+    def __tail_ready_cb(self, generation, stream):
+        """Called on the conversion thread; hand the longer stream to the main loop"""
+        GLib.idle_add(self.__on_tail_ready, generation, stream)
+
+    def __on_tail_ready(self, generation, stream):
+        if (generation != self.__converter.generation or stream is not self.__candidates
+                or self.__lookup_table_stale):
+            return False
+        # Offer the page that was asked for; the next page key moves to it
+        table = self.__lookup_table
+        if self.__fill_lookup_table(table.get_number_of_candidates() + table.get_page_size()):
+            STATS.count('candidate_pages')
+            self.__update_lookup_table_ui()
+        return False
+
+    def page_down_lookup_table(self):
+        """Show the next page of candidates, fetching it first; return whether the page changed"""
+        self.__sync_lookup_table()
+        table = self.__lookup_table
+        page_size = table.get_page_size()
+        page_start = table.get_cursor_pos() - table.get_cursor_in_page()
+        if self.__fill_lookup_table(page_start + 2 * page_size):
+            STATS.count('candidate_pages')
+        if table.get_number_of_candidates() > 0 and table.page_down():
+            self.update_lookup_table(table, True)
+            return True
+        return False
+
+    def page_up_lookup_table(self):
+        """Show the previous page of candidates; return whether the page changed"""
+        self.__sync_lookup_table()
+        table = self.__lookup_table
+        if table.get_number_of_candidates() > 0 and table.page_up():
+            self.update_lookup_table(table, True)
+            return True
+        return False
+
+    def cursor_down_lookup_table(self):
+        """Move the candidate cursor down, fetching the next page past the end"""
+        self.__sync_lookup_table()
+        table = self.__lookup_table
+        if table.get_number_of_candidates() == 0:
+            return False
+        if table.get_cursor_pos() + 1 >= table.get_number_of_candidates():
+            if self.__fill_lookup_table(table.get_number_of_candidates() + table.get_page_size()):
+                STATS.count('candidate_pages')
+        table.cursor_down()
+        self.update_lookup_table(table, True)
+        return True
+
+    def cursor_up_lookup_table(self):
+        """Move the candidate cursor up"""
+        self.__sync_lookup_table()
+        table = self.__lookup_table
+        if table.get_number_of_candidates() == 0:
+            return False
+        table.cursor_up()
+        self.update_lookup_table(table, True)
+        return True
 
     def update_preedit_and_lookup(self):
         if not self.__preedit_string:
@@ -297,18 +806,13 @@ class Engine(IBus.Engine):
         preedit_text = IBus.Text.new_from_string(self.__preedit_string)
         self.update_preedit_text(preedit_text, len(self.__preedit_string), True)
         
-        # Update lookup table
-        candidates = self.lookup_candidates(self.__preedit_string)
-        self.__lookup_table.clear()
-        if candidates:
-            self.__lookup_table.set_orientation(IBus.Orientation.VERTICAL)
-            for candidate in candidates[:5]:
-                self.__lookup_table.append_candidate(candidate)
-            
-            if self.__lookup_table.get_number_of_candidates() > 0:
-                self.update_lookup_table(self.__lookup_table, True)
-            else:
-                self.hide_lookup_table()
+        # Update lookup table, unless its candidates are still being computed
+        if not self.__lookup_table_stale:
+            self.__update_lookup_table_ui()
+
+    def __update_lookup_table_ui(self):
+        if self.__lookup_table.get_number_of_candidates() > 0:
+            self.update_lookup_table(self.__lookup_table, True)
         else:
             self.hide_lookup_table()
 
@@ -316,8 +820,37 @@ class Engine(IBus.Engine):
         self.hide_preedit_text()
         self.hide_lookup_table()
 
+    ## ====================================================================== ##
+    ## IBUS UI CALLS
+    ## Each of these is a D-Bus round trip, counted for the statistics
+    ## ====================================================================== ##
+
+    def commit_text(self, text):
+        STATS.count('ui.commit_text')
+        super(Engine, self).commit_text(text)
+
+    def update_preedit_text(self, text, cursor_pos, visible):
+        STATS.count('ui.update_preedit_text')
+        super(Engine, self).update_preedit_text(text, cursor_pos, visible)
+
+    def hide_preedit_text(self):
+        STATS.count('ui.hide_preedit_text')
+        super(Engine, self).hide_preedit_text()
+
+    def update_lookup_table(self, table, visible):
+        STATS.count('ui.update_lookup_table')
+        super(Engine, self).update_lookup_table(table, visible)
+
+    def hide_lookup_table(self):
+        STATS.count('ui.hide_lookup_table')
+        super(Engine, self).hide_lookup_table()
+
     def commit_candidate(self, candidate):
         self.commit_text(candidate)
+        # Phrases add their text as one word; the model only knows it if it is one
+        word = candidate.get_text()
+        self.__context_words.append(word)
+        USER_FREQUENCIES.learn(word)
 
     ## ====================================================================== ##
     ## BEHAVIORS
@@ -331,13 +864,43 @@ class Engine(IBus.Engine):
     def do_focus_out(self):
         """Called when the engine loses focus"""
         self.logger.debug("Engine focused out")
+        self.flush_commit_buffer()
 
     def do_reset(self):
         """Called when the engine needs to be reset"""
         self.logger.debug("Engine reset")
+        self.flush_commit_buffer()
         self.__preedit_string = ""
+        self.__normalizer.reset()
+        self.__lookup_table.clear()
+        self.__lookup_table_stale = False
+        self.__candidates = None
+        # Results still on their way belong to the text just cleared
+        self.__converter.advance()
+        self.__apply_pending_dictionary()
+        self.__cancel_update()
         self.hide_preedit_and_lookup()
 
+    def do_destroy(self):
+        """Called when IBus destroys the engine"""
+        self.logger.debug("Engine destroyed")
+        self.flush_commit_buffer()
+        if self.__dictionary_acquired:
+            self.__dictionary_acquired = False
+            self.__pending_dictionary = None
+            DICTIONARIES.remove_listener(DICTIONARY_DIR, self.__dictionary_replaced)
+            DICTIONARIES.release(DICTIONARY_DIR)
+        if self.__language_model_acquired:
+            self.__language_model_acquired = False
+            self.__language_model = None
+            DICTIONARIES.release(self.__language_model_path)
+        if self.__prefetch_source:
+            GLib.source_remove(self.__prefetch_source)
+            self.__prefetch_source = 0
+        # Prefetch jobs still queued see a newer generation and drop out
+        self.__converter.advance()
+        super(Engine, self).do_destroy()
+
     def do_enable(self):
         """Called when the engine is enabled"""
         self.logger.info("Engine enabled")
@@ -345,22 +908,62 @@ class Engine(IBus.Engine):
     def do_disable(self):
         """Called when the engine is disabled"""
         self.logger.info("Engine disabled")
+        self.flush_commit_buffer()
+
+    def do_page_up(self):
+        """Called when the previous page button of the candidate panel is clicked"""
+        self.page_up_lookup_table()
+
+    def do_page_down(self):
+        """Called when the next page button of the candidate panel is clicked"""
+        self.page_down_lookup_table()
+
+    def do_cursor_up(self):
+        """Called when the candidate panel asks for the previous candidate"""
+        self.cursor_up_lookup_table()
+
+    def do_cursor_down(self):
+        """Called when the candidate panel asks for the next candidate"""
+        self.cursor_down_lookup_table()
 
     def do_set_cursor_location(self, x, y, w, h):
         """Called when the cursor location changes"""
-        self.logger.debug(f"Cursor location: x={x}, y={y}, w={w}, h={h}")
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Cursor location: x=%d, y=%d, w=%d, h=%d", x, y, w, h)
 
     def do_set_surrounding_text(self, text, cursor_pos, anchor_pos):
         """Called when surrounding text changes"""
-        self.logger.debug(f"Surrounding text: '{text}', cursor={cursor_pos}, anchor={anchor_pos}")
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Surrounding text: '%s', cursor=%d, anchor=%d", text, cursor_pos, anchor_pos)
+
+        # The application knows better than our commit history what precedes the cursor
+        if self.__language_model is not None:
+            before = text.get_text()[max(0, cursor_pos - CONTEXT_CHARS):cursor_pos]
+            self.__context_words.clear()
+            self.__context_words.extend(self.__language_model.last_words(before, CONTEXT_WORDS))
 
     def __invalidate(self):
         if self.__is_invalidate:
+            self.coalesced_updates += 1
+            STATS.count('ui.coalesced_updates')
             return
         self.__is_invalidate = True
-        GLib.idle_add(self.__update, priority=GLib.PRIORITY_LOW)
+        # Low priority, so every key event already queued is handled first
+        self.__update_source = GLib.idle_add(self.__update, priority=GLib.PRIORITY_LOW)
+
+    def __cancel_update(self):
+        if not self.__is_invalidate:
+            return
+        GLib.source_remove(self.__update_source)
+        self.__is_invalidate = False
+        self.__update_source = 0
 
     def __update(self):
         """Update the engine state"""
         self.logger.debug("Updating engine state")
-        self.__is_invalidate = False
\ No newline at end of file
+        self.__is_invalidate = False
+        self.__update_source = 0
+        start = time.perf_counter_ns()
+        self.update_preedit_and_lookup()
+        STATS.record_latency(MODE_NAMES[self.current_mode], 'render', time.perf_counter_ns() - start)
+        return False
\ No newline at end of file
@@ -1,29 +1,85 @@
+import collections
 import logging
+import time
 
 import gi
 gi.require_version('IBus', '1.0')
 
 import engine
-from gi.repository import IBus
+from config import env_int
+from gi.repository import GLib, IBus
+from instrumentation import STATS
+from registry import DICTIONARIES
+
+# Engines constructed ahead of time and handed out on creation; 0 disables the pool.
+# A pooled engine holds only its own state, a few kilobytes with its empty caches: it
+# takes the shared dictionary and registers its properties when handed out, so the
+# dictionary is still freed once the last engine in use is destroyed, and the next
+# engine after that waits for it to load again like the first one did
+ENGINE_POOL_SIZE = env_int('THAIME_ENGINE_POOL', 2)
 
 
 class EngineFactory(IBus.Factory):
-    def __init__(self, bus):
+    def __init__(self, bus, pool_size=ENGINE_POOL_SIZE):
         self.__bus = bus
         super(EngineFactory, self).__init__(self.__bus)
 
         self.__id = 0
         self.logger = logging.getLogger('thaime.factory')
-        self.logger.info("Engine factory created")
+
+        # Never handed to IBus yet, so nothing to reset when one is taken
+        self.__pool_size = max(0, pool_size)
+        self.__pool = collections.deque()
+        self.__fill_source = 0
+        self.__schedule_fill()
+        self.logger.info(f"Engine factory created, keeping {self.__pool_size} engines ready")
 
     def do_create_engine(self, engine_name):
         self.logger.info(f"Creating engine: {engine_name}")
-        self.__id += 1
-        engine_path = f"/org/freedesktop/IBus/Thaime/Engine/{self.__id}"
-        self.logger.info(f"Creating engine instance with path: {engine_path}")
 
         if engine_name == "thaime":
-            return engine.Engine(self.__bus, engine_path)
+            start = time.perf_counter_ns()
+            if self.__pool:
+                new_engine = self.__pool.popleft()
+                new_engine.start()
+                STATS.count('engine_pool_hits')
+            else:
+                new_engine = self.__construct()
+                STATS.count('engine_pool_misses')
+            STATS.record_latency('factory', 'create_engine', time.perf_counter_ns() - start)
+            self.logger.info(f"Handing out engine with path: {new_engine.get_object_path()}")
+            self.logger.info(f"Engines sharing each dictionary: {DICTIONARIES.share_counts()}")
+            # Replace it once the main loop has nothing better to do
+            self.__schedule_fill()
+            return new_engine
         else:
             self.logger.error(f"Unknown engine name: {engine_name}")
-            raise NotImplementedError(f"Unknown engine name: {engine_name}")
\ No newline at end of file
+            raise NotImplementedError(f"Unknown engine name: {engine_name}")
+
+    def do_destroy(self):
+        if self.__fill_source:
+            GLib.source_remove(self.__fill_source)
+            self.__fill_source = 0
+        while self.__pool:
+            self.__pool.popleft().destroy()
+        super(EngineFactory, self).do_destroy()
+
+    def __construct(self, pooled=False):
+        self.__id += 1
+        engine_path = f"/org/freedesktop/IBus/Thaime/Engine/{self.__id}"
+        self.logger.info(f"Creating engine instance with path: {engine_path}")
+        return engine.Engine(self.__bus, engine_path, pooled=pooled)
+
+    def __schedule_fill(self):
+        if self.__fill_source or len(self.__pool) >= self.__pool_size:
+            return
+        self.__fill_source = GLib.idle_add(self.__fill_idle, priority=GLib.PRIORITY_LOW)
+
+    def __fill_idle(self):
+        # One engine per dispatch, so a key event never waits behind the whole pool
+        self.__pool.append(self.__construct(pooled=True))
+        STATS.count('engine_pool_filled')
+        if len(self.__pool) < self.__pool_size:
+            return GLib.SOURCE_CONTINUE
+        self.__fill_source = 0
+        return GLib.SOURCE_REMOVE
@@ -0,0 +1,192 @@
+"""
+Thaime Fuzzy Lookup
+
+This module provides typo-tolerant key lookup: it finds the dictionary keys
+within a small edit distance of the typed romanization by walking the trie
+with one Levenshtein row per node, and abandons any branch whose row can
+no longer come within the allowed distance. Keys sharing a prefix share
+the work for it, so only a thin slice of the trie is visited instead of
+every key.
+
+The walk stops when its time budget runs out and returns what it found so
+far, keeping lookups inside a keystroke. Searches one edit away are cheap;
+two edits cost about ten times more and only run when one edit finds
+nothing.
+"""
+
+import time
+
+from dictionary import NO_NODE, ROOT
+
+# Edit distance allowed for the typed length: nothing for very short input,
+# where everything is close, then one edit, then two
+DISTANCE_STEPS = ((3, 1), (6, 2))
+
+# Default time budget of one search, in nanoseconds
+DEFAULT_BUDGET_NS = 5_000_000
+
+# Leading characters assumed typed correctly. Typos rarely hit the first
+# letter, and fixing it skips most of the trie
+DEFAULT_FIXED_PREFIX = 1
+
+# Nodes visited between two clock reads
+CLOCK_INTERVAL = 64
+
+
+def max_distance(length):
+    """Return the edit distance tolerated for input of ``length`` characters"""
+    distance = 0
+    for min_length, step in DISTANCE_STEPS:
+        if length >= min_length:
+            distance = step
+    return distance
+
+
+class FuzzyResult:
+    """Keys found by one search, with how the search ended"""
+
+    def __init__(self, matches, visited, complete):
+        # (key index, distance) pairs, closest first
+        self.matches = matches
+        self.visited = visited
+        # False when the time budget cut the search short
+        self.complete = complete
+
+
+def advance(query, row, depth, label, distance):
+    """
+    Return the Levenshtein row one trie edge further down, and its smallest cell.
+
+    Only cells within ``distance`` of the diagonal are computed; the others
+    can never come back in reach and stay at ``distance + 1``.
+    """
+    far = distance + 1
+    width = len(query) + 1
+    first = max(1, depth - distance)
+    last = min(width - 1, depth + distance)
+
+    next_row = [far] * width
+    if depth <= distance:
+        next_row[0] = depth
+    best = left = next_row[first - 1]
+    for column in range(first, last + 1):
+        cell = row[column - 1] if query[column - 1] == label else row[column - 1] + 1
+        if row[column] + 1 < cell:
+            cell = row[column] + 1
+        if left + 1 < cell:
+            cell = left + 1
+        if cell > far:
+            cell = far
+        next_row[column] = left = cell
+        if cell < best:
+            best = cell
+    return next_row, best
+
+
+def search(dictionary, text, distance=None, budget_ns=DEFAULT_BUDGET_NS,
+           fixed_prefix=DEFAULT_FIXED_PREFIX):
+    """
+    Find the keys within ``distance`` edits of ``text``.
+
+    Substitutions, insertions and deletions each count as one edit. The exact
+    key, if present, is included at distance 0. Keys must start with the
+    first ``fixed_prefix`` characters of ``text``.
+
+    Args:
+        dictionary (Dictionary): Dictionary to search
+        text (str): Typed romanization
+        distance (int): Maximum edit distance; defaults to ``max_distance(len(text))``
+        budget_ns (int): Time after which the search stops early
+        fixed_prefix (int): Leading characters that must match exactly
+
+    Returns:
+        FuzzyResult: The keys found, closest first, in key order within a distance
+    """
+    query = text.encode('utf-8')
+    if distance is None:
+        distance = max_distance(len(query))
+
+    deadline = time.perf_counter_ns() + budget_ns
+    far = distance + 1
+    matches = []
+    visited = 0
+    complete = True
+
+    # Follow the fixed prefix exactly, then branch out
+    node = ROOT
+    row = [min(column, far) for column in range(len(query) + 1)]
+    prefix = query[:fixed_prefix]
+    for depth, label in enumerate(prefix, start=1):
+        node = dictionary.child(node, label)
+        if node == NO_NODE:
+            return FuzzyResult(matches, visited, complete)
+        row, _ = advance(query, row, depth, label, distance)
+
+    # Depth-first, each entry carrying the node, its depth and its Levenshtein row
+    stack = [(node, len(prefix), row)]
+    while stack:
+        node, depth, row = stack.pop()
+        visited += 1
+        if visited % CLOCK_INTERVAL == 0 and time.perf_counter_ns() > deadline:
+            complete = False
+            break
+
+        if row[-1] <= distance:
+            index = dictionary.node_key(node)
+            if index >= 0:
+                matches.append((index, row[-1]))
+
+        # Every label missing from the query band yields the same row, so it is
+        # computed once and, when out of reach, prunes all those children at once
+        depth += 1
+        band = query[max(0, depth - 1 - distance):depth + distance]
+        other_row, other_best = advance(query, row, depth, -1, distance)
+        likely = []
+        for label, child in dictionary.children(node):
+            if label in band:
+                next_row, best = advance(query, row, depth, label, distance)
+                # No cell within reach: no key below this child can match
+                if best <= distance:
+                    likely.append((child, depth, next_row))
+            elif other_best <= distance:
+                stack.append((child, depth, other_row))
+        # Children spelled like the query are explored first, so a search cut
+        # short by the budget has still looked where matches are most likely
+        stack.extend(reversed(likely))
+
+    matches.sort(key=lambda match: match[1])
+    return FuzzyResult(matches, visited, complete)
+
+
+def fuzzy_candidates(dictionary, text, limit, budget_ns=DEFAULT_BUDGET_NS):
+    """
+    Return candidates of keys near ``text``, excluding ``text`` itself.
+
+    Searches one edit away first, and only widens the search when nothing
+    was found and the shared budget lasts.
+
+    Returns:
+        tuple: (list of (thai_word, frequency, distance), list of FuzzyResult);
+        words are ordered by distance, then frequency
+    """
+    deadline = time.perf_counter_ns() + budget_ns
+    candidates = []
+    results = []
+    seen = set()
+    for distance in range(1, max_distance(len(text)) + 1):
+        remaining = deadline - time.perf_counter_ns()
+        if remaining <= 0 or candidates:
+            break
+        result = search(dictionary, text, distance, remaining)
+        results.append(result)
+
+        found = []
+        for index, edits in result.matches:
+            if edits == distance:
+                found.extend((word, freq, edits) for word, freq in dictionary.candidates(index))
+        found.sort(key=lambda item: -item[1])
+        for item in found:
+            if item[0] not in seen:
+                seen.add(item[0])
+                candidates.append(item)
+    return candidates[:limit], results
@@ -0,0 +1,190 @@
+"""
+Thaime Instrumentation
+
+This module provides the always-on, fixed-memory statistics the engine
+keeps about itself: key handling latency histograms per input mode and key
+class, event counters, and dictionary load timings. A snapshot can be
+written as JSON at any time, e.g. on SIGUSR1.
+"""
+
+import collections
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from config import env_str
+
+logger = logging.getLogger('thaime.instrumentation')
+
+# Histogram resolution: SUB_BUCKETS buckets per power of two microseconds,
+# covering 1 us to 2^OCTAVES us (about 16 s); slower samples land in the last bucket
+SUB_BUCKETS = 4
+OCTAVES = 24
+BUCKET_COUNT = 2 + OCTAVES * SUB_BUCKETS
+
+# Number of dictionary loads remembered
+LOAD_HISTORY = 16
+
+
+def bucket_index(ns):
+    """Return the histogram bucket for a duration in nanoseconds"""
+    us = ns // 1000
+    if us < 1:
+        return 0
+    octave = us.bit_length() - 1
+    if octave >= OCTAVES:
+        return BUCKET_COUNT - 1
+    sub = ((us - (1 << octave)) * SUB_BUCKETS) >> octave
+    return 1 + octave * SUB_BUCKETS + sub
+
+
+def bucket_upper_us(index):
+    """Return the upper bound of a histogram bucket in microseconds"""
+    if index == 0:
+        return 1.0
+    if index >= BUCKET_COUNT - 1:
+        return float('inf')
+    octave, sub = divmod(index - 1, SUB_BUCKETS)
+    width = (1 << octave) / SUB_BUCKETS
+    return (1 << octave) + (sub + 1) * width
+
+
+class LatencyHistogram:
+    """Log-bucketed latency histogram with constant memory"""
+
+    def __init__(self):
+        self.buckets = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, ns):
+        self.buckets[bucket_index(ns)] += 1
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def percentile_us(self, fraction):
+        """Upper bound of the bucket holding the given percentile, in microseconds"""
+        if not self.count:
+            return 0.0
+        threshold = fraction * self.count
+        seen = 0
+        for index, hits in enumerate(self.buckets):
+            seen += hits
+            if seen >= threshold:
+                return min(bucket_upper_us(index), self.max_ns / 1000)
+        return self.max_ns / 1000
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean_us': self.total_ns / self.count / 1000 if self.count else 0.0,
+            'p50_us': self.percentile_us(0.50),
+            'p95_us': self.percentile_us(0.95),
+            'p99_us': self.percentile_us(0.99),
+            'max_us': self.max_ns / 1000,
+            # Sparse [upper bound us, count] pairs, enough to merge dumps later
+            'buckets': [
+                [bucket_upper_us(index), hits]
+                for index, hits in enumerate(self.buckets) if hits
+            ],
+        }
+
+
+class Stats:
+    """Process-wide engine statistics"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.__lock = threading.Lock()
+        self.latency = collections.defaultdict(LatencyHistogram)
+        self.counters = collections.Counter()
+        self.dictionary_loads = collections.deque(maxlen=LOAD_HISTORY)
+
+    def record_latency(self, mode, key_class, ns):
+        """Record how long handling one event of ``key_class`` took in ``mode``; any thread"""
+        with self.__lock:
+            self.latency[(mode, key_class)].record(ns)
+
+    def count(self, name, amount=1):
+        """Add to counter ``name``; the main loop and the conversion thread both count"""
+        with self.__lock:
+            self.counters[name] += amount
+
+    def record_dictionary_load(self, path, ms, keys):
+        """Record a dictionary load; may be called from the loader thread"""
+        with self.__lock:
+            self.dictionary_loads.append({
+                'path': path,
+                'ms': ms,
+                'keys': keys,
+                'at': time.time(),
+            })
+
+    def snapshot(self):
+        """Return every statistic as a JSON-serializable dict"""
+        latency = {}
+        with self.__lock:
+            for (mode, key_class), histogram in sorted(self.latency.items()):
+                latency.setdefault(mode, {})[key_class] = histogram.to_dict()
+            counters = dict(sorted(self.counters.items()))
+            loads = list(self.dictionary_loads)
+        return {
+            'pid': os.getpid(),
+            'uptime_s': time.time() - self.started_at,
+            'latency': latency,
+            'counters': counters,
+            'dictionary_loads': loads,
+        }
+
+    def reset(self):
+        with self.__lock:
+            self.latency.clear()
+            self.counters.clear()
+
+
+STATS = Stats()
+
+
+def output_path(kind, suffix, directory=None):
+    """
+    Return a timestamped path for a diagnostics file.
+
+    Args:
+        kind (str): File kind, e.g. "stats" or "profile"
+        suffix (str): File name suffix including the dot
+        directory (str): Output directory; defaults to THAIME_STATS_DIR,
+            then XDG_RUNTIME_DIR, then the system temporary directory
+
+    Returns:
+        str: The path, e.g. /run/user/1000/thaime-stats-1234-20250101-120000.json
+    """
+    directory = directory or env_str('THAIME_STATS_DIR') or env_str('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(directory, f"thaime-{kind}-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}{suffix}")
+
+
+def dump_stats(extra=None, directory=None):
+    """
+    Write a statistics snapshot as JSON.
+
+    Args:
+        extra (dict): Additional top-level entries for the snapshot
+        directory (str): Output directory, see ``output_path``
+
+    Returns:
+        str: Path of the written file
+    """
+    snapshot = STATS.snapshot()
+    if extra:
+        snapshot.update(extra)
+
+    path = output_path('stats', '.json', directory)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f, indent=2)
+    logger.info(f"Statistics written to {path}")
+    return path
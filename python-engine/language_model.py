@@ -0,0 +1,410 @@
+"""
+Thaime Language Model
+
+This module provides the word n-gram model used to rerank candidates by
+the words just before the cursor. It is built from a word-segmented Thai
+corpus, stored in the same kind of flat, mmap-able file as the compiled
+dictionary, and queried in place.
+
+Scores are stupid-backoff log probabilities quantized to one byte each.
+Bigrams are stored per first word, and trigrams per bigram entry, so a
+query is at most three binary searches over small sorted runs.
+
+The file is a section file (see section_file.py) whose format-specific
+header byte holds the n-gram order and whose item count is the vocabulary
+size.
+
+Sections:
+
+    VOCAB_OFFSETS    uint32[words + 1]    offsets into VOCAB_BLOB
+    VOCAB_BLOB       bytes                UTF-8 words, sorted
+    UNIGRAM_SCORES   uint8[words]         quantized log P(w)
+    BIGRAM_OFFSETS   uint32[words + 1]    bigram range of each first word
+    BIGRAM_WORDS     uint32[bigrams]      second word, sorted per first word
+    BIGRAM_SCORES    uint8[bigrams]       quantized log P(w2 | w1)
+    TRIGRAM_OFFSETS  uint32[bigrams + 1]  trigram range of each bigram entry
+    TRIGRAM_WORDS    uint32[trigrams]     third word, sorted per bigram
+    TRIGRAM_SCORES   uint8[trigrams]      quantized log P(w3 | w1 w2)
+"""
+
+import array
+import collections
+import getopt
+import math
+import os
+import sys
+
+from section_file import SectionFormat
+
+MAGIC = b'THLM'
+FORMAT_VERSION = 1
+
+# Section name and array typecode, in file order
+SECTIONS = (
+    ('vocab_offsets', 'I'),
+    ('vocab_blob', 'B'),
+    ('unigram_scores', 'B'),
+    ('bigram_offsets', 'I'),
+    ('bigram_words', 'I'),
+    ('bigram_scores', 'B'),
+    ('trigram_offsets', 'I'),
+    ('trigram_words', 'I'),
+    ('trigram_scores', 'B'),
+)
+
+# Quantization: a score byte q stands for the log probability -q * QUANT_STEP
+QUANT_STEP = 0.125
+QUANT_MAX = 255
+
+# Stupid backoff penalty for each order dropped
+BACKOFF = math.log(0.4)
+
+# Score of a word the model has never seen
+UNKNOWN_SCORE = -QUANT_MAX * QUANT_STEP + 2 * BACKOFF
+
+# Longest word tried when splitting surrounding text into words
+MAX_WORD_LENGTH = 24
+
+NO_WORD = -1
+
+
+class LanguageModelError(Exception):
+    """Raised when a language model file cannot be read or built"""
+
+
+FILE_FORMAT = SectionFormat(MAGIC, FORMAT_VERSION, SECTIONS, LanguageModelError, 'language model')
+
+
+def quantize(log_probability):
+    return min(QUANT_MAX, max(0, round(-log_probability / QUANT_STEP)))
+
+
+def split_words(line):
+    """Split a corpus line into words; both spaces and '|' separate words"""
+    return line.replace('|', ' ').split()
+
+
+class LanguageModel:
+    """Read-only word n-gram model backed by flat typed arrays"""
+
+    def __init__(self, sections, order, path=None, mapping=None):
+        self.path = path
+        self.order = order
+        self.__mapping = mapping
+        self.__sections = sections
+        for name, _ in SECTIONS:
+            setattr(self, f"_{name}", sections[name])
+        # Candidate words are looked up over and over; remember their ids. Only
+        # vocabulary words are kept, so the memo is bounded by the model and never
+        # holds fragments of surrounding text that missed
+        self.__ids = {}
+
+    ## ====================================================================== ##
+    ## CONSTRUCTION
+    ## ====================================================================== ##
+
+    @classmethod
+    def build(cls, sentences, order=3, min_count=2, path=None):
+        """
+        Count n-grams and build a model in memory.
+
+        Args:
+            sentences (iterable): Lists of words
+            order (int): 2 for bigrams, 3 for trigrams
+            min_count (int): Bigrams and trigrams seen fewer times are dropped
+            path (str): Source path, for diagnostics only
+
+        Returns:
+            LanguageModel: The in-memory model
+        """
+        if order not in (2, 3):
+            raise LanguageModelError(f"Unsupported n-gram order {order}")
+
+        unigrams = collections.Counter()
+        bigrams = collections.Counter()
+        trigrams = collections.Counter()
+        for words in sentences:
+            unigrams.update(words)
+            bigrams.update(zip(words, words[1:]))
+            if order == 3:
+                trigrams.update(zip(words, words[1:], words[2:]))
+
+        vocabulary = sorted(unigrams, key=lambda word: word.encode('utf-8'))
+        ids = {word: index for index, word in enumerate(vocabulary)}
+        total = sum(unigrams.values())
+
+        sections = {name: array.array(code) for name, code in SECTIONS}
+        vocab_blob = bytearray()
+        sections['vocab_offsets'].append(0)
+        for word in vocabulary:
+            vocab_blob += word.encode('utf-8')
+            sections['vocab_offsets'].append(len(vocab_blob))
+            sections['unigram_scores'].append(quantize(math.log(unigrams[word] / total)))
+        sections['vocab_blob'] = bytes(vocab_blob)
+
+        # Bigrams grouped by first word, then trigrams grouped by bigram entry
+        followers = collections.defaultdict(list)
+        for (first, second), count in bigrams.items():
+            if count >= min_count:
+                followers[ids[first]].append((ids[second], count))
+        extensions = collections.defaultdict(list)
+        for (first, second, third), count in trigrams.items():
+            if count >= min_count:
+                extensions[(ids[first], ids[second])].append((ids[third], count))
+
+        sections['bigram_offsets'].append(0)
+        sections['trigram_offsets'].append(0)
+        for first, word in enumerate(vocabulary):
+            for second, count in sorted(followers.get(first, ())):
+                sections['bigram_words'].append(second)
+                sections['bigram_scores'].append(quantize(math.log(count / unigrams[word])))
+                for third, trigram_count in sorted(extensions.get((first, second), ())):
+                    sections['trigram_words'].append(third)
+                    sections['trigram_scores'].append(
+                        quantize(math.log(trigram_count / bigrams[(word, vocabulary[second])]))
+                    )
+                sections['trigram_offsets'].append(len(sections['trigram_words']))
+            sections['bigram_offsets'].append(len(sections['bigram_words']))
+
+        return cls(sections, order, path=path)
+
+    @classmethod
+    def open(cls, path, verify=True):
+        """
+        Memory-map a language model file.
+
+        Args:
+            path (str): Path to the model
+            verify (bool): Check the body against the header checksum
+
+        Returns:
+            LanguageModel: The mapped model
+        """
+        mapping, sections, order = FILE_FORMAT.open(path, verify)
+        return cls(sections, order, path=path, mapping=mapping)
+
+    def save(self, path):
+        """Write the model in its binary format"""
+        FILE_FORMAT.save(path, self.__sections, self.order, len(self))
+
+    def close(self):
+        """Release the memory mapping, if any"""
+        if self.__mapping is None:
+            return
+        FILE_FORMAT.close(self.__mapping, self.__sections, self.path)
+        self.__mapping = None
+
+    ## ====================================================================== ##
+    ## QUERIES
+    ## ====================================================================== ##
+
+    def __len__(self):
+        return len(self._vocab_offsets) - 1
+
+    def word(self, word_id):
+        """Return the word with id ``word_id``"""
+        offsets = self._vocab_offsets
+        return str(self._vocab_blob[offsets[word_id]:offsets[word_id + 1]], 'utf-8')
+
+    def word_id(self, word):
+        """Return the id of ``word``, or NO_WORD"""
+        word_id = self.__ids.get(word)
+        if word_id is not None:
+            return word_id
+
+        encoded = word.encode('utf-8')
+        offsets = self._vocab_offsets
+        blob = self._vocab_blob
+        lo, hi = 0, len(self)
+        word_id = NO_WORD
+        while lo < hi:
+            mid = (lo + hi) // 2
+            probe = bytes(blob[offsets[mid]:offsets[mid + 1]])
+            if probe < encoded:
+                lo = mid + 1
+            elif probe > encoded:
+                hi = mid
+            else:
+                word_id = mid
+                break
+        if word_id != NO_WORD:
+            self.__ids[word] = word_id
+        return word_id
+
+    @staticmethod
+    def __find(words, lo, hi, word_id):
+        """Return the index of ``word_id`` in the sorted run words[lo:hi], or -1"""
+        while lo < hi:
+            mid = (lo + hi) // 2
+            probe = words[mid]
+            if probe < word_id:
+                lo = mid + 1
+            elif probe > word_id:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def score(self, context, word_id):
+        """
+        Return the backed-off log probability of a word after its context.
+
+        Args:
+            context (tuple): Ids of the preceding words, oldest first; only
+                the last ``order - 1`` are used, NO_WORD entries cut it short
+            word_id (int): Id of the scored word
+
+        Returns:
+            float: Log probability, never above 0
+        """
+        if word_id == NO_WORD:
+            return UNKNOWN_SCORE
+        previous = context[-1] if context else NO_WORD
+        if previous == NO_WORD:
+            return -self._unigram_scores[word_id] * QUANT_STEP
+
+        bigram = self.__find(
+            self._bigram_words, self._bigram_offsets[previous],
+            self._bigram_offsets[previous + 1], word_id
+        )
+        if bigram < 0:
+            return 2 * BACKOFF - self._unigram_scores[word_id] * QUANT_STEP
+
+        first = context[-2] if self.order == 3 and len(context) >= 2 else NO_WORD
+        if first != NO_WORD:
+            # Trigrams hang off the bigram entry of their first two words
+            pair = self.__find(
+                self._bigram_words, self._bigram_offsets[first],
+                self._bigram_offsets[first + 1], previous
+            )
+            if pair >= 0:
+                trigram = self.__find(
+                    self._trigram_words, self._trigram_offsets[pair],
+                    self._trigram_offsets[pair + 1], word_id
+                )
+                if trigram >= 0:
+                    return -self._trigram_scores[trigram] * QUANT_STEP
+        return BACKOFF - self._bigram_scores[bigram] * QUANT_STEP
+
+    def context_ids(self, words):
+        """Return the ids of the last ``order - 1`` of ``words``"""
+        return tuple(self.word_id(word) for word in tuple(words)[-(self.order - 1):])
+
+    def context_gain(self, context, word):
+        """How much more likely ``word`` is after ``context`` than on its own, in log units"""
+        word_id = self.word_id(word)
+        if word_id == NO_WORD or not context:
+            return 0.0
+        return self.score(context, word_id) - self.score((), word_id)
+
+    def last_words(self, text, count):
+        """
+        Split the end of unsegmented Thai ``text`` into up to ``count`` words.
+
+        Matches the longest known word ending at the end of the text, then
+        repeats before it, skipping whitespace; stops at text the model does
+        not know.
+
+        Returns:
+            list: Words, oldest first
+        """
+        words = []
+        end = len(text)
+        while len(words) < count:
+            while end > 0 and text[end - 1].isspace():
+                end -= 1
+            if end == 0:
+                break
+            for start in range(max(0, end - MAX_WORD_LENGTH), end):
+                candidate = text[start:end]
+                if not candidate[0].isspace() and self.word_id(candidate) != NO_WORD:
+                    words.append(candidate)
+                    end = start
+                    break
+            else:
+                break
+        words.reverse()
+        return words
+
+
+def rerank(model, candidates, context, weight=1.0):
+    """
+    Reorder (word, frequency) candidates by frequency and context.
+
+    Args:
+        model (LanguageModel): The model, or None to keep the order
+        candidates (list): (word, frequency) pairs
+        context (tuple): Word ids from ``LanguageModel.context_ids``
+        weight (float): Weight of the context gain against log frequency
+
+    Returns:
+        list: The candidates, best first
+    """
+    if model is None or not context or len(candidates) < 2:
+        return candidates
+    return sorted(
+        candidates,
+        key=lambda item: math.log(max(item[1], 1)) + weight * model.context_gain(context, item[0]),
+        reverse=True
+    )
+
+
+def build_model(corpus_path, output_path, order=3, min_count=2):
+    """Build a model from a word-segmented corpus, one sentence per line"""
+    with open(corpus_path, 'r', encoding='utf-8') as f:
+        model = LanguageModel.build(
+            (split_words(line) for line in f), order=order, min_count=min_count, path=corpus_path
+        )
+    model.save(output_path)
+    return model
+
+
+## ========================================================================== ##
+## COMMAND LINE
+## ========================================================================== ##
+
+def print_help(out, v=0):
+    print("Usage: language_model.py [options] CORPUS.txt OUTPUT.bin", file=out)
+    print("CORPUS.txt holds one sentence per line, words separated by spaces or '|'.", file=out)
+    print("    --order N          2 for bigrams, 3 for trigrams (default 3).", file=out)
+    print("-m, --min-count N      drop n-grams seen fewer times (default 2).", file=out)
+    print("-h, --help             show this message.", file=out)
+    sys.exit(v)
+
+def main():
+    order = 3
+    min_count = 2
+
+    shortopt = "m:h"
+    longopt = ["order=", "min-count=", "help"]
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], shortopt, longopt)
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        print_help(sys.stderr, 1)
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print_help(sys.stdout)
+        elif o == "--order":
+            order = int(a)
+        elif o in ("-m", "--min-count"):
+            min_count = int(a)
+
+    if len(args) != 2:
+        print_help(sys.stderr, 1)
+
+    corpus_path, output_path = args
+    try:
+        model = build_model(corpus_path, output_path, order, min_count)
+    except (OSError, LanguageModelError) as err:
+        print(str(err), file=sys.stderr)
+        sys.exit(1)
+
+    print(f"Built a {model.order}-gram model of {len(model)} words, {len(model._bigram_words)} bigrams "
+          f"and {len(model._trigram_words)} trigrams into {output_path} "
+          f"({os.path.getsize(output_path)} bytes)")
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,31 @@
+import copy
 import getopt
 import locale
 import logging
+import logging.handlers
 import os
+import queue
+import signal
 import sys
 
 import gi
 gi.require_version('IBus', '1.0')
 
+import engine
 import factory
+from config import env_flag, env_int, env_str
+from conversion_client import CONVERSION_CLIENT
+from profiling import PROFILER
+from reloader import DictionaryReloader
+from user_learning import USER_FREQUENCIES
 from gi.repository import GLib, IBus
 
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+DEFAULT_LOG_LEVEL = 'INFO'
+
 
 class IMApp:
     def __init__(self, exec_by_ibus):
-        # Setup logging
-        logging.basicConfig(
-            level=logging.DEBUG,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
         self.logger = logging.getLogger('thaime')
         self.logger.info("Starting Thaime")
         
@@ -49,7 +57,24 @@ class IMApp:
         self.__mainloop = GLib.MainLoop()
         self.__bus = IBus.Bus()
         self.__bus.connect("disconnected", self.__bus_disconnected_cb)
+
+        # `kill -USR1 <pid>` dumps key latency statistics as JSON
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1, self.__dump_stats_cb)
+        # `kill -USR2 <pid>` starts a profile capture, or stops the running one
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR2, self.__toggle_profile_cb)
+
+        # THAIME_PROFILE=<seconds> profiles the first seconds after startup
+        profile_seconds = env_int('THAIME_PROFILE', 0)
+        if profile_seconds > 0:
+            PROFILER.start(profile_seconds)
         
+        # Reload the dictionary when trie.json or trie.bin changes on disk; a conversion
+        # server watches them itself
+        self.__reloader = None
+        if env_flag('THAIME_HOT_RELOAD', True) and CONVERSION_CLIENT is None:
+            self.__reloader = DictionaryReloader(engine.DICTIONARY_DIR)
+            self.__reloader.start()
+
         # Create engine factory
         self.__factory = factory.EngineFactory(self.__bus)
         
@@ -63,11 +88,61 @@ class IMApp:
     def run(self):
         self.logger.info("Running main loop")
         self.__mainloop.run()
+        if self.__reloader is not None:
+            self.__reloader.stop()
 
     def __bus_disconnected_cb(self, bus):
         self.logger.info("Bus disconnected, quitting")
         self.__mainloop.quit()
 
+    def __dump_stats_cb(self):
+        engine.dump_engine_stats()
+        return True
+
+    def __toggle_profile_cb(self):
+        PROFILER.toggle()
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that leaves message formatting to the listener thread"""
+
+    def prepare(self, record):
+        # The stock prepare() formats the message and traceback on the calling thread;
+        # log arguments here are plain values, safe to format later on the listener
+        return copy.copy(record)
+
+
+def setup_logging(level_name):
+    """
+    Route all log records through a queue to a background writer thread.
+
+    The thread calling the logger only enqueues the record; formatting and
+    stderr I/O happen on the listener thread, off the GLib main loop.
+
+    Args:
+        level_name (str): Logging level name, e.g. "DEBUG" or "WARNING"
+
+    Returns:
+        logging.handlers.QueueListener: The started listener, stop it on exit
+    """
+    level = logging.getLevelName(level_name.upper())
+    if not isinstance(level, int):
+        print(f"Unknown log level: {level_name}", file=sys.stderr)
+        level = logging.getLevelName(DEFAULT_LOG_LEVEL)
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
 
 def launch_engine(exec_by_ibus):
     app = IMApp(exec_by_ibus)
@@ -77,6 +152,8 @@ def print_help(out, v=0):
     print("-i, --ibus             executed by ibus.", file=out)
     print("-h, --help             show this message.", file=out)
     print("-d, --daemonize        daemonize ibus", file=out)
+    print("-l, --log-level=LEVEL  log level (DEBUG, INFO, WARNING, ERROR), default from", file=out)
+    print("                       THAIME_LOG_LEVEL or INFO. DEBUG logs every keystroke.", file=out)
     sys.exit(v)
 
 def main():
@@ -87,9 +164,10 @@ def main():
 
     exec_by_ibus = False
     daemonize = False
+    log_level = env_str('THAIME_LOG_LEVEL', DEFAULT_LOG_LEVEL)
 
-    shortopt = "ihd"
-    longopt = ["ibus", "help", "daemonize"]
+    shortopt = "ihdl:"
+    longopt = ["ibus", "help", "daemonize", "log-level="]
 
     try:
         opts, args = getopt.getopt(sys.argv[1:], shortopt, longopt)
@@ -104,6 +182,8 @@ def main():
             daemonize = True
         elif o in ("-i", "--ibus"):
             exec_by_ibus = True
+        elif o in ("-l", "--log-level"):
+            log_level = a
         else:
             print("Unknown argument: %s" % o, file=sys.stderr)
             print_help(sys.stderr, 1)
@@ -112,7 +192,14 @@ def main():
         if os.fork():
             sys.exit()
 
-    launch_engine(exec_by_ibus)
+    # Start the writer thread after forking, threads do not survive fork()
+    listener = setup_logging(log_level)
+    try:
+        launch_engine(exec_by_ibus)
+    finally:
+        # Write learned frequencies still waiting for the debounce
+        USER_FREQUENCIES.close()
+        listener.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,226 @@
+"""
+Thaime Runtime Profiling
+
+This module captures cProfile and tracemalloc data from the running engine
+for a bounded window, without restarting it. A capture writes three files
+next to the statistics dumps:
+
+    thaime-profile-<pid>-<time>.prof       cProfile data, for pstats/snakeviz
+    thaime-profile-<pid>-<time>.snapshot   tracemalloc snapshot
+    thaime-profile-<pid>-<time>.txt        summary of the top functions and
+                                           allocators, with allocations
+                                           attributed to engine.py methods
+
+The conversion worker runs its jobs through ``run_profiled``, so the
+candidate computation done off the main loop is part of the capture.
+"""
+
+import cProfile
+import inspect
+import io
+import linecache
+import logging
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+
+from gi.repository import GLib
+from instrumentation import output_path
+
+logger = logging.getLogger('thaime.profiling')
+
+# Default and maximum capture window, in seconds
+DEFAULT_DURATION = 30
+MAX_DURATION = 600
+
+# Stack depth kept per allocation, deep enough to reach the engine frames
+TRACEMALLOC_FRAMES = 32
+
+# Rows in each table of the text summary
+TOP_ROWS = 20
+
+ENGINE_FILE = 'engine.py'
+
+# From 3.12 a profiler sees every thread; before, only the thread that enabled it
+PER_THREAD = sys.version_info < (3, 12)
+
+
+def engine_method_ranges():
+    """Return (first line, last line, qualified name) for each function in engine.py"""
+    import engine
+
+    ranges = []
+    for owner in (engine, engine.Engine):
+        for name, member in vars(owner).items():
+            function = inspect.unwrap(member.fget if isinstance(member, property) else member)
+            code = getattr(function, '__code__', None)
+            if code is None or not code.co_filename.endswith(ENGINE_FILE):
+                continue
+            lines = [line for _, _, line in code.co_lines() if line is not None]
+            if owner is engine.Engine:
+                # Undo name mangling so private methods read as written
+                qualified = f"Engine.{name.removeprefix('_Engine')}"
+            else:
+                qualified = name
+            ranges.append((code.co_firstlineno, max(lines, default=code.co_firstlineno), qualified))
+    return sorted(ranges)
+
+
+class ProfileSession:
+    """One cProfile + tracemalloc capture at a time, stopped after a fixed window"""
+
+    def __init__(self):
+        self.__profiler = None
+        self.__timeout_source = 0
+        self.__started_tracemalloc = False
+        # Profilers of other threads, by thread id; guarded with the jobs they time
+        self.__lock = threading.Lock()
+        self.__thread_profilers = {}
+
+    @property
+    def running(self):
+        return self.__profiler is not None
+
+    def start(self, duration=DEFAULT_DURATION):
+        """Start a capture that stops by itself after ``duration`` seconds"""
+        if self.running:
+            logger.warning("Profiling already running")
+            return False
+
+        duration = max(1, min(int(duration), MAX_DURATION))
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self.__started_tracemalloc = True
+        tracemalloc.clear_traces()
+
+        # The GLib main loop; other threads profile themselves in run_profiled
+        profiler = cProfile.Profile()
+        profiler.enable()
+        with self.__lock:
+            self.__profiler = profiler
+        self.__timeout_source = GLib.timeout_add_seconds(duration, self.__timeout_cb)
+        logger.info(f"Profiling started for {duration} s")
+        return True
+
+    def stop(self):
+        """Stop the capture and write its files; return the base path, or None"""
+        if not self.running:
+            return None
+
+        # Waits for a job being profiled on another thread to finish
+        with self.__lock:
+            profiler, self.__profiler = self.__profiler, None
+            thread_profilers, self.__thread_profilers = self.__thread_profilers, {}
+        profiler.disable()
+        stats = pstats.Stats(profiler)
+        for thread_profiler in thread_profilers.values():
+            stats.add(thread_profiler)
+        if self.__timeout_source:
+            GLib.source_remove(self.__timeout_source)
+            self.__timeout_source = 0
+
+        snapshot = tracemalloc.take_snapshot()
+        if self.__started_tracemalloc:
+            tracemalloc.stop()
+            self.__started_tracemalloc = False
+
+        base_path = output_path('profile', '')
+        try:
+            stats.dump_stats(f"{base_path}.prof")
+            snapshot.dump(f"{base_path}.snapshot")
+            with open(f"{base_path}.txt", 'w', encoding='utf-8') as f:
+                f.write(self.summarize(stats, snapshot))
+        except OSError as err:
+            logger.error(f"Could not write profile: {err}")
+            return None
+
+        logger.info(f"Profile written to {base_path}.prof/.snapshot/.txt")
+        return base_path
+
+    def run_profiled(self, function, *args):
+        """Call ``function(*args)`` from a thread other than the main loop, profiled during a capture"""
+        if not PER_THREAD or self.__profiler is None:
+            return function(*args)
+        with self.__lock:
+            if self.__profiler is None:
+                return function(*args)
+            thread_id = threading.get_ident()
+            profiler = self.__thread_profilers.get(thread_id)
+            if profiler is None:
+                profiler = self.__thread_profilers[thread_id] = cProfile.Profile()
+            profiler.enable()
+            try:
+                return function(*args)
+            finally:
+                profiler.disable()
+
+    def toggle(self, duration=DEFAULT_DURATION):
+        """Start a capture, or stop the running one early"""
+        if self.running:
+            self.stop()
+        else:
+            self.start(duration)
+
+    def __timeout_cb(self):
+        self.__timeout_source = 0
+        self.stop()
+        return False
+
+    ## ====================================================================== ##
+    ## SUMMARY
+    ## ====================================================================== ##
+
+    @staticmethod
+    def summarize(stats, snapshot):
+        """Render the text summary of a capture from its merged pstats.Stats"""
+        out = io.StringIO()
+
+        out.write("== Top functions by cumulative time ==\n")
+        stats.stream = out
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_ROWS)
+
+        out.write(f"== {ENGINE_FILE} functions by cumulative time ==\n")
+        stats.print_stats(ENGINE_FILE.replace('.', r'\.'), TOP_ROWS)
+
+        out.write("== Top allocating lines ==\n")
+        for stat in snapshot.statistics('lineno')[:TOP_ROWS]:
+            frame = stat.traceback[0]
+            out.write(f"{stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  "
+                      f"{frame.filename}:{frame.lineno}  "
+                      f"{linecache.getline(frame.filename, frame.lineno).strip()}\n")
+
+        out.write(f"\n== Allocations attributed to {ENGINE_FILE} methods ==\n")
+        for name, size, count in ProfileSession.attribute_allocations(snapshot)[:TOP_ROWS]:
+            out.write(f"{size / 1024:10.1f} KiB {count:8d} blocks  {name}\n")
+
+        return out.getvalue()
+
+    @staticmethod
+    def attribute_allocations(snapshot):
+        """
+        Group live allocations by the innermost engine.py method on their stack.
+
+        Returns:
+            list: (method name, bytes, blocks), largest first
+        """
+        ranges = engine_method_ranges()
+        totals = {}
+        for stat in snapshot.statistics('traceback'):
+            # Frames are ordered oldest call first; walk them from the allocation outwards
+            for frame in reversed(stat.traceback):
+                if os.path.basename(frame.filename) != ENGINE_FILE:
+                    continue
+                name = next(
+                    (qualified for first, last, qualified in ranges if first <= frame.lineno <= last),
+                    f"{ENGINE_FILE}:{frame.lineno}"
+                )
+                size, count = totals.get(name, (0, 0))
+                totals[name] = (size + stat.size, count + stat.count)
+                break
+        return sorted(((name, size, count) for name, (size, count) in totals.items()),
+                      key=lambda item: item[1], reverse=True)
+
+
+PROFILER = ProfileSession()
@@ -0,0 +1,211 @@
+"""
+Thaime Dictionary Registry
+
+This module keeps one copy of each dictionary per process. Engines acquire
+a dictionary by name instead of loading their own, the first acquire loads
+it, and the last release frees it. Loading can run on a worker thread so
+the GLib main loop keeps handling keys meanwhile. A dictionary can also be
+replaced while in use; listeners hear about the new one, and the old one
+lives on for as long as an engine still holds it.
+"""
+
+import logging
+import threading
+import time
+
+# Seconds a failed load, such as a missing optional file, is not retried
+MISSING_RETRY_S = 60.0
+
+logger = logging.getLogger('thaime.registry')
+
+
+class DictionaryRegistry:
+    """Process-wide, reference-counted dictionary store"""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__dictionaries = {}
+        self.__ref_counts = {}
+        # Callbacks waiting on dictionaries that are still loading, by name
+        self.__pending = {}
+        # Callbacks told about replacements, by name
+        self.__listeners = {}
+        # When loading each name last gave nothing, so engines built meanwhile skip the attempt
+        self.__missing = {}
+
+    def acquire(self, name, loader):
+        """
+        Return the dictionary registered as ``name``, loading it on first use.
+
+        Args:
+            name (str): Registry key, usually the dictionary directory
+            loader (callable): Zero-argument function returning the dictionary
+
+        Returns:
+            Dictionary: The shared dictionary
+        """
+        event = None
+        with self.__lock:
+            if name in self.__pending:
+                # Another caller is loading it already, wait for that load
+                event = threading.Event()
+                self.__pending[name].append(lambda dictionary: event.set())
+            elif name not in self.__dictionaries:
+                self.__dictionaries[name] = loader()
+                self.__ref_counts[name] = 0
+                logger.info(f"Dictionary '{name}' loaded")
+            self.__ref_counts[name] = self.__ref_counts.get(name, 0) + 1
+            logger.debug(f"Dictionary '{name}' shared by {self.__ref_counts[name]} engines")
+            if event is None:
+                return self.__dictionaries[name]
+        event.wait()
+        with self.__lock:
+            return self.__dictionaries.get(name)
+
+    def acquire_async(self, name, loader, callback):
+        """
+        Take a reference to ``name`` without blocking on the load.
+
+        If the dictionary is already loaded it is returned directly and
+        ``callback`` is never called. Otherwise None is returned and
+        ``callback(dictionary)`` runs on the loader thread once the load
+        finishes; the callback must hand the result back to its own thread.
+        A load that gave None less than MISSING_RETRY_S ago is not repeated:
+        ``callback(None)`` is called right away, on the calling thread.
+
+        Args:
+            name (str): Registry key, usually the dictionary directory
+            loader (callable): Zero-argument function returning the dictionary
+            callback (callable): Called with the dictionary when it is ready
+
+        Returns:
+            Dictionary: The shared dictionary, or None while it is loading
+        """
+        with self.__lock:
+            self.__ref_counts[name] = self.__ref_counts.get(name, 0) + 1
+            logger.debug(f"Dictionary '{name}' shared by {self.__ref_counts[name]} engines")
+            if name in self.__dictionaries:
+                return self.__dictionaries[name]
+            if name in self.__pending:
+                self.__pending[name].append(callback)
+                return None
+            missed_at = self.__missing.get(name)
+            missing = missed_at is not None and time.monotonic() - missed_at < MISSING_RETRY_S
+            if not missing:
+                self.__pending[name] = [callback]
+
+        if missing:
+            callback(None)
+            return None
+        thread = threading.Thread(
+            target=self.__load,
+            args=(name, loader),
+            name="thaime-dictionary-loader",
+            daemon=True
+        )
+        thread.start()
+        return None
+
+    def __load(self, name, loader):
+        try:
+            dictionary = loader()
+        except Exception:
+            logger.exception(f"Loading dictionary '{name}' failed")
+            dictionary = None
+
+        orphan = None
+        with self.__lock:
+            callbacks = self.__pending.pop(name)
+            if self.__ref_counts.get(name, 0) == 0:
+                # Every engine went away while the dictionary was loading
+                self.__ref_counts.pop(name, None)
+                orphan, dictionary, callbacks = dictionary, None, []
+            elif dictionary is not None:
+                self.__dictionaries[name] = dictionary
+                self.__missing.pop(name, None)
+                logger.info(f"Dictionary '{name}' loaded in the background")
+            else:
+                self.__missing[name] = time.monotonic()
+
+        if orphan is not None:
+            self.__close(name, orphan)
+        for callback in callbacks:
+            callback(dictionary)
+
+    def release(self, name):
+        """Drop one reference to ``name``, freeing the dictionary after the last one"""
+        with self.__lock:
+            if name not in self.__ref_counts:
+                logger.warning(f"Release of unknown dictionary '{name}'")
+                return
+            self.__ref_counts[name] -= 1
+            if self.__ref_counts[name] > 0 or name in self.__pending:
+                # Still shared, or still loading; the loader thread cleans up
+                logger.debug(f"Dictionary '{name}' shared by {self.__ref_counts[name]} engines")
+                return
+            dictionary = self.__dictionaries.pop(name, None)
+            del self.__ref_counts[name]
+            self.__missing.pop(name, None)
+        self.__close(name, dictionary)
+
+    def replace(self, name, dictionary):
+        """
+        Make ``dictionary`` the one shared as ``name`` and tell the listeners.
+
+        The previous dictionary is not closed: engines in the middle of a
+        composition keep using it, and it is freed with the last reference.
+
+        Args:
+            name (str): Registry key, usually the dictionary directory
+            dictionary (Dictionary): The replacement
+
+        Returns:
+            bool: False if no engine holds ``name``, in which case the
+                replacement is closed and nothing changes
+        """
+        with self.__lock:
+            if name not in self.__dictionaries:
+                held = False
+            else:
+                held = True
+                self.__dictionaries[name] = dictionary
+                self.__missing.pop(name, None)
+                listeners = list(self.__listeners.get(name, ()))
+        if not held:
+            self.__close(name, dictionary)
+            return False
+        logger.info(f"Dictionary '{name}' replaced")
+        for listener in listeners:
+            listener(dictionary)
+        return True
+
+    def add_listener(self, name, callback):
+        """Call ``callback(dictionary)`` whenever ``name`` is replaced, on the replacing thread"""
+        with self.__lock:
+            self.__listeners.setdefault(name, []).append(callback)
+
+    def remove_listener(self, name, callback):
+        with self.__lock:
+            listeners = self.__listeners.get(name, [])
+            if callback in listeners:
+                listeners.remove(callback)
+            if not listeners:
+                self.__listeners.pop(name, None)
+
+    @staticmethod
+    def __close(name, dictionary):
+        if dictionary is None:
+            return
+        logger.info(f"Dictionary '{name}' no longer used, freeing it")
+        close = getattr(dictionary, 'close', None)
+        if close is not None:
+            close()
+
+    def share_counts(self):
+        """Return how many engines share each loaded dictionary"""
+        with self.__lock:
+            return dict(self.__ref_counts)
+
+
+# Shared by every engine in the process
+DICTIONARIES = DictionaryRegistry()
@@ -0,0 +1,206 @@
+"""
+Thaime Dictionary Reloader
+
+This module provides hot reloading of the shared dictionary. A GIO monitor
+watches the dictionary directory; once ``trie.json`` or ``trie.bin`` has
+settled after a change, a background thread recompiles ``trie.json`` when
+it is newer than ``trie.bin`` and opens the result. The new dictionary is
+handed to the registry on the GLib main loop, so it is swapped in between
+key events, and each engine moves over once its current composition ends.
+
+Compiling runs ``dictionary.py`` in a child process: parsing a large JSON
+file holds the interpreter lock for seconds, which would stall every key
+handled in the meantime. Opening the compiled file is a memory map.
+"""
+
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import gi
+gi.require_version('Gio', '2.0')
+
+from gi.repository import Gio, GLib
+from dictionary import DictionaryError, load_dictionary
+from instrumentation import STATS
+from registry import DICTIONARIES
+
+JSON_FILE = 'trie.json'
+BINARY_FILE = 'trie.bin'
+
+# Quiet time after the last file event before reloading, in milliseconds
+RELOAD_DELAY_MS = 500
+
+COMPILER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dictionary.py')
+
+# The compiler runs at a lower priority so keys keep the CPU on a busy machine
+NICE = shutil.which('nice')
+NICENESS = 10
+
+# Events after which a file may hold new content; CHANGED fires throughout a write
+RELOAD_EVENTS = frozenset((
+    Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+    Gio.FileMonitorEvent.CREATED,
+    Gio.FileMonitorEvent.MOVED_IN,
+    Gio.FileMonitorEvent.RENAMED,
+))
+
+logger = logging.getLogger('thaime.reloader')
+
+
+def file_signature(directory):
+    """(mtime_ns, size) of each dictionary file, None where missing"""
+    signature = []
+    for file_name in (JSON_FILE, BINARY_FILE):
+        try:
+            stat = os.stat(os.path.join(directory, file_name))
+        except FileNotFoundError:
+            signature.append(None)
+        else:
+            signature.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def json_is_newer(signature):
+    """Whether trie.json exists and was written after trie.bin, or trie.bin is missing"""
+    json_stat, bin_stat = signature
+    return json_stat is not None and (bin_stat is None or json_stat[0] > bin_stat[0])
+
+
+def compile_dictionary(json_path, bin_path):
+    """Compile ``json_path`` into ``bin_path`` in a child process; return an error message, or None"""
+    logger.info(f"Compiling {json_path}")
+    command = [sys.executable, COMPILER, json_path, bin_path]
+    if NICE is not None:
+        command = [NICE, '-n', str(NICENESS)] + command
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        return result.stderr.decode('utf-8', 'replace').strip()
+    return None
+
+
+class DictionaryReloader:
+    """Watches a dictionary directory and replaces the shared dictionary when it changes"""
+
+    def __init__(self, directory, delay_ms=RELOAD_DELAY_MS):
+        """
+        Args:
+            directory (str): Dictionary directory, also the registry key
+            delay_ms (int): Quiet time after the last file event before reloading
+        """
+        self.directory = directory
+        self.delay_ms = delay_ms
+        self.__monitor = None
+        self.__timeout_source = 0
+        self.__signature = None
+        self.__running = False
+        self.__again = False
+        # Timings of the last finished reload, for diagnostics
+        self.last_reload = None
+        self.reloads = 0
+
+    def start(self):
+        """Start watching; the files as they are now count as loaded"""
+        self.__signature = file_signature(self.directory)
+        directory = Gio.File.new_for_path(self.directory)
+        self.__monitor = directory.monitor_directory(Gio.FileMonitorFlags.WATCH_MOVES, None)
+        self.__monitor.connect('changed', self.__changed_cb)
+        logger.info(f"Watching {self.directory} for dictionary changes")
+
+    def stop(self):
+        if self.__monitor is not None:
+            self.__monitor.cancel()
+            self.__monitor = None
+        if self.__timeout_source:
+            GLib.source_remove(self.__timeout_source)
+            self.__timeout_source = 0
+
+    def __changed_cb(self, monitor, file, other_file, event_type):
+        if event_type not in RELOAD_EVENTS:
+            return
+        names = {file.get_basename()}
+        if other_file is not None:
+            names.add(other_file.get_basename())
+        if not names & {JSON_FILE, BINARY_FILE}:
+            return
+        # Editors and compilers write in several steps; wait for the last one
+        if self.__timeout_source:
+            GLib.source_remove(self.__timeout_source)
+        self.__timeout_source = GLib.timeout_add(self.delay_ms, self.__reload_timeout)
+
+    def __reload_timeout(self):
+        self.__timeout_source = 0
+        self.reload()
+        return False
+
+    def reload(self):
+        """Rebuild and reload in the background if the files changed since the last load"""
+        if self.__running:
+            # Look again once the reload in progress is done
+            self.__again = True
+            return
+        self.__running = True
+        self.__again = False
+        thread = threading.Thread(target=self.__rebuild, name='thaime-dictionary-reload', daemon=True)
+        thread.start()
+
+    def __rebuild(self):
+        """Reload thread: compile if needed, open, and hand the result to the main loop"""
+        start = time.perf_counter()
+        signature = file_signature(self.directory)
+        result = (None, signature, None)
+        try:
+            if signature != self.__signature:
+                result = self.__build(start, signature)
+        except Exception:
+            logger.exception(f"Could not reload the dictionary from {self.directory}")
+        finally:
+            # Always, or no later change would ever be reloaded
+            GLib.idle_add(self.__finished, *result)
+
+    def __build(self, start, signature):
+        """Compile and open the changed files; return (dictionary or None, signature, timings)"""
+        json_path = os.path.join(self.directory, JSON_FILE)
+        bin_path = os.path.join(self.directory, BINARY_FILE)
+        timings = {'compile_ms': 0.0}
+        if json_is_newer(signature):
+            message = compile_dictionary(json_path, bin_path)
+            timings['compile_ms'] = (time.perf_counter() - start) * 1000
+            if message is not None:
+                logger.error(f"Could not compile {json_path}, keeping the current dictionary: {message}")
+                return None, signature, None
+            # Our own write of trie.bin must not trigger another reload
+            signature = file_signature(self.directory)
+
+        open_start = time.perf_counter()
+        try:
+            dictionary = load_dictionary(bin_path if os.path.exists(bin_path) else json_path)
+        except (OSError, DictionaryError) as err:
+            logger.error(f"Could not reload the dictionary from {self.directory}: {err}")
+            return None, signature, None
+        timings['open_ms'] = (time.perf_counter() - open_start) * 1000
+        timings['started'] = start
+        return dictionary, signature, timings
+
+    def __finished(self, dictionary, signature, timings):
+        """Main loop: swap the new dictionary in between key events"""
+        self.__running = False
+        self.__signature = signature
+        if dictionary is not None:
+            # Counted first: with no engine holding the directory, the replacement is closed
+            keys = len(dictionary)
+            DICTIONARIES.replace(self.directory, dictionary)
+            total_ms = (time.perf_counter() - timings.pop('started')) * 1000
+            self.last_reload = dict(timings, total_ms=total_ms, keys=keys)
+            self.reloads += 1
+            STATS.count('dictionary_reloads')
+            STATS.record_dictionary_load(self.directory, total_ms, keys)
+            logger.info(f"Reloaded {keys} dictionary keys in {total_ms:.1f} ms "
+                        f"(compile {timings['compile_ms']:.1f} ms, open {timings['open_ms']:.1f} ms)")
+        if self.__again:
+            self.reload()
+        return False
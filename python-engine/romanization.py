@@ -0,0 +1,294 @@
+"""
+Thaime Romanization Normalization
+
+This module maps the spelling variants of romanized Thai onto one canonical
+spelling, so the dictionary stores each key once and any variant the user
+types still finds it. Normalization runs when a dictionary is built and on
+the live preedit, with the same rules.
+
+Rules rewrite one or two characters into fewer, matched from the left and
+reapplied to their own output. That keeps the transducer streaming: a typed
+character only rewrites the tail of the output, and each step records how
+to undo itself, so BackSpace costs the same as typing.
+
+It also provides ``romanize``, which spells a Thai word the way it is typed
+in phonetic mode, for building dictionaries from Thai text. The spelling is
+RTGS-like and rule-based: syllables are read from their consonants and
+vowel signs, with the implicit vowels and silent letters of common words.
+Tone is not written. Where it guesses wrong, a pronunciation lexicon given
+to the dictionary builder takes precedence.
+"""
+
+import re
+
+# Variant -> canonical spelling. Right sides are shorter, so rewriting ends
+RULES = {
+    # Aspirated consonants are written with or without the h
+    'ph': 'p',
+    'th': 't',
+    'kh': 'k',
+    # Vowel length is often not marked
+    'aa': 'a',
+    'ii': 'i',
+    'ee': 'i',
+    'oo': 'o',
+    'uu': 'u',
+}
+
+# Rules for dictionaries built without normalization
+IDENTITY = {}
+
+
+class Normalizer:
+    """
+    Streaming rule transducer from typed romanization to canonical spelling.
+
+    ``push`` and ``pop`` return the edit they made to the canonical text as
+    (removed, added) strings, removed from its end first, so trie cursors
+    that follow the canonical text can replay it character by character.
+    """
+
+    def __init__(self, rules=RULES):
+        self.rules = rules
+        self.__output = []
+        # (removed, added) canonical edit of every push
+        self.__undo = []
+
+    def push(self, char):
+        """Feed one typed character; return the (removed, added) canonical edit"""
+        output = self.__output
+        # Output before ``kept`` is untouched by this push
+        kept = len(output)
+        removed = ''
+        output.extend(self.rules.get(char, char))
+
+        # A rewrite can complete a pair with the character before it, so keep
+        # rewriting the tail; the output never holds a rule's left side and
+        # normalizing twice changes nothing
+        while len(output) >= 2 and output[-2] + output[-1] in self.rules:
+            start = len(output) - 2
+            if start < kept:
+                removed = ''.join(output[start:kept]) + removed
+                kept = start
+            pair = output[-2] + output[-1]
+            del output[-2:]
+            output.extend(self.rules[pair])
+
+        added = ''.join(output[kept:])
+        self.__undo.append((removed, added))
+        return removed, added
+
+    def pop(self):
+        """Undo the last push; return the (removed, added) canonical edit"""
+        if not self.__undo:
+            return '', ''
+        removed, added = self.__undo.pop()
+        if added:
+            del self.__output[-len(added):]
+        self.__output.extend(removed)
+        # The inverse edit: take back what was added, restore what was removed
+        return added, removed
+
+    def reset(self):
+        self.__output.clear()
+        self.__undo.clear()
+
+    @property
+    def text(self):
+        """The canonical spelling of everything pushed so far"""
+        return ''.join(self.__output)
+
+    def __len__(self):
+        return len(self.__undo)
+
+
+def normalize(text, rules=RULES):
+    """Return the canonical spelling of ``text``"""
+    normalizer = Normalizer(rules)
+    for char in text:
+        normalizer.push(char)
+    return normalizer.text
+
+
+def normalize_entries(entries, rules=RULES):
+    """
+    Merge dictionary entries whose keys share a canonical spelling.
+
+    A word listed under several variants keeps its highest frequency, since
+    variant keys usually repeat the same corpus count.
+
+    Args:
+        entries (dict): Romanized key -> list of [thai_word, frequency]
+
+    Returns:
+        dict: Canonical key -> list of [thai_word, frequency]
+    """
+    merged = {}
+    for key, candidates in entries.items():
+        words = merged.setdefault(normalize(key, rules), {})
+        for word, freq in candidates:
+            if freq > words.get(word, float('-inf')):
+                words[word] = freq
+    return {
+        key: [[word, freq] for word, freq in words.items()]
+        for key, words in merged.items()
+    }
+
+
+## ========================================================================== ##
+## THAI TO ROMAN
+## ========================================================================== ##
+
+# Bumped whenever romanize() spells any word differently
+ROMANIZER_VERSION = 1
+
+INITIALS = {
+    'ก': 'k', 'ข': 'kh', 'ฃ': 'kh', 'ค': 'kh', 'ฅ': 'kh', 'ฆ': 'kh', 'ง': 'ng', 'จ': 'ch',
+    'ฉ': 'ch', 'ช': 'ch', 'ซ': 's', 'ฌ': 'ch', 'ญ': 'y', 'ฎ': 'd', 'ฏ': 't', 'ฐ': 'th',
+    'ฑ': 'th', 'ฒ': 'th', 'ณ': 'n', 'ด': 'd', 'ต': 't', 'ถ': 'th', 'ท': 'th', 'ธ': 'th',
+    'น': 'n', 'บ': 'b', 'ป': 'p', 'ผ': 'ph', 'ฝ': 'f', 'พ': 'ph', 'ฟ': 'f', 'ภ': 'ph',
+    'ม': 'm', 'ย': 'y', 'ร': 'r', 'ล': 'l', 'ว': 'w', 'ศ': 's', 'ษ': 's', 'ส': 's',
+    'ห': 'h', 'ฬ': 'l', 'อ': '', 'ฮ': 'h',
+}
+
+FINALS = {
+    'ก': 'k', 'ข': 'k', 'ค': 'k', 'ฆ': 'k', 'ง': 'ng', 'จ': 't', 'ช': 't', 'ซ': 't',
+    'ฌ': 't', 'ญ': 'n', 'ฎ': 't', 'ฏ': 't', 'ฐ': 't', 'ฑ': 't', 'ฒ': 't', 'ณ': 'n',
+    'ด': 't', 'ต': 't', 'ถ': 't', 'ท': 't', 'ธ': 't', 'น': 'n', 'บ': 'p', 'ป': 'p',
+    'พ': 'p', 'ฟ': 'p', 'ภ': 'p', 'ม': 'm', 'ย': 'i', 'ร': 'n', 'ล': 'n', 'ว': 'w',
+    'ศ': 't', 'ษ': 't', 'ส': 't', 'ฬ': 'n',
+}
+
+# Second consonants of initial clusters, and the first consonants each follows
+CLUSTERS = {
+    'ร': frozenset('กขคตปพบด'),
+    'ล': frozenset('กขคปพผบ'),
+    'ว': frozenset('กขค'),
+}
+
+# Leading ห and อ are silent before these, only marking the tone
+SILENT_LEADS = {'ห': frozenset('งญนมยรลว'), 'อ': frozenset('ย')}
+
+LEADING_VOWELS = frozenset('เแโใไ')
+
+# Signs after a consonant that make it the initial of a syllable
+FOLLOWING_VOWELS = frozenset('ะัาำิีึืุู็')
+
+# Vowel spellings after the initial consonant, longest first, per leading
+# vowel: (spelling, sound, whether a final consonant may follow)
+VOWELS = {
+    '': (('ัว', 'ua', False), ('ั', 'a', True), ('ะ', 'a', False), ('า', 'aa', True),
+         ('ำ', 'am', False), ('ิ', 'i', True), ('ี', 'ee', True), ('ึ', 'ue', True),
+         ('ือ', 'ue', False), ('ื', 'ue', True), ('ุ', 'u', True), ('ู', 'uu', True),
+         ('็อ', 'o', True), ('็', 'o', False)),
+    'เ': (('ีย', 'ia', True), ('ือ', 'uea', True), ('าะ', 'o', False), ('า', 'ao', False),
+          ('ิ', 'oe', True), ('อ', 'oe', False), ('ย', 'oei', False), ('ะ', 'e', False),
+          ('็', 'e', True), ('', 'e', True)),
+    'แ': (('ะ', 'ae', False), ('็', 'ae', True), ('', 'ae', True)),
+    'โ': (('ะ', 'o', False), ('', 'o', True)),
+    'ใ': (('', 'ai', False),),
+    'ไ': (('', 'ai', True),),
+}
+
+# Tone marks change nothing in the spelling; a consonant under the
+# cancellation mark, with a following ร and a vowel on it, is not read
+TONE_MARKS = re.compile('[่-๋ๆฯ]')
+SILENCED = re.compile('(?:[ทต]ร|[ก-ฮ])[ิุ]?์')
+THAI_WORD = re.compile('[ก-ฮะ-ฺเ-ๅ็-์]+')
+
+
+def is_consonant(char):
+    return 'ก' <= char <= 'ฮ' and char not in 'ฤฦ'
+
+
+def romanize(word):
+    """
+    Spell a Thai word in the roman letters typed for it in phonetic mode.
+
+    Args:
+        word (str): A Thai word
+
+    Returns:
+        str: The romanized key, or None if ``word`` is not plain Thai
+    """
+    if THAI_WORD.fullmatch(word) is None:
+        return None
+    text = SILENCED.sub('', TONE_MARKS.sub('', word))
+    n = len(text)
+
+    def starts_syllable(j):
+        """Whether the consonant at ``j`` is the initial of a syllable with a written vowel"""
+        return j + 1 < n and (text[j + 1] in FOLLOWING_VOWELS or text[j + 1] == 'อ')
+
+    output = []
+    i = 0
+    while i < n:
+        char = text[i]
+        if char in 'ฤฦ':
+            output.append('rue' if char == 'ฤ' else 'lue')
+            i += 1
+            if i < n and text[i] == 'ๅ':
+                i += 1
+            continue
+
+        # Leading vowel, then the initial consonant with its silent lead or cluster
+        leading = ''
+        if char in LEADING_VOWELS:
+            leading = char
+            i += 1
+            if i >= n:
+                return None
+            char = text[i]
+        if not is_consonant(char):
+            return None
+        i += 1
+        if i < n and text[i] in SILENT_LEADS.get(char, ()) and (leading or starts_syllable(i)):
+            char = text[i]
+            i += 1
+        initial = INITIALS[char]
+        if i < n and char in CLUSTERS.get(text[i], ()) and (leading or starts_syllable(i)):
+            initial += INITIALS[text[i]]
+            i += 1
+
+        # Written vowel, else the implicit one
+        vowel = None
+        for spelling, sound, closed in VOWELS[leading]:
+            # อ and ย are only vowels when no vowel sign follows them
+            if text.startswith(spelling, i) and not (spelling in ('อ', 'ย') and starts_syllable(i)):
+                vowel = sound
+                i += len(spelling)
+                break
+        if vowel is None:
+            closed = True
+            if text.startswith('อ', i) and not starts_syllable(i):
+                vowel = 'o'
+                i += 1
+            elif text.startswith('ว', i) and i + 1 < n and is_consonant(text[i + 1]) \
+                    and not starts_syllable(i + 1):
+                vowel = 'ua'
+                i += 1
+            elif text.startswith('รร', i):
+                vowel = 'a' if i + 2 < n else 'an'
+                i += 2
+            elif i < n and is_consonant(text[i]) and (starts_syllable(i) or i + 2 == n):
+                # The next consonant starts a syllable of its own: a short, open a
+                vowel = 'a'
+                closed = False
+            elif i < n and is_consonant(text[i]):
+                vowel = 'o'
+            else:
+                vowel = 'a'
+                closed = False
+        output.append(initial + vowel)
+
+        # Final consonant, unless it starts the next syllable
+        if not closed or i >= n or not is_consonant(text[i]) or starts_syllable(i):
+            continue
+        if i + 2 < n and text[i] in CLUSTERS.get(text[i + 1], ()) and starts_syllable(i + 1):
+            continue
+        final = FINALS.get(text[i], '')
+        # A written y after a vowel that already ends in it adds nothing
+        if not (final == 'i' and vowel.endswith(('i', 'ia'))):
+            output.append(final)
+        i += 1
+    return ''.join(output)
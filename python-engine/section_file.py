@@ -0,0 +1,172 @@
+"""
+Thaime Section Files
+
+This module provides the flat, mmap-able file container shared by the
+compiled dictionary and the language model. A file is a header, a table
+of sections, and the sections themselves, which are typed arrays mapped
+in place, so opening a file costs a header check instead of a parse.
+
+File layout (all integers in the byte order recorded in the header):
+
+    header      magic, format version, byte order, a format-specific byte,
+                crc32, item count, section count
+    sections    (offset, length) pair for each section, offsets absolute
+    data        each section padded to an 8-byte boundary
+"""
+
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import zlib
+
+# magic, version, byte order, format-specific byte, crc32, item count, section count
+HEADER = struct.Struct('=4sHBBIII')
+SECTION = struct.Struct('=QQ')
+ALIGNMENT = 8
+
+BYTE_ORDERS = {'little': 0, 'big': 1}
+
+logger = logging.getLogger('thaime.section_file')
+
+
+class SectionFormat:
+    """One kind of section file: its magic, version, sections and how it reports errors"""
+
+    def __init__(self, magic, version, sections, error, kind, hint=''):
+        """
+        Args:
+            magic (bytes): Four bytes identifying the kind of file
+            version (int): Format version written and accepted
+            sections (tuple): (name, array typecode) pairs in file order,
+                'B' for raw bytes
+            error (type): Exception raised for unreadable files
+            kind (str): What the file holds, for messages
+            hint (str): Appended to the message of a version mismatch
+        """
+        self.magic = magic
+        self.version = version
+        self.sections = sections
+        self.error = error
+        self.kind = kind
+        self.hint = hint
+
+    def open(self, path, verify=True):
+        """
+        Memory-map a file of this format.
+
+        Args:
+            path (str): Path to the file
+            verify (bool): Check the body against the header checksum
+
+        Returns:
+            tuple: The mapping, a dict of section name -> memoryview, and
+                the format-specific header byte
+        """
+        with open(path, 'rb') as f:
+            try:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as err:
+                raise self.error(f"Empty {self.kind} file {path}") from err
+
+        try:
+            sections, extra = self.__map_sections(mapping, path, verify)
+        except Exception:
+            mapping.close()
+            raise
+        return mapping, sections, extra
+
+    def __map_sections(self, mapping, path, verify):
+        if len(mapping) < HEADER.size:
+            raise self.error(f"Truncated {self.kind} header in {path}")
+
+        magic, version, byte_order, extra, checksum, _, count = HEADER.unpack_from(mapping, 0)
+        if magic != self.magic:
+            raise self.error(f"Not a Thaime {self.kind}: {path}")
+        if version != self.version:
+            raise self.error(
+                f"{self.kind.capitalize()} {path} has format version {version}, "
+                f"expected {self.version}{self.hint}"
+            )
+        if byte_order != BYTE_ORDERS[sys.byteorder]:
+            raise self.error(f"{self.kind.capitalize()} {path} was built for another byte order")
+        if count != len(self.sections):
+            raise self.error(
+                f"{self.kind.capitalize()} {path} has {count} sections, expected {len(self.sections)}"
+            )
+
+        view = memoryview(mapping)
+        if verify and zlib.crc32(view[HEADER.size:]) != checksum:
+            view.release()
+            raise self.error(f"Checksum mismatch in {self.kind} {path}")
+
+        sections = {}
+        table_end = HEADER.size + SECTION.size * count
+        for index, (name, code) in enumerate(self.sections):
+            offset, length = SECTION.unpack_from(mapping, HEADER.size + SECTION.size * index)
+            if offset < table_end or offset + length > len(mapping):
+                for section in sections.values():
+                    section.release()
+                view.release()
+                raise self.error(f"Section {name} out of bounds in {path}")
+            sections[name] = view[offset:offset + length].cast(code)
+        view.release()
+        return sections, extra
+
+    def save(self, path, sections, extra, count):
+        """
+        Write a file of this format.
+
+        Args:
+            path (str): Destination, replaced atomically
+            sections (dict): Section name -> array, bytes or memoryview
+            extra (int): Format-specific header byte
+            count (int): Item count recorded in the header
+        """
+        payloads = []
+        for name, code in self.sections:
+            data = sections[name]
+            payloads.append(bytes(data) if code == 'B' else data.tobytes())
+
+        offset = HEADER.size + SECTION.size * len(self.sections)
+        table = bytearray()
+        body = bytearray()
+        for payload in payloads:
+            padding = -(offset + len(body)) % ALIGNMENT
+            body += bytes(padding)
+            table += SECTION.pack(offset + len(body), len(payload))
+            body += payload
+
+        checksum = zlib.crc32(body, zlib.crc32(table))
+        header = HEADER.pack(
+            self.magic, self.version, BYTE_ORDERS[sys.byteorder], extra,
+            checksum, count, len(self.sections)
+        )
+
+        # Write to a temporary file first so readers never see a partial file; its name
+        # is unique, so a reload and a startup recompile of the same file cannot clobber it
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path) or '.', prefix=f"{os.path.basename(path)}.", suffix='.tmp'
+        )
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                os.fchmod(f.fileno(), 0o644)
+                f.write(header)
+                f.write(table)
+                f.write(body)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def close(self, mapping, sections, path):
+        """Release the section views and the mapping of an opened file"""
+        for name, _ in self.sections:
+            sections[name].release()
+        try:
+            mapping.close()
+        except BufferError:
+            # Someone still holds a view; the mapping goes away with it
+            logger.debug(f"{self.kind.capitalize()} {path} still referenced, deferring unmap")
@@ -0,0 +1,135 @@
+"""
+Thaime Phrase Segmenter
+
+This module provides an incremental lattice decoder that splits romanized
+input typed without spaces into dictionary keys and returns the best
+full-phrase conversions.
+
+Each typed character adds one lattice column. The column keeps the trie
+nodes of every dictionary key that may still end at or after it, so a new
+character only advances those nodes instead of re-scanning the preedit.
+Their number is bounded by the longest dictionary key, which keeps the
+cost of a keystroke flat however long the phrase grows. BackSpace drops
+the last column.
+
+A phrase scores the sum of its words' log frequencies, each word taking
+away WORD_PENALTY, so segmentations with fewer, more common words win.
+"""
+
+import heapq
+import math
+
+from dictionary import NO_NODE, ROOT
+
+# Partial phrases kept per lattice column
+DEFAULT_BEAM = 8
+
+# Candidates of each dictionary key considered as lattice edges
+WORDS_PER_KEY = 4
+
+# Log frequency taken away per word, roughly the log of the corpus size
+WORD_PENALTY = math.log(1_000_000)
+
+
+class Segmenter:
+    """
+    Viterbi-style beam decoder over the preedit, one column per character.
+
+    Column ``i`` holds the best partial phrases covering the first ``i``
+    characters as (score, start column, rank in start column, word),
+    best first. Column 0 holds the empty phrase.
+    """
+
+    def __init__(self, dictionary, beam=DEFAULT_BEAM):
+        self.dictionary = dictionary
+        self.beam = beam
+        self.__paths = [[(0.0, -1, -1, '')]]
+        # (start column, trie node) of the keys still growing at each column
+        self.__active = [()]
+
+    def push(self, char):
+        """Extend the lattice by one character; return whether a phrase ends here"""
+        dictionary = self.dictionary
+        paths = self.__paths
+        end = len(paths)
+
+        # Advance every live key by the new character, and start one here
+        active = []
+        for start, node in self.__active[-1] + ((end - 1, ROOT),):
+            if not paths[start]:
+                # Nothing reaches this start, so no phrase can use the key
+                continue
+            node = dictionary.walk(node, char)
+            if node != NO_NODE:
+                active.append((start, node))
+
+        # Join the keys that end here to the best phrases before them
+        column = []
+        for start, node in active:
+            index = dictionary.node_key(node)
+            if index < 0:
+                continue
+            for word, freq in dictionary.candidates(index)[:WORDS_PER_KEY]:
+                score = math.log(max(freq, 1)) - WORD_PENALTY
+                for rank, path in enumerate(paths[start]):
+                    column.append((path[0] + score, start, rank, word))
+
+        paths.append(heapq.nlargest(self.beam, column, key=lambda path: path[0]))
+        self.__active.append(tuple(active))
+        return bool(paths[-1])
+
+    def pop(self):
+        """Step back over the last pushed character"""
+        if len(self.__paths) > 1:
+            self.__paths.pop()
+            self.__active.pop()
+
+    def reset(self):
+        del self.__paths[1:]
+        del self.__active[1:]
+
+    @property
+    def length(self):
+        return len(self.__paths) - 1
+
+    @property
+    def is_alive(self):
+        """Whether a phrase can still cover the input once more characters are typed"""
+        # A new key starts only where a phrase ends, so with neither left no column fills again
+        return bool(self.__paths[-1] or self.__active[-1])
+
+    def phrase(self, column, rank):
+        """Return the words of the partial phrase at ``rank`` in ``column``"""
+        words = []
+        while column > 0:
+            _, start, previous, word = self.__paths[column][rank]
+            words.append(word)
+            column, rank = start, previous
+        words.reverse()
+        return words
+
+    def phrases(self, limit):
+        """
+        Return the best conversions of the whole input.
+
+        Args:
+            limit (int): Maximum number of phrases
+
+        Returns:
+            list: (words, score) pairs, best first, distinct by joined text
+        """
+        results = []
+        seen = set()
+        end = len(self.__paths) - 1
+        if end == 0:
+            return results
+        for rank, path in enumerate(self.__paths[end]):
+            words = self.phrase(end, rank)
+            text = ''.join(words)
+            if text in seen:
+                continue
+            seen.add(text)
+            results.append((words, path[0]))
+            if len(results) >= limit:
+                break
+        return results
@@ -2,9 +2,24 @@
 Thai Kedmanee Keyboard Layout Mapping
 
 This module provides the standard Thai Kedmanee layout mapping from
-ANSI-QWERTY keyboard layout to Thai characters.
+ANSI-QWERTY keyboard layout to Thai characters, converters between the two
+built on ``str.translate``, and a command line tool repairing text typed
+with the wrong layout active.
+
+The tool streams files or standard input in fixed-size chunks, so memory
+stays constant however large the input is. With ``--detect`` it judges each
+line on its own and converts only the lines that read better in the other
+layout, judged by Thai spelling rules on one side and the shape of English
+words on the other.
 """
 
+import getopt
+import io
+import os
+import re
+import sys
+import tempfile
+
 # Thai Kedmanee layout mapping
 # Maps ANSI-QWERTY keys to Thai characters
 KEDMANEE_KEYMAP = {
@@ -121,6 +136,192 @@ KEDMANEE_KEYMAP = {
 # Create reverse mapping for potential future use
 REVERSE_KEDMANEE_KEYMAP = {v: k for k, v in KEDMANEE_KEYMAP.items()}
 
+# Both layouts fit below the end of the Thai block
+TABLE_SIZE = 0x0E80
+
+def translation_table(keymap):
+    """
+    Build a ``str.translate`` table from a character mapping.
+
+    The table is a tuple indexed by code point rather than a dict, which
+    translates about twice as fast; code points past its end raise
+    IndexError, which ``str.translate`` treats as unmapped.
+
+    Args:
+        keymap (dict): Character to character mapping
+
+    Returns:
+        tuple: Code point of the replacement of each code point
+    """
+    table = list(range(TABLE_SIZE))
+    for key, value in keymap.items():
+        table[ord(key)] = ord(value)
+    return tuple(table)
+
+QWERTY_TO_THAI_TABLE = translation_table(KEDMANEE_KEYMAP)
+THAI_TO_QWERTY_TABLE = translation_table(REVERSE_KEDMANEE_KEYMAP)
+
+# Characters read per chunk when converting a stream
+CHUNK_SIZE = 1 << 20
+
+# How much more plausible the other layout must read before a line is converted
+DETECT_THRESHOLD = 0.5
+
+# Thai characters one misplaced mark counts against, roughly a syllable
+MISPLACED_WEIGHT = 4
+
+## ========================================================================== ##
+## WRONG LAYOUT DETECTION
+## ========================================================================== ##
+
+THAI_CHAR = re.compile('[ก-๛]')
+ASCII_LETTER = re.compile('[A-Za-z]')
+ASCII_ALNUM = re.compile('[A-Za-z0-9]')
+
+# Thai spelling that no correctly typed word contains: vowel and tone marks
+# without a consonant to sit on, following vowels out of place, leading
+# vowels not followed by a consonant, letters only old or Pali spelling uses,
+# and digits or symbols inside a word; shifted keys produce the last two. Each
+# character is matched before what precedes it is looked at, so the regex
+# skips ahead to candidates quickly
+THAI_MISPLACED = re.compile('(?=[ัิ-ฺ็่-๎าำๅะเ-ไฦ๐-๙()"+_?,])(?:' + '|'.join((
+    '[ัิ-ฺ็](?<![ก-ฮ].)',
+    '[่-๎](?<![ก-ฮัิ-ู].)',
+    '[าำๅ](?<![ก-ฮ่-๋].)',
+    'ะ(?<![ก-ฮา่-๋].)',
+    '[เ-ไ](?![ก-ฮ])',
+    '[ฦฺํ]',
+    '[๐-๙](?<=[ก-๏].)',
+    '[๐-๙](?=[ก-๏])',
+    '[()"+_?,](?<=[ก-๏].)(?=[ก-๏])',
+)) + ')')
+
+# An English word or number, with the punctuation that may surround it; apostrophes
+# only join short endings ("don't", "we're")
+ENGLISH_WORD = re.compile(
+    r"""["'(\[{<*#@$]*"""
+    r"""(?:[A-Za-z]+(?:['’][A-Za-z]{1,2}|-[A-Za-z]+)*|[0-9]+(?:[.,:/-][0-9]+)*(?:%|[a-z]{1,2})?)"""
+    r"""["')\]}>.,;:!?*]*"""
+)
+# Addresses and code are neither, but were typed in the layout they are in;
+# Thai typed on QWERTY keys has no underscores, which the Thai layout shifts
+ADDRESS = re.compile(
+    r'[A-Za-z][A-Za-z0-9+.-]*://\S*|www\.\S+|[\w.+-]+@[\w-]+\.[\w.-]+'
+    r'|\S*[A-Za-z0-9]_\S*|\S*_[A-Za-z0-9]\S*'
+)
+# Attribute chains and calls, "self.version" or "f.flush()"; checked for English letter pairs
+DOTTED_NAME = re.compile(r'[(\[]*[A-Za-z]+(?:\.[A-Za-z]{2,})+(?:\(\S*\))?[)\]:,;]*')
+# Capitalized parts run together, "GLib" or "CandidateStream"
+CAMEL_CASE = re.compile('[A-Z]*[a-z]{2,}(?:[A-Z]+[a-z]{2,})*[A-Z]*')
+ENGLISH_VOWEL = re.compile('[aeiouyAEIOUY]')
+# Letter pairs no common lowercase English word contains; Thai typed on QWERTY keys is full of them
+ENGLISH_UNSEEN = re.compile('|'.join((
+    'j[bcdfghjklmnpqrstvwxz]', 'q[^u]', 'v[bcdfghjkmnpqtwxz]', 'x[bdfgjkmnqrvwxz]',
+    '[bcfghkmpwz][qvxz]',
+)))
+
+# Lines of nothing but correctly spelled Thai words and plain English words and
+# numbers; most lines are, and matching one regex spares judging word by word
+PLAIN_WORD = (
+    r"""["'(\[]*"""
+    r"""(?:[ก-๛]+"""
+    r"""|(?=[A-Za-z]*[aeiouyAEIOUY])(?:[A-Z]?[a-z]+|[A-Z]+)|[A-Z]?[a-z]{1,2}|[A-Z]{1,3}"""
+    r"""|[0-9]+(?:[.,:][0-9]+)*)"""
+    r"""["')\].,;:!?]*"""
+)
+PLAIN_LINE = re.compile(rf'\s*(?:{PLAIN_WORD}\s+)*(?:{PLAIN_WORD}\s*)?')
+
+
+def is_english_word(word):
+    """Whether ``word`` is shaped like English: one case pattern, vowels, no stray symbols"""
+    if ENGLISH_WORD.fullmatch(word) is None:
+        if ADDRESS.fullmatch(word) is not None:
+            return True
+        return DOTTED_NAME.fullmatch(word) is not None and ENGLISH_UNSEEN.search(word) is None
+    letters = ''.join(ASCII_LETTER.findall(word))
+    if not letters:
+        return True
+    if not (letters.islower() or letters.isupper() or letters[1:].islower()
+            or CAMEL_CASE.fullmatch(letters)):
+        return False
+    if ENGLISH_UNSEEN.search(word) is not None:
+        return False
+    # Short words without vowels are abbreviations ("pm", "BTW"); longer ones are not English
+    return len(letters) <= 3 or ENGLISH_VOWEL.search(letters) is not None
+
+
+def implausibility(text):
+    """
+    Share of ``text`` that reads as neither correct Thai nor English.
+
+    Thai words are judged by their misplaced marks, other words by their
+    shape; a word mixing Thai and Latin letters counts as wrong entirely.
+
+    Args:
+        text (str): A line of text
+
+    Returns:
+        float: 0.0 for text that reads well, up to 1.0 for gibberish
+    """
+    bad = 0
+    total = 0
+    for word in text.split():
+        thai = len(THAI_CHAR.findall(word))
+        if thai:
+            if ASCII_LETTER.search(word):
+                bad += len(word)
+                total += len(word)
+            else:
+                bad += min(thai, MISPLACED_WEIGHT * len(THAI_MISPLACED.findall(word)))
+                total += thai
+        elif ASCII_ALNUM.search(word):
+            if not is_english_word(word):
+                bad += len(word)
+            total += len(word)
+    return bad / total if total else 0.0
+
+
+def other_layout(line):
+    """``line`` as it would read had it been typed with the other layout active"""
+    if len(THAI_CHAR.findall(line)) > len(ASCII_LETTER.findall(line)):
+        return thai_to_qwerty(line)
+    return qwerty_to_thai(line)
+
+
+def layout_score(line):
+    """
+    Score whether ``line`` was typed with the wrong layout active.
+
+    Args:
+        line (str): A line of text
+
+    Returns:
+        tuple: (score, converted) where score is how much more plausible
+            ``converted``, the line in the other layout, reads; positive
+            means the other layout is the better reading
+    """
+    converted = other_layout(line)
+    return implausibility(line) - implausibility(converted), converted
+
+
+def repair_line(line, threshold=DETECT_THRESHOLD):
+    """Return ``line`` converted to the other layout if it was typed in the wrong one, else None"""
+    if (PLAIN_LINE.fullmatch(line) and THAI_MISPLACED.search(line) is None
+            and ENGLISH_UNSEEN.search(line) is None):
+        return None
+    current = implausibility(line)
+    # The other reading scores at least 0, so it cannot win by more than this
+    if current < threshold:
+        return None
+    converted = other_layout(line)
+    if current - implausibility(converted) >= threshold:
+        return converted
+    return None
+
+## ========================================================================== ##
+## CONVERSION
+## ========================================================================== ##
+
 def qwerty_to_thai(text):
     """
     Convert QWERTY text to Thai using Kedmanee layout.
@@ -131,11 +332,7 @@ def qwerty_to_thai(text):
     Returns:
         str: Converted Thai text
     """
-    result = []
-    for char in text:
-        thai_char = KEDMANEE_KEYMAP.get(char, char)
-        result.append(thai_char)
-    return ''.join(result)
+    return text.translate(QWERTY_TO_THAI_TABLE)
 
 def thai_to_qwerty(text):
     """
@@ -147,8 +344,183 @@ def thai_to_qwerty(text):
     Returns:
         str: Converted QWERTY text
     """
-    result = []
-    for char in text:
-        qwerty_char = REVERSE_KEDMANEE_KEYMAP.get(char, char)
-        result.append(qwerty_char)
-    return ''.join(result)
\ No newline at end of file
+    return text.translate(THAI_TO_QWERTY_TABLE)
+
+def convert_stream(src, dst, table=QWERTY_TO_THAI_TABLE, chunk_size=CHUNK_SIZE):
+    """
+    Convert a text stream a chunk at a time.
+
+    Args:
+        src: Text file to read
+        dst: Text file to write
+        table (dict): QWERTY_TO_THAI_TABLE or THAI_TO_QWERTY_TABLE
+        chunk_size (int): Characters read at a time
+
+    Returns:
+        int: Characters converted
+    """
+    count = 0
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            return count
+        dst.write(chunk.translate(table))
+        count += len(chunk)
+
+def repair_stream(src, dst, threshold=DETECT_THRESHOLD, chunk_size=CHUNK_SIZE):
+    """
+    Copy a text stream, converting only the lines typed in the wrong layout.
+
+    Args:
+        src: Text file to read
+        dst: Text file to write
+        threshold (float): Score from which a line is converted
+        chunk_size (int): Characters read at a time; a line longer than
+            this is judged a piece at a time
+
+    Returns:
+        tuple: (lines, converted) counts
+    """
+    lines = 0
+    converted = 0
+    unfinished = ''
+    while True:
+        chunk = src.read(chunk_size)
+        pieces = (unfinished + chunk).splitlines(True)
+        unfinished = ''
+        if chunk and pieces:
+            last = pieces[-1]
+            # The last line may go on in the next chunk, and a '\r' there may be half of a '\r\n'
+            if last[-1] == '\r' or (last[-1] != '\n' and len(last) < chunk_size):
+                unfinished = pieces.pop()
+        for index, line in enumerate(pieces):
+            repaired = repair_line(line, threshold)
+            if repaired is not None:
+                pieces[index] = repaired
+                converted += 1
+        lines += len(pieces)
+        dst.write(''.join(pieces))
+        if not chunk:
+            return lines, converted
+
+def open_text(path, mode='r'):
+    """Open ``path``, or stdin/stdout for '-', as UTF-8 text that keeps undecodable bytes and line endings"""
+    if path == '-':
+        stream = sys.stdin.buffer if mode == 'r' else sys.stdout.buffer
+        return io.TextIOWrapper(stream, encoding='utf-8', errors='surrogateescape', newline='')
+    return open(path, mode, encoding='utf-8', errors='surrogateescape', newline='')
+
+def convert_files(sources, dst, table, detect, threshold, verbose):
+    """Convert each opened (path, stream) source into ``dst``"""
+    for path, src in sources:
+        if detect:
+            lines, converted = repair_stream(src, dst, threshold)
+            if verbose:
+                print(f"{path}: converted {converted} of {lines} lines", file=sys.stderr)
+        else:
+            count = convert_stream(src, dst, table)
+            if verbose:
+                print(f"{path}: converted {count} characters", file=sys.stderr)
+
+def write_replacing(path, write):
+    """
+    Call ``write`` with a text file that replaces ``path`` once it returns.
+
+    The output goes to a temporary file next to ``path``, so ``path`` keeps
+    its old content if anything fails, and may be one of the inputs.
+    """
+    directory = os.path.dirname(path) or '.'
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f"{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with open(fd, 'w', encoding='utf-8', errors='surrogateescape', newline='') as dst:
+            os.fchmod(dst.fileno(), mode)
+            write(dst)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+## ========================================================================== ##
+## COMMAND LINE
+## ========================================================================== ##
+
+def print_help(out, v=0):
+    print("Usage: thai_keymap.py [options] [FILE...]", file=out)
+    print("Converts text typed with the wrong keyboard layout; reads stdin without FILE.", file=out)
+    print("-r, --reverse          convert Thai to QWERTY instead of QWERTY to Thai.", file=out)
+    print("-d, --detect           convert only lines that read better in the other layout,", file=out)
+    print("                       in either direction.", file=out)
+    print("-t, --threshold X      score from which --detect converts a line (default 0.5).", file=out)
+    print("-o, --output FILE      write to FILE instead of stdout.", file=out)
+    print("-v, --verbose          report what was converted on stderr.", file=out)
+    print("-h, --help             show this message.", file=out)
+    sys.exit(v)
+
+def main():
+    table = QWERTY_TO_THAI_TABLE
+    detect = False
+    threshold = DETECT_THRESHOLD
+    output = '-'
+    verbose = False
+
+    shortopt = "rdt:o:vh"
+    longopt = ["reverse", "detect", "threshold=", "output=", "verbose", "help"]
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], shortopt, longopt)
+    except getopt.GetoptError as err:
+        print(str(err), file=sys.stderr)
+        print_help(sys.stderr, 1)
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print_help(sys.stdout)
+        elif o in ("-r", "--reverse"):
+            table = THAI_TO_QWERTY_TABLE
+        elif o in ("-d", "--detect"):
+            detect = True
+        elif o in ("-t", "--threshold"):
+            try:
+                threshold = float(a)
+            except ValueError:
+                threshold = None
+            if threshold is None or not 0.0 <= threshold <= 1.0:
+                print(f"Invalid threshold {a!r}, expected a number from 0 to 1", file=sys.stderr)
+                print_help(sys.stderr, 1)
+        elif o in ("-o", "--output"):
+            output = a
+        elif o in ("-v", "--verbose"):
+            verbose = True
+
+    sources = []
+    try:
+        # Every input must open before the output is touched
+        for path in args or ['-']:
+            sources.append((path, open_text(path)))
+        if output == '-':
+            dst = open_text(output, 'w')
+            try:
+                convert_files(sources, dst, table, detect, threshold, verbose)
+            finally:
+                dst.flush()
+                dst.detach()
+        else:
+            write_replacing(output, lambda dst: convert_files(sources, dst, table, detect, threshold, verbose))
+    except OSError as err:
+        print(str(err), file=sys.stderr)
+        sys.exit(1)
+    finally:
+        for path, src in sources:
+            if path == '-':
+                src.detach()
+            else:
+                src.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+"""
+Thaime User Learning
+
+This module provides the per-user frequency overlay. Every committed
+candidate adds weight to its word, and ranking multiplies dictionary
+frequencies by the weight, so words the user keeps picking move up. Weights
+decay by half every HALF_LIFE commits, and when the overlay outgrows its
+capacity the weakest words are evicted.
+
+The overlay lives in memory and is written to a JSON file by a background
+thread, a few seconds after the last change and at most every MAX_DELAY
+seconds while typing continues, so no keystroke waits on the disk. Writes
+go to a temporary file renamed over the old one, so a crash leaves either
+the old or the new overlay, never a torn one. The file is read once per
+process, on a thread of its own; picks made meanwhile are merged into it.
+"""
+
+import collections
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from config import env_int, env_str
+from instrumentation import STATS
+
+FORMAT_VERSION = 1
+FILE_NAME = 'user.json'
+
+# Words kept, and the share of them dropped at once when the overlay is full
+DEFAULT_CAPACITY = 10000
+EVICT_FRACTION = 0.1
+
+# Commits after which a pick counts half as much
+HALF_LIFE = 2000
+
+# Exponent of (1 + weight) applied to the dictionary frequency
+BOOST = 2.0
+
+# Seconds of quiet before a write, and the longest a change may stay unwritten
+FLUSH_DELAY = 3.0
+MAX_DELAY = 30.0
+
+# Changed words remembered, so rankings cached before a change can be kept unless they hold one
+CHANGE_LOG = 512
+
+logger = logging.getLogger('thaime.user')
+
+
+def default_path():
+    """Return the overlay path: THAIME_USER_DIR, else $XDG_DATA_HOME/thaime"""
+    directory = env_str('THAIME_USER_DIR')
+    if directory is None:
+        data_home = env_str('XDG_DATA_HOME', os.path.join(os.path.expanduser('~'), '.local', 'share'))
+        directory = os.path.join(data_home, 'thaime')
+    return os.path.join(directory, FILE_NAME)
+
+
+class UserFrequencies:
+    """In-memory word weight overlay with write-behind persistence"""
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY, half_life=HALF_LIFE,
+                 flush_delay=FLUSH_DELAY, max_delay=MAX_DELAY):
+        """
+        Args:
+            path (str): JSON file the overlay is loaded from and written to
+            capacity (int): Most words kept before decay-based eviction
+            half_life (int): Commits after which a weight has halved
+            flush_delay (float): Seconds without changes before writing
+            max_delay (float): Longest a change waits while changes keep coming
+        """
+        self.path = path
+        self.capacity = capacity
+        self.half_life = half_life
+        self.flush_delay = flush_delay
+        self.max_delay = max_delay
+
+        # word -> (weight, clock at last update); the weight decays from there
+        self.__words = {}
+        self.__clock = 0
+        # Bumped on every change; the words each version changed, oldest first,
+        # and the oldest version the log still covers
+        self.version = 0
+        self.__changes = collections.deque()
+        self.__changes_since = 0
+        self.__loaded = False
+        self.__loading = False
+
+        self.__condition = threading.Condition()
+        # Held for a whole write, by the writer thread or a direct flush()
+        self.__write_lock = threading.Lock()
+        self.__thread = None
+        self.__dirty = False
+        self.__first_change = 0.0
+        self.__last_change = 0.0
+        self.__closing = False
+        self.writes = 0
+
+    def __len__(self):
+        return len(self.__words)
+
+    ## ====================================================================== ##
+    ## LEARNING AND RANKING
+    ## ====================================================================== ##
+
+    def weight(self, word):
+        """Current decayed weight of ``word``, 0 if it was never picked"""
+        entry = self.__words.get(word)
+        if entry is None:
+            return 0.0
+        weight, clock = entry
+        return weight * 0.5 ** ((self.__clock - clock) / self.half_life)
+
+    def learn(self, word):
+        """Count one pick of ``word`` and schedule a write"""
+        with self.__condition:
+            self.__clock += 1
+            self.__words[word] = (self.weight(word) + 1.0, self.__clock)
+            changed = [word]
+            if len(self.__words) > self.capacity:
+                changed.extend(self.__evict())
+            self.version += 1
+            self.__log_changes(changed)
+            self.__mark_dirty()
+
+    def changed_since(self, version):
+        """
+        Return the words whose weight changed after ``version``.
+
+        Every pick also decays the other weights a little; that is not a
+        change, as it hardly moves one word past another.
+
+        Args:
+            version (int): An earlier value of ``version``
+
+        Returns:
+            tuple: The changed words, or None if any word may have changed,
+                and the current version
+        """
+        with self.__condition:
+            if version < self.__changes_since:
+                return None, self.version
+            words = {word for changed, word in self.__changes if changed > version}
+            return words, self.version
+
+    def __log_changes(self, words):
+        """Remember the words the current version changed; the caller holds the lock"""
+        for word in words:
+            self.__changes.append((self.version, word))
+        while len(self.__changes) > CHANGE_LOG:
+            self.__changes_since = self.__changes.popleft()[0]
+
+    def adjust(self, candidates):
+        """
+        Scale (word, frequency) candidates by their user weight.
+
+        Args:
+            candidates (list): (word, frequency) pairs, best first
+
+        Returns:
+            list: The pairs with adjusted frequencies, re-sorted; the same
+                list when none of the words was ever picked
+        """
+        words = self.__words
+        if not words or not any(word in words for word, _ in candidates):
+            return candidates
+        adjusted = []
+        for word, frequency in candidates:
+            weight = self.weight(word)
+            if weight:
+                frequency = max(frequency, 1) * (1.0 + weight) ** BOOST
+            adjusted.append((word, frequency))
+        adjusted.sort(key=lambda item: item[1], reverse=True)
+        return adjusted
+
+    def __evict(self):
+        """Drop the weakest share of the words, by decayed weight, and return them"""
+        # log2 of the weight scaled to a common clock; comparable without decaying each entry
+        count = max(1, int(self.capacity * EVICT_FRACTION))
+        weakest = heapq.nsmallest(
+            count, self.__words.items(),
+            key=lambda item: math.log2(item[1][0]) + item[1][1] / self.half_life
+        )
+        for word, _ in weakest:
+            del self.__words[word]
+        STATS.count('user_learning.evicted', count)
+        logger.debug(f"Evicted {count} user words, {len(self.__words)} left")
+        return [word for word, _ in weakest]
+
+    ## ====================================================================== ##
+    ## PERSISTENCE
+    ## ====================================================================== ##
+
+    def load_async(self):
+        """Read the overlay from disk once, on a thread of its own so no engine waits on the disk"""
+        with self.__condition:
+            if self.__loaded:
+                return
+            self.__loaded = True
+            self.__loading = True
+        threading.Thread(target=self.__load, name='thaime-user-loader', daemon=True).start()
+
+    def load(self):
+        """Read the overlay from disk once and wait for it; a missing or broken file starts it empty"""
+        self.load_async()
+        with self.__condition:
+            self.__condition.wait_for(lambda: not self.__loading)
+
+    def __load(self):
+        """Loader thread: read the file, then let writes through"""
+        try:
+            self.__read()
+        finally:
+            with self.__condition:
+                self.__loading = False
+                self.__condition.notify_all()
+
+    def __read(self):
+        """Merge the overlay on disk into memory; a missing or broken file leaves it as is"""
+        start = time.perf_counter()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            logger.info(f"No user frequencies at {self.path}, starting empty")
+            return
+        except (OSError, ValueError) as err:
+            logger.error(f"Error loading user frequencies from {self.path}: {err}")
+            return
+        if not isinstance(data, dict) or data.get('version') != FORMAT_VERSION:
+            logger.error(f"Ignoring user frequencies in {self.path}: unsupported format")
+            return
+        try:
+            clock = int(data['clock'])
+            words = {word: (float(weight), int(tick))
+                     for word, (weight, tick) in data['words'].items()}
+        except (AttributeError, KeyError, TypeError, ValueError) as err:
+            logger.error(f"Ignoring user frequencies in {self.path}: {err}")
+            return
+
+        with self.__condition:
+            # Picks made while the file was read come after the ones in it
+            for word, (weight, tick) in self.__words.items():
+                earlier = words.get(word)
+                if earlier is not None:
+                    weight += earlier[0] * 0.5 ** ((clock + tick - earlier[1]) / self.half_life)
+                words[word] = (weight, clock + tick)
+            self.__clock += clock
+            self.__words = words
+            while len(self.__words) > self.capacity:
+                self.__evict()
+            # Any word may have changed
+            self.version += 1
+            self.__changes.clear()
+            self.__changes_since = self.version
+            count = len(self.__words)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        logger.info(f"Loaded {count} user frequencies from {self.path} in {elapsed_ms:.1f} ms")
+
+    def __mark_dirty(self):
+        """Record a change and wake the writer; the caller holds the lock"""
+        now = time.monotonic()
+        if not self.__dirty:
+            self.__dirty = True
+            self.__first_change = now
+        self.__last_change = now
+        if self.__thread is None:
+            self.__thread = threading.Thread(
+                target=self.__writer, name='thaime-user-writer', daemon=True
+            )
+            self.__thread.start()
+        self.__condition.notify()
+
+    def __writer(self):
+        """Writer thread: wait for changes to settle, then write them"""
+        while True:
+            with self.__condition:
+                while not self.__dirty and not self.__closing:
+                    self.__condition.wait()
+                # Debounce: a burst of commits becomes one write
+                while self.__dirty and not self.__closing:
+                    deadline = min(self.__last_change + self.flush_delay,
+                                   self.__first_change + self.max_delay)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.__condition.wait(remaining)
+                closing = self.__closing
+            self.flush()
+            if closing:
+                return
+
+    def flush(self):
+        """Write pending changes now, if any, and wait for the write"""
+        # Snapshots are taken under the write lock, so a newer one is never overwritten by an older
+        with self.__write_lock:
+            # Entries are immutable tuples, so a shallow copy is a consistent snapshot;
+            # formatting it happens outside the lock the keystroke path takes
+            with self.__condition:
+                # Never replace the file with the picks of this process alone
+                self.__condition.wait_for(lambda: not self.__loading)
+                if not self.__dirty:
+                    return
+                clock = self.__clock
+                words = dict(self.__words)
+                self.__dirty = False
+
+            start = time.perf_counter()
+            snapshot = {
+                'version': FORMAT_VERSION,
+                'clock': clock,
+                'words': {word: [round(weight, 4), tick] for word, (weight, tick) in words.items()},
+            }
+            tmp_path = f"{self.path}.tmp"
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except OSError as err:
+                STATS.count('user_learning.write_errors')
+                logger.error(f"Could not write user frequencies to {self.path}: {err}")
+                with self.__condition:
+                    # Still all in memory; the writer tries again after the usual delay
+                    if not self.__dirty:
+                        self.__dirty = True
+                        self.__first_change = self.__last_change = time.monotonic()
+                return
+            self.writes += 1
+        STATS.count('user_learning.writes')
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        logger.debug(f"Wrote {len(snapshot['words'])} user frequencies to {self.path} in {elapsed_ms:.1f} ms")
+
+    def close(self):
+        """Stop the writer thread, writing anything still pending"""
+        with self.__condition:
+            self.__closing = True
+            self.__condition.notify()
+            thread = self.__thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+
+USER_FREQUENCIES = UserFrequencies(default_path(), capacity=env_int('THAIME_USER_WORDS', DEFAULT_CAPACITY))